@@ -0,0 +1 @@
+"""Offline benchmarks of simbot against local stand-ins of Slack and the ssh server."""
@@ -0,0 +1,88 @@
+"""
+Runs the benchmarks and optionally compares them with earlier results.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --quick --compare results.json
+
+Exits with status 1 if a result is worse than the baseline by more than the tolerance.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import slack_simbot
+from benchmarks.scenarios import SCENARIOS
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "version": slack_simbot.__version__,
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Prints the change of each result relative to the baseline and returns the regressed results."""
+    regressions = []
+    for scenario, metrics in results["results"].items():
+        for name, result in metrics.items():
+            old = baseline.get("results", {}).get(scenario, {}).get(name)
+            if old is None or not old["value"]:
+                continue
+            change = result["value"] / old["value"] - 1
+            worse = change > tolerance if result["better"] == "lower" else change < -tolerance
+            print("{:<40} {:>12.4g} {:>12.4g} {:>+8.1%} {}".format(
+                "{}.{}".format(scenario, name), old["value"], result["value"], change, "REGRESSION" if worse else ""))
+            if worse:
+                regressions.append("{}.{}".format(scenario, name))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline simbot benchmarks.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run. Can be given several times. Runs all if not given.")
+    parser.add_argument("--quick", action="store_true", help="Use smaller workloads.")
+    parser.add_argument("--output", help="Json file the results are written to.")
+    parser.add_argument("--compare", help="Json file with earlier results to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative change counted as a regression (default 0.2).")
+    args = parser.parse_args(argv)
+
+    results = {"meta": metadata(), "quick": args.quick, "results": {}}
+    for name in args.scenario or sorted(SCENARIOS):
+        print("Running {}...".format(name), file=sys.stderr)
+        results["results"][name] = SCENARIOS[name](quick=args.quick)
+        for metric, result in results["results"][name].items():
+            print("  {:<30} {:>12.4g} {}".format(metric, result["value"], result["unit"]), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("quick") != args.quick:
+            print("Warning: comparing quick and full runs.", file=sys.stderr)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
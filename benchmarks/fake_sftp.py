@@ -0,0 +1,175 @@
+"""This module contains a local ssh and sftp server stand-in used by the benchmarks."""
+
+import hashlib
+import os
+import re
+import shlex
+import socket
+import threading
+
+import paramiko
+from paramiko import SFTPServerInterface, SFTPServer, SFTPAttributes, SFTPHandle, SFTP_OK
+
+
+_SHA256_COMMAND = re.compile(r"^tail -c \+(\d+) (.+) \| head -c (\d+) \| sha256sum$")
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    # Accepts everyone, or only `password` if it's given. Only meant to listen on localhost.
+
+    def __init__(self, password=None):
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if self.password is not None and password != self.password:
+            return paramiko.AUTH_FAILED
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL if self.password is None else paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password,publickey" if self.password is None else "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        # Only the command the chunked uploader hashes chunks with is
+        # supported. It's answered in python rather than run by a shell.
+        match = _SHA256_COMMAND.match(command.decode("utf-8", "replace"))
+        if match is None:
+            return False
+
+        def run():
+            offset, path, length = match.groups()
+            try:
+                with open(shlex.split(path)[0], "rb") as f:
+                    f.seek(int(offset) - 1)
+                    channel.sendall("{}  -\n".format(hashlib.sha256(f.read(int(length))).hexdigest()).encode())
+                channel.send_exit_status(0)
+            except (OSError, ValueError, IndexError):
+                channel.send_exit_status(1)
+            # Only sends an eof. Closing the channel right away can beat the reply to the exec request.
+            channel.shutdown_write()
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _SFTPInterface(SFTPServerInterface):
+    # Serves the local file system with absolute paths.
+
+    @staticmethod
+    def _error(e):
+        return SFTPServer.convert_errno(e.errno)
+
+    def list_folder(self, path):
+        try:
+            entries = []
+            for name in os.listdir(path):
+                attributes = SFTPAttributes.from_stat(os.stat(os.path.join(path, name)))
+                attributes.filename = name
+                entries.append(attributes)
+            return entries
+        except OSError as e:
+            return self._error(e)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return self._error(e)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            fd = os.open(path, flags, 0o644)
+        except OSError as e:
+            return self._error(e)
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        handle = _Handle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            return self._error(e)
+        return SFTP_OK
+
+    def rename(self, old_path, new_path):
+        try:
+            os.replace(old_path, new_path)
+        except OSError as e:
+            return self._error(e)
+        return SFTP_OK
+
+    posix_rename = rename
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            return self._error(e)
+        return SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(path)
+        except OSError as e:
+            return self._error(e)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        return SFTP_OK
+
+
+class FakeSFTPServer:
+    """
+    Local ssh server with the sftp subsystem and command execution, listening on localhost.
+
+    Any user and key or password is accepted, or only `password` if given.
+    Paths are paths on the local file system, so uploads can be checked directly.
+    """
+
+    def __init__(self, password=None):
+        self.password = password
+        self.key = paramiko.RSAKey.generate(2048)
+        self.transports = []
+        self._socket = socket.socket()
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(16)
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.key)
+            transport.set_subsystem_handler("sftp", SFTPServer, _SFTPInterface)
+            transport.start_server(server=_ServerInterface(self.password))
+            self.transports.append(transport)
+
+    def close(self):
+        self._socket.close()
+        for transport in self.transports:
+            transport.close()
@@ -0,0 +1,127 @@
+"""This module contains a local stand-in of the Slack Web API used by the benchmarks."""
+
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import requests
+
+
+class FakeSlackServer:
+    """
+    Local http server answering Slack Web API calls.
+
+    Every call is delayed by `latency` seconds and every `ratelimit_every`-th
+    call is answered with a 429 and a Retry-After header of `retry_after`
+    seconds. chat.postMessage returns increasing timestamps and users.list
+    is paginated over `n_users` users.
+    """
+
+    def __init__(self, latency=0., ratelimit_every=0, retry_after=1, n_users=500):
+        self.latency = latency
+        self.ratelimit_every = ratelimit_every
+        self.retry_after = retry_after
+        self.n_users = n_users
+        self.calls = {}
+        self.n_calls = 0
+        self.n_ratelimited = 0
+        self._lock = threading.Lock()
+        self._n_posted = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                data = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+                status, headers, body = server.handle(self.path.rsplit("/", 1)[-1], data)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:{}/api/".format(self.httpd.server_address[1])
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def handle(self, method, data):
+        with self._lock:
+            self.n_calls += 1
+            if self.ratelimit_every and self.n_calls % self.ratelimit_every == 0:
+                self.n_ratelimited += 1
+                return 429, {"Retry-After": str(self.retry_after)}, {"ok": False, "error": "ratelimited"}
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if method == "chat.postMessage":
+                self._n_posted += 1
+                ts = "{}.{:06d}".format(int(time.time()), self._n_posted)
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == "chat.postMessage":
+            return 200, {}, {"ok": True, "ts": ts, "channel": data.get("channel")}
+        if method == "users.list":
+            offset = int(data.get("cursor") or 0)
+            limit = int(data.get("limit") or 100)
+            members = [{"id": "U{}".format(i), "name": "user{}".format(i), "deleted": False,
+                        "profile": {"email": "user{}@example.com".format(i), "real_name": "User {}".format(i),
+                                    "display_name": "user{}".format(i), "image_192": ""}}
+                       for i in range(offset, min(offset + limit, self.n_users))]
+            cursor = str(offset + limit) if offset + limit < self.n_users else ""
+            return 200, {}, {"ok": True, "members": members, "response_metadata": {"next_cursor": cursor}}
+        if method == "channels.list":
+            return 200, {}, {"ok": True, "channels": [{"id": "C1", "name": "sim_notifications"}]}
+        return 200, {}, {"ok": True}
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+            self.n_calls = 0
+            self.n_ratelimited = 0
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class HttpSlackClient:
+    """
+    Minimal replacement of SlackClient calling an arbitrary api url over a keep-alive session.
+
+    Like SlackClient.api_call, lists and dictionaries are sent as json and
+    the response headers are returned under 'headers'.
+    """
+
+    def __init__(self, url, token="xoxb-benchmark"):
+        self.url = url
+        self.token = token
+        self._local = threading.local()
+
+    def _session(self):
+        # requests sessions are not thread safe, so each thread gets its own.
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def api_call(self, method, timeout=None, **kwargs):
+        data = {key: json.dumps(value) if isinstance(value, (list, dict)) else value
+                for key, value in kwargs.items()}
+        response = self._session().post(self.url + method, data=data, timeout=timeout,
+                                        headers={"Authorization": "Bearer " + self.token})
+        result = response.json()
+        result["headers"] = dict(response.headers)
+        return result
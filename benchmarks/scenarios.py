@@ -0,0 +1,237 @@
+"""This module contains the benchmark scenarios."""
+
+import importlib.util
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+from slack_simbot import SimBot
+from slack_simbot.compression import write_archive
+from slack_simbot.metrics import Metrics
+from slack_simbot.rate_limit import TokenBucket
+from benchmarks.fake_slack import FakeSlackServer, HttpSlackClient
+from benchmarks.fake_sftp import FakeSFTPServer
+
+
+def metric(value, unit, better="lower"):
+    """Result of a benchmark. `better` tells whether a 'lower' or 'higher' value is an improvement."""
+    return {"value": value, "unit": unit, "better": better}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def make_result_tree(path, size, n_files=64, seed=0):
+    """
+    Writes a synthetic result directory of about `size` bytes.
+
+    Most files are csv files with random numbers, which compress like real
+    time series. Some are binary files with random doubles, which hardly compress.
+    """
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    file_size = max(1, size // n_files)
+    for i in range(n_files):
+        case_dir = os.path.join(path, "case_{:03d}".format(i // 8))
+        os.makedirs(case_dir, exist_ok=True)
+        if i % 4 == 3:
+            with open(os.path.join(case_dir, "state_{}.bin".format(i)), "wb") as f:
+                f.write(rng.getrandbits(8 * file_size).to_bytes(file_size, "little"))
+        else:
+            rows = []
+            n = 0
+            t = 0.
+            while n < file_size:
+                row = "{:.3f},{:.6f},{:.6f},{:.6f}\n".format(t, rng.gauss(0, 1), rng.gauss(10, 2), rng.random())
+                rows.append(row)
+                n += len(row)
+                t += 0.01
+            with open(os.path.join(case_dir, "output_{}.csv".format(i)), "w") as f:
+                f.write("".join(rows))
+
+
+def make_simbot(server, **kwargs):
+    return SimBot(token="xoxb-benchmark", slack_client=HttpSlackClient(server.url), metrics=Metrics(),
+                  default_channel="#benchmark", **kwargs)
+
+
+def update_overhead(quick=False, latency=0.02):
+    """Time a single BatchMsgHandle.update blocks the simulation, with synchronous and asynchronous updates."""
+    n = 50 if quick else 300
+    results = {}
+    server = FakeSlackServer(latency=latency)
+    try:
+        for mode, async_updates in (("sync", False), ("async", True)):
+            simbot = make_simbot(server, async_updates=async_updates, update_interval=0.)
+            batch = simbot.get_user_("Benchmark", n, "Update overhead")
+            durations = []
+            for i in range(n):
+                t0 = time.perf_counter()
+                batch.update("case_{}".format(i))
+                durations.append(time.perf_counter() - t0)
+            batch.flush()
+            if async_updates:
+                simbot.dispatcher.close()
+            results["{}_mean_us".format(mode)] = metric(1e6 * sum(durations) / n, "us")
+            results["{}_p99_us".format(mode)] = metric(1e6 * percentile(durations, 0.99), "us")
+    finally:
+        server.close()
+    return results
+
+
+def update_throughput(quick=False, latency=0.02):
+    """Rate at which 10k finished cases are reported with asynchronous updates, and the api calls needed."""
+    n = 2000 if quick else 10000
+    server = FakeSlackServer(latency=latency, ratelimit_every=50, retry_after=0.1)
+    try:
+        simbot = make_simbot(server, async_updates=True, update_interval=0.1)
+        batch = simbot.get_user_("Benchmark", n, "Update throughput")
+        server.reset()
+        t0 = time.perf_counter()
+        for i in range(n):
+            batch.update("case_{}".format(i))
+        batch.flush()
+        duration = time.perf_counter() - t0
+        simbot.dispatcher.close()
+        return {
+            "cases_per_second": metric(n / duration, "1/s", "higher"),
+            "api_calls": metric(server.n_calls, "calls"),
+            "ratelimited": metric(server.n_ratelimited, "calls"),
+        }
+    finally:
+        server.close()
+
+
+class EncodingSlackClient:
+    """In-process client that encodes calls like HttpSlackClient and counts the bytes, without any network."""
+
+    def __init__(self):
+        self.n_calls = 0
+        self.n_bytes = 0
+
+    def api_call(self, method, **kwargs):
+        data = {key: json.dumps(value) if isinstance(value, (list, dict)) else value
+                for key, value in kwargs.items()}
+        self.n_calls += 1
+        self.n_bytes += len(urlencode(data))
+        return {"ok": True, "ts": "1.0", "channel": kwargs.get("channel")}
+
+
+def render(quick=False):
+    """Cpu time and bytes of rendering and encoding progress updates, with attachments and with blocks."""
+    n = 2000 if quick else 20000
+    results = {}
+    for mode, blocks in (("attachments", False), ("blocks", True)):
+        client = EncodingSlackClient()
+        simbot = SimBot(token="xoxb-benchmark", slack_client=client, metrics=Metrics(), update_interval=0.)
+        # Every update is sent, so each one is rendered and encoded.
+        simbot.rate_limit = TokenBucket(1e9, 1e9)
+        batch = simbot.get_user_("Benchmark", n, "Render", blocks=blocks)
+        client.n_calls = client.n_bytes = 0
+        t0 = time.process_time()
+        # Only progress updates, each of which changes the message.
+        for i in range(n):
+            batch.update("case_{}".format(i))
+        duration = time.process_time() - t0
+        results["{}_cpu_us".format(mode)] = metric(1e6 * duration / n, "us")
+        results["{}_bytes_per_update".format(mode)] = metric(client.n_bytes / client.n_calls, "B")
+        results["{}_api_calls".format(mode)] = metric(client.n_calls, "calls")
+    return results
+
+
+def compression(quick=False):
+    """Compression throughput of each codec on a synthetic result tree."""
+    size = (16 if quick else 128) * 1024 * 1024
+    results = {}
+    temp_dir = tempfile.mkdtemp(prefix="simbot_benchmark_")
+    try:
+        tree = os.path.join(temp_dir, "results")
+        make_result_tree(tree, size)
+        codecs = ["none", "deflate"]
+        if importlib.util.find_spec("zstandard") is not None:
+            codecs.append("zstd")
+        for codec in codecs:
+            with open(os.devnull, "wb") as f:
+                report = write_archive(tree, f, codec=codec)
+            results["{}_mb_per_s".format(codec)] = metric(report.bytes_in / 1e6 / report.duration, "MB/s", "higher")
+            results["{}_ratio".format(codec)] = metric(report.ratio, "", "higher")
+    finally:
+        shutil.rmtree(temp_dir)
+    return results
+
+
+def finish(quick=False, latency=0.02):
+    """End to end time of BatchMsgHandle.finish, including the upload to a local sftp server."""
+    size = (8 if quick else 64) * 1024 * 1024
+    results = {}
+    slack_server = FakeSlackServer(latency=latency)
+    sftp_server = FakeSFTPServer()
+    temp_dir = tempfile.mkdtemp(prefix="simbot_benchmark_")
+    try:
+        remote_dir = os.path.join(temp_dir, "remote")
+        os.mkdir(remote_dir)
+        for mode in ("stream", "chunked", "incremental"):
+            simbot = make_simbot(slack_server, debug=True)
+            simbot.connect_ssh(hostname="127.0.0.1", port=sftp_server.port, username="benchmark", password="x")
+            result_dir = os.path.join(temp_dir, "results_{}".format(mode))
+            batch = simbot.get_user_("Benchmark {}".format(mode), 1, "Finish", result_dir=result_dir)
+            make_result_tree(result_dir, size)
+            batch.update("case_0", update_slack=False)
+
+            t0 = time.perf_counter()
+            batch.finish(remote_path=remote_dir, url="http://localhost/data", upload_mode=mode)
+            results["{}_seconds".format(mode)] = metric(time.perf_counter() - t0, "s")
+    finally:
+        sftp_server.close()
+        slack_server.close()
+        shutil.rmtree(temp_dir)
+    return results
+
+
+STARTUP_SCRIPT = """
+import sys, time
+t0 = time.perf_counter()
+import slack_simbot
+t1 = time.perf_counter()
+simbot = slack_simbot.SimBot(active=False)
+batch = simbot.get_user_("Inactive", 1000, "Startup")
+for i in range(1000):
+    batch.update("case_{}".format(i))
+batch.finish()
+t2 = time.perf_counter()
+heavy = ("slackclient", "paramiko", "scp", "asyncio", "concurrent.futures.process")
+print(t1 - t0, t2 - t1, sum(name in sys.modules for name in heavy))
+"""
+
+
+def startup(quick=False):
+    """Import time of slack_simbot and cost of an inactive simbot, each in a fresh interpreter."""
+    n = 5 if quick else 20
+    runs = []
+    for _ in range(n):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+        runs.append([float(value) for value in output.splitlines()[-1].split()])
+    return {
+        "import_ms": metric(1e3 * percentile([run[0] for run in runs], 0.5), "ms"),
+        "inactive_batch_ms": metric(1e3 * percentile([run[1] for run in runs], 0.5), "ms"),
+        "heavy_modules_loaded": metric(runs[-1][2], "modules"),
+    }
+
+
+SCENARIOS = {
+    "startup": startup,
+    "update_overhead": update_overhead,
+    "update_throughput": update_throughput,
+    "render": render,
+    "compression": compression,
+    "finish": finish,
+}
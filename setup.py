@@ -14,7 +14,12 @@ setup(
     author_email='aaron.dewindt@gmail.com',
 
     install_requires=['slackclient'],
-    packages=find_packages('.', exclude=["test"]),
+    extras_require={
+        'zstd': ['zstandard'],
+        'async': ['aiohttp'],
+        'digest': ['numpy', 'h5py'],
+    },
+    packages=find_packages('.', exclude=["test", "benchmarks"]),
 
     classifiers=[
         'Programming Language :: Python :: 3 :: Only',
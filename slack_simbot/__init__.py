@@ -1,3 +1,11 @@
 __version__ = "0.0.0"
 
 from slack_simbot.simbot import SimBot, MsgHandle
+
+
+def __getattr__(name):
+    # AsyncSimBot pulls in asyncio, so it's only imported when it's used.
+    if name == "AsyncSimBot":
+        from slack_simbot.async_simbot import AsyncSimBot
+        return AsyncSimBot
+    raise AttributeError("module 'slack_simbot' has no attribute '{}'".format(name))
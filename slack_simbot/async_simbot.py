@@ -0,0 +1,191 @@
+"""This module contains the asyncio version of the SimBot client."""
+
+import asyncio
+import json
+import os
+
+from slack_simbot.msg_handle import MsgHandle
+from slack_simbot.exception_guard import guard
+from slack_simbot.event_loop import get_event_loop
+
+
+def parse_users(result):
+    """Returns (email, real name, display name, image) tuples of the active users in a users.list response."""
+    users = []
+    if result['ok']:
+        for user in result['members']:
+            try:
+                if not user['deleted']:
+                    users.append((
+                        user['profile']['email'],
+                        user['profile']['real_name'],
+                        user['profile']['display_name'],
+                        user['profile']['image_192']
+                    ))
+            except (KeyError, TypeError):
+                pass
+    return users
+
+
+class AsyncSimBot:
+    """
+    SimBot client with awaitable api calls sharing a keep-alive connection pool.
+
+    All requests go through a single aiohttp session living on the secondary
+    event loop, so many calls, e.g. the updates of a dashboard, can be in
+    flight at the same time over reused connections. The coroutines have to
+    run on that loop. Code outside of it can use `submit`, which returns a
+    concurrent future, or the blocking `*_sync` wrappers.
+
+    Rate limited calls are retried after the time Slack asks for in the
+    Retry-After header. Requires the `aiohttp` package.
+
+    :param default_channel: Channel messages are sent to by default.
+    :param debug: If True, errors in the sync wrappers are raised instead of returned.
+    :param active: If False no messages are sent.
+    :param token: Slack token. Defaults to the SIMBOT_TOKEN environment variable.
+    :param max_connections: Maximum number of simultaneous connections to slack.
+    :param max_retries: Number of times a rate limited call is retried.
+    :param timeout: Timeout of a single request in seconds.
+    :param base_url: Url of the Slack Web API.
+    """
+
+    def __init__(self, default_channel="#sim_notifications", debug=False, active=True, token=None,
+                 max_connections=16, max_retries=5, timeout=30, base_url="https://slack.com/api/"):
+        self.debug = debug
+        self.token = token or os.environ.get('SIMBOT_TOKEN')
+        self.default_channel = "#simbot_testing" if debug else default_channel
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.base_url = base_url
+        self.n_calls = 0
+        self.n_ratelimited = 0
+        self._active = active
+        self._session = None
+        self.loop = get_event_loop(debug_enabled=False)
+
+        if self.token is None:
+            print("Warning: No access to simbot.")
+
+    @property
+    def active(self):
+        return self.token is not None and self._active
+
+    def _get_session(self):
+        # Only called from the event loop, so no lock is needed.
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Authorization": "Bearer {}".format(self.token)},
+            )
+        return self._session
+
+    async def api_call(self, method, **kwargs):
+        """
+        Calls a Slack Web API method.
+
+        :param method: Name of the method, e.g. 'chat.postMessage'.
+        :param kwargs: Arguments of the method. Lists and dictionaries are json encoded.
+        :return: Decoded response with the response headers under 'headers',
+                 like `SlackClient.api_call`.
+        """
+        data = {key: json.dumps(value) if isinstance(value, (list, dict)) else value
+                for key, value in kwargs.items() if value is not None}
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            async with session.post(self.base_url + method, data=data) as response:
+                self.n_calls += 1
+                if response.status == 429 and attempt < self.max_retries:
+                    self.n_ratelimited += 1
+                    await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+                    continue
+                if response.status == 429:
+                    result = {"ok": False, "error": "ratelimited"}
+                else:
+                    result = await response.json(content_type=None)
+                result["headers"] = dict(response.headers)
+                return result
+
+    async def send_msg(self, msg, channel=None):
+        if self.active:
+            r = await self.api_call(
+                "chat.postMessage",
+                channel=channel or self.default_channel,
+                text=msg,
+                as_user="1",
+                parse="full",
+                link_names="1"
+            )
+            if r['ok']:
+                return MsgHandle(r['ts'], r['channel'])
+            else:
+                return None
+
+    async def update_msg(self, handle, msg):
+        if self.active:
+            return await self.api_call(
+                "chat.update",
+                ts=handle.ts,
+                channel=handle.channel,
+                text=msg,
+                parse="full",
+                link_names="1",
+                as_user="1",
+            )
+
+    async def delete_msg(self, handle):
+        if self.active:
+            return await self.api_call(
+                "chat.delete",
+                channel=handle.channel,
+                ts=handle.ts
+            )
+
+    async def get_channel_list(self):
+        return await self.api_call("channels.list")
+
+    async def get_users(self):
+        return parse_users(await self.api_call("users.list"))
+
+    def submit(self, coro):
+        """Schedules a coroutine of this client on the event loop and returns a concurrent future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _run(self, coro):
+        return self.submit(coro).result()
+
+    @guard
+    def api_call_sync(self, method, **kwargs):
+        return self._run(self.api_call(method, **kwargs))
+
+    @guard
+    def send_msg_sync(self, msg, channel=None) -> MsgHandle:
+        return self._run(self.send_msg(msg, channel))
+
+    @guard
+    def update_msg_sync(self, handle: MsgHandle, msg):
+        return self._run(self.update_msg(handle, msg))
+
+    @guard
+    def delete_msg_sync(self, handle: MsgHandle):
+        return self._run(self.delete_msg(handle))
+
+    @guard
+    def get_channel_list_sync(self):
+        return self._run(self.get_channel_list())
+
+    @guard
+    def get_users_sync(self):
+        return self._run(self.get_users())
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def close(self):
+        """Closes the connection pool."""
+        self._run(self.aclose())
@@ -2,28 +2,18 @@ import datetime
 import os
 import shutil
 import sys
+import threading
 import time
 from traceback import format_exception
 
 from slack_simbot.msg_handle import MsgHandle
 from slack_simbot.exception_guard import guard
-from scp import SCPClient
-
-
-class RunningAverage:
-    def __init__(self, initial=None, weight=0.8):
-        self.value = initial
-        self.weight = weight
-
-    def update(self, value):
-        if self.value is None:
-            self.value = value
-        else:
-            self.value = ((1-self.weight) * self.value + self.weight * value)
-        return self.value
-
-    def reset(self):
-        self.value = None
+from slack_simbot.case_log import CaseLog
+from slack_simbot.render import BatchRenderer
+from slack_simbot.cancel import CancelToken
+from slack_simbot.metrics import BlockingTime
+# RunningAverage used to live here, keep it importable.
+from slack_simbot.eta import RunningAverage, ThroughputEstimator
 
 
 class BatchMsgHandle(MsgHandle):
@@ -31,27 +21,97 @@ class BatchMsgHandle(MsgHandle):
     CANCELLED = 1
     EXCEPTION = 2
 
-    def __init__(self, simbot, title, n_cases, result_dir, description, *, channel=None, clear_result_dir=True):
+    def __init__(self, simbot, title, n_cases, result_dir, description, *, channel=None, clear_result_dir=True,
+                 async_updates=None, eta_estimator=None, case_log_path=None, resume=None, dashboard=None,
+                 resources=None, watchdog=None, owner=None, history=None, blocks=False):
         self.simbot = simbot
         self.debug = simbot.debug
+        # Guards the progress state, so several threads can report cases of the batch.
+        self._lock = threading.RLock()
+        # Number of the last rendered and the last sent message.
+        self._seq = 0
+        self._sent_seq = 0
+        self._finished = False
         self.channel = channel or self.simbot.default_channel
         self.title = title
         self.n_cases = n_cases
         self.result_dir = result_dir
         self.start_time = datetime.datetime.now()
+        # Time spent waiting on the calls of this batch. Other batches and threads aren't counted.
+        self.blocking_time = BlockingTime()
         self.done = 0
         self.running = True
-        self.cases = []
+        self.cases = CaseLog(spill_path=case_log_path)
         self.eta = None
+        self.eta_band = None
         self.last_update_time = None
-        self.case_dt = RunningAverage()
+        self.last_progress_time = None
+        self.coordinator = None
+        self.eta_estimator = eta_estimator or ThroughputEstimator()
+        self.eta_estimator.begin(self.start_time.timestamp())
         self.description = description
-
-        r = self.start(clear_result_dir=clear_result_dir)
-        super().__init__(r['ts'], r['channel'])
+        self.async_updates = simbot.async_updates if async_updates is None else async_updates
+        self.dashboard = dashboard
+        # The dashboard combines the attachments of its batches, so it doesn't work with blocks.
+        self.renderer = BatchRenderer(title, description, n_cases, blocks=blocks and dashboard is None)
+        self.last_payload = None
+        # Without a dispatcher, the latest update held back, the timer sending it, and when the last update was sent.
+        self._pending = None
+        self._timer = None
+        self._last_sent_time = None
+        # Set by `/simbot cancel`, the simulation polls `cancelled`.
+        self.cancel_token = CancelToken()
+        self.case_peaks = None
+        # Sample the cpu, memory and io usage of the process tree in the background.
+        # True uses a ResourceSampler with its default settings.
+        self.resources = None
+        if resources and simbot.active:
+            from slack_simbot.resources import ResourceSampler, CasePeaks
+            self.resources = ResourceSampler(metrics=simbot.metrics) if resources is True else resources
+            self.resources.start()
+            self.case_peaks = CasePeaks()
+
+        # Earlier runs with the same title seed the eta, and this run is recorded for later ones.
+        self.history = (history or simbot.history) if simbot.active else None
+        self.history_run = None
+        if self.history is not None:
+            rates = self.history.seed(title)
+            if rates is not None:
+                self.eta_estimator.seed(rates)
+            self.history_run = self.history.begin(title, n_cases, started=self.start_time.timestamp())
+
+        if simbot.active:
+            simbot._register_batch(self)
+
+        # Alerts the owner if the batch stalls or runs slower than before.
+        self.watchdog = watchdog
+        if watchdog is not None:
+            watchdog.watch(self, owner)
+
+        if dashboard is not None:
+            # The batch is shown in the dashboard's message instead of its own.
+            self.start(clear_result_dir=clear_result_dir, post=False)
+            super().__init__(None, self.channel)
+            dashboard.add(self)
+            return
+
+        handle = None
+        if resume is not None and self.simbot.outbox is not None:
+            # Continue with the message of a batch started before a restart.
+            handle = self.simbot.outbox.message_handle(resume)
+        if handle is None:
+            handle = self.start(clear_result_dir=clear_result_dir, post=self.simbot.active)
+        if handle is None:
+            # Inactive simbot, nothing is sent.
+            super().__init__(None, self.channel)
+            return
+        super().__init__(handle.ts, handle.channel, outbox_id=handle.outbox_id)
+        if self.ts is None:
+            # The message is still in the outbox.
+            self.simbot.outbox.bind(self)
 
     @guard
-    def start(self, clear_result_dir=True):
+    def start(self, clear_result_dir=True, post=True):
         # Clear the results directory if necessary by deleting and recreating it.
         if clear_result_dir and self.result_dir is not None:
             result_dir = os.path.abspath(self.result_dir)
@@ -59,9 +119,11 @@ class BatchMsgHandle(MsgHandle):
                 shutil.rmtree(self.result_dir)
             os.mkdir(self.result_dir)
 
+        if not post:
+            return
+
         # Send msg to slack
-        r = self.simbot.slack_client.api_call(
-            "chat.postMessage",
+        return self.simbot.post_message(
             channel=self.channel,
             text="Starting simulation batch '{}' with {} {}.".format(
                 self.title, self.n_cases, "case" if self.n_cases == 1 else "cases"
@@ -70,117 +132,338 @@ class BatchMsgHandle(MsgHandle):
             parse="full",
             link_names="1"
         )
-        return r
 
     @guard
-    def update(self, case_name, update_slack=True):
-        self.cases.append(case_name)
-        now = datetime.datetime.now()
-
-        if self.last_update_time is not None:
-            dt = now - self.last_update_time
-            dt = self.case_dt.update(dt)
-            self.eta = now + dt * (self.n_cases - len(self.cases) + 1)
-
-        self.last_update_time = now
-
-        if len(self.cases) <= self.n_cases:
-            text = "*running* {}\n*progress* {}/{}\n*eta* {}".format(
-                            self.cases[-1],
-                            len(self.cases),
-                            self.n_cases,
-                            "tbd" if self.eta is None else self.eta.strftime("%d-%b-%Y %H:%M:%S")
-                        )
-        else:
-            text = "*done*"
-
-        text = "_{}_\n".format(self.description) + text
+    def update(self, case_name, update_slack=True, start_time=None, end_time=None, status="ok"):
+        """
+        Records a finished case and updates the progress message.
+
+        :param case_name: Name of the case.
+        :param update_slack: Whether to update the message on slack.
+        :param start_time: Unix time the case started at, if known. Improves the eta of parallel runs.
+        :param end_time: Unix time the case finished at. Defaults to now.
+        :param status: One of 'ok', 'failed' or 'skipped'.
+
+        Cases reported after `finish` are ignored, the summary already replaced the progress message.
+        """
+        end_time = time.time() if end_time is None else end_time
+        with self._lock:
+            if self._finished:
+                self.simbot.metrics.inc("simbot_updates_after_finish_total")
+                return
+            self.cases.append(case_name, status, start_time, end_time)
+            self.last_update_time = datetime.datetime.fromtimestamp(end_time)
+            if not self.simbot.active:
+                return
+
+            self.eta_estimator.record(end_time, start_time)
+            if self.history is not None:
+                self.history.add_case(self.history_run, self.title, case_name, status, start_time, end_time)
+            eta = self.eta_estimator.estimate(max(self.n_cases - len(self.cases), 0))
+            if eta is not None:
+                self.eta = eta.expected
+                self.eta_band = eta
+
+            if self.resources is not None:
+                # Peaks since the previous case finished, so with parallel cases they're shared between them.
+                self.case_peaks.add(case_name, *self.resources.take_peak())
+
+            if not update_slack:
+                return
+
+            self._seq += 1
+            seq = self._seq
+            payload = self.renderer.progress(
+                self.cases.last if len(self.cases) <= self.n_cases else None,
+                len(self.cases),
+                self.eta_text(),
+                self.resources.text() if self.resources is not None else None)
+            # The last case is always sent, it may be the final state of the message.
+            coalesce = len(self.cases) < self.n_cases
+        self._send(seq, payload, coalesce)
+
+    @property
+    def cancelled(self):
+        """Whether someone asked the batch to stop with `/simbot cancel`."""
+        return self.cancel_token.cancelled
+
+    def throughput(self):
+        """Returns the current throughput in cases per second, or None if unknown. Safe to call from any thread."""
+        # The estimator is updated by the threads reporting cases, under the batch lock.
+        with self._lock:
+            return self.eta_estimator.rate()
+
+    def eta_text(self):
+        if self.eta_band is None:
+            return "tbd"
+        time_format = "%d-%b-%Y %H:%M:%S"
+        expected, low, high = self.eta_band
+        if high - low < datetime.timedelta(seconds=1):
+            return expected.strftime(time_format)
+        # Leave the date out of the band if it's the same day.
+        band_format = "%H:%M:%S" if low.date() == high.date() == expected.date() else time_format
+        return "{} ({} - {})".format(expected.strftime(time_format), low.strftime(band_format),
+                                     high.strftime(band_format))
+
+    def serve(self, address=None, secret=None):
+        """
+        Starts accepting case reports from other processes or nodes.
+
+        Workers report finished cases with the BatchReporter returned by
+        `reporter()` instead of calling `update` themselves. This process
+        then aggregates all reports into this batch's single message.
+
+        :param address: Path of a unix socket or (host, port) tuple to listen
+                        on. A temporary unix socket is used if None.
+        :param secret: Optional string reporters have to send along.
+        :return: BatchCoordinator
+        """
+        with self._lock:
+            if self.coordinator is None:
+                from slack_simbot.coordinator import BatchCoordinator
+                self.coordinator = BatchCoordinator(self, address=address, secret=secret)
+            return self.coordinator
+
+    def reporter(self):
+        """Returns a picklable BatchReporter workers can use to report finished cases."""
+        return self.serve().reporter()
+
+    def send_update(self, **kwargs):
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        self._send(seq, kwargs)
+
+    def _send(self, seq, payload, coalesce=False):
+        # With a dashboard, an outbox, or in async mode, the update is queued and this returns right away.
+        # Otherwise it's sent right away, or held back for the update interval or the rate limit, see `_send_now`.
+        if not self.simbot.active:
+            return
+        with self.simbot.message_lock(self):
+            # Nothing to send if a newer update was sent by another thread in the
+            # meantime, or if the message would look the same as after the previous update.
+            if seq < self._sent_seq or payload == self.last_payload:
+                self.simbot.metrics.inc("simbot_updates_skipped_total")
+                return
+            self._sent_seq = seq
+            self.last_payload = payload
+            kwargs = dict(payload, ts=self.ts, channel=self.channel)
+            if self.dashboard is not None:
+                self.dashboard.set(self, kwargs["attachments"])
+            elif self.simbot.outbox is not None:
+                del kwargs["ts"], kwargs["channel"]
+                self.simbot.message_call("chat.update", self, **kwargs)
+            elif self.async_updates:
+                self.simbot.dispatcher.submit("chat.update", **kwargs)
+            else:
+                self._send_now(kwargs, coalesce)
+
+    def _send_now(self, kwargs, coalesce):
+        # Called with the message lock held. Like the dispatcher, this sends at most one progress update per
+        # update interval and only while the rate limit allows it. Otherwise the update replaces the one held
+        # back before it, and a timer sends it once it's allowed, so the message never stays behind for long.
+        now = time.monotonic()
+        delay = 0.
+        if coalesce and self._last_sent_time is not None:
+            delay = self._last_sent_time + self.simbot.update_interval - now
+        if delay > 0 or not self.simbot.rate_limit.take():
+            self._hold(kwargs, max(delay, self.simbot.rate_limit.delay()))
+            return
+        self._post_update(kwargs, now)
+
+    def _post_update(self, kwargs, now):
+        self._pending = None
+        self._last_sent_time = now
+        r = self.simbot.api_call("chat.update", **kwargs)
+        if r.get("error") == "ratelimited":
+            # Honour Retry-After, the update is sent again once it's over.
+            retry_after = float(r.get("headers", {}).get("Retry-After", 1))
+            self.simbot.rate_limit.block(retry_after)
+            self._hold(kwargs, retry_after)
+
+    def _hold(self, kwargs, delay):
+        self._pending = kwargs
+        self.simbot.metrics.inc("simbot_updates_coalesced_total")
+        if self._timer is None:
+            self._timer = threading.Timer(delay, self._send_pending)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _send_pending(self):
+        # Runs on the timer thread. Not guarded, the simulation doesn't wait on it, so it's no overhead.
+        try:
+            with self.simbot.message_lock(self):
+                self._timer = None
+                if self._pending is not None:
+                    self._send_now(self._pending, False)
+        except Exception as e:
+            self.simbot.metrics.inc("simbot_errors_total", op="_send_pending", type=type(e).__name__)
+            if self.debug:
+                raise
 
-        self.simbot.slack_client.api_call(
-            "chat.update",
-            ts=self.ts,
-            channel=self.channel,
-            # text=msg,
-            parse="full",
-            link_names="1",
-            as_user="1",
-            attachments=[
-                {
-                    "fallback": text,
-                    "color": "#3AA3E3",
-                    "title": self.title,
-                    "text": text,
-                    "mrkdwn_in": ["text"]
-                }
-            ]
-        )
+    @guard
+    def flush(self, timeout=None):
+        """Blocks until all queued updates of this batch have been sent to slack."""
+        if self.dashboard is not None or not self.simbot.active:
+            return
+        elif self.simbot.outbox is not None:
+            self.simbot.outbox.flush(timeout)
+        elif self.async_updates:
+            self.simbot.dispatcher.flush(timeout)
+        else:
+            with self.simbot.message_lock(self):
+                if self._pending is not None:
+                    self.simbot.rate_limit.wait()
+                    self._post_update(self._pending, time.monotonic())
 
+    join = flush
 
     @guard
-    def update_done(self):
-        text = "_{}_\n*Done*\nPostprocessing and uploading results".format(
-            self.description)
-
-        self.simbot.slack_client.api_call(
-            "chat.update",
-            ts=self.ts,
-            channel=self.channel,
-            # text=msg,
-            parse="full",
-            link_names="1",
-            as_user="1",
-            attachments=[
-                {
-                    "fallback": text,
-                    "color": "#3AA3E3",
-                    "title": self.title,
-                    "text": text,
-                    "mrkdwn_in": ["text"]
-                }
-            ]
-        )
+    def update_done(self, stage="Postprocessing and uploading results"):
+        self.send_update(**self.renderer.done(stage))
+
+    def upload_progress(self, n_bytes, total, throughput):
+        # Called from the upload threads, so only update slack once per update interval.
+        now = time.monotonic()
+        with self._lock:
+            if self.last_progress_time is not None and now - self.last_progress_time < self.simbot.update_interval:
+                return
+            self.last_progress_time = now
+        self.update_done("Uploading results {:.0f}% ({:.1f} MB/s)".format(
+            100 * n_bytes / total if total else 100, throughput))
 
     @guard
     def finish(self,
-               succesfull,
+               succesfull=None,
                status=None,
                exc_info=None,
                remote_path="/var/www/html/data",
-               url="http://daresim.tk/data"):
+               url="http://daresim.tk/data",
+               upload_mode="stream",
+               detach=False,
+               digest=False):
+        """
+        Uploads the results and replaces the progress message with a summary.
+
+        With `detach` the upload and the notification run on the process wide
+        Finisher pool and a Future is returned right away, so the next batch
+        can start. The progress message then shows the stage the finish is in.
+        Use `SimBot.wait_all` to wait for all detached finishes. Only the
+        first call finishes the batch, later ones return None.
+
+        With `digest` a summary of the files in the result directory, with
+        statistics of the columns of csv, npy and hdf5 files, is added to the
+        notification. It's computed while the results are compressed. True
+        uses a Digest with its default settings.
+        """
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+
+        # Stop accepting reports from workers.
+        if self.coordinator is not None:
+            self.coordinator.close()
+            self.coordinator = None
+
+        if self.watchdog is not None:
+            self.watchdog.unwatch(self)
+        self.simbot._unregister_batch(self)
+
+        if not self.simbot.active:
+            self.cases.close()
+            return
+
+        # The sampler would otherwise include the compression of the results.
+        resources = None
+        if self.resources is not None:
+            resources = self.resources.summary()
+            self.resources.close()
+
+        # Time spent waiting on the calls of this batch, not counting this one.
+        elapsed = (datetime.datetime.now() - self.start_time).total_seconds()
+        overhead = self.blocking_time.seconds
+
+        args = (succesfull, status, exc_info, remote_path, url, upload_mode, resources, elapsed, overhead, detach,
+                digest)
+        if detach:
+            return self.simbot.finisher.submit(self._finish, *args)
+        return self._finish(*args)
+
+    def _finish(self, succesfull, status, exc_info, remote_path, url, upload_mode, resources, elapsed, overhead,
+                detached, digest):
+        def stage(text):
+            # Only worth an api call when nobody is waiting for the finish.
+            if detached:
+                self.update_done(text)
+
         self.update_done()
 
         status = status or self.COMPLETED
 
-        # Compress the target directory.
-        if self.result_dir is not None:
-            self.simbot.connect_ssh()
-            zip_path = self.simbot.compress_directory(self.result_dir)
-
-            # Generate the name the file will have on the server.
-            _, dir_name = os.path.split(self.result_dir)
-            remote_file_name = "{}_{}.zip".format(
-                self.title.lower().replace(" ", "_"),
-                datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
-
-            # Generate the full path of the file on the server
-            remote_path = os.path.join(remote_path, remote_file_name)
-
-            # Generate url pointing to the file.
-            url = "{}/{}".format(url, remote_file_name)
+        if digest and self.result_dir is not None:
+            from slack_simbot.digest import Digest
+            digest = Digest() if digest is True else digest
+        else:
+            digest = None
 
-            # Upload file to server
-            with SCPClient(self.simbot.ssh_client.get_transport()) as scp:
-                scp.put(zip_path, remote_path)
+        # Upload the results. A failed upload doesn't stop the summary, it's reported in it instead.
+        report = None
+        upload_error = None
+        if self.result_dir is not None:
+            title_name = self.title.lower().replace(" ", "_")
+            try:
+                if self.simbot.ssh_pool is None:
+                    stage("Connecting to the server")
+                    self.simbot._connect_ssh()
+
+                if upload_mode == "incremental":
+                    # Only upload the files that changed since the last run of this batch.
+                    stage("Uploading changed results")
+                    report = self.simbot._sync_directory(self.result_dir, os.path.join(remote_path, title_name),
+                                                         title=self.title)
+                    url = "{}/{}/".format(url, title_name)
+                    if digest is not None:
+                        # The sync doesn't walk the directory the same way, so the digest walks it itself.
+                        stage("Summarizing results")
+                        digest.scan(self.result_dir)
+                else:
+                    # Generate the name the file will have on the server.
+                    remote_file_name = self.simbot.remote_file_name(title_name, self.result_dir, remote_path,
+                                                                    upload_mode)
+
+                    # Generate the full path of the file on the server
+                    remote_path = os.path.join(remote_path, remote_file_name)
+
+                    # Generate url pointing to the file.
+                    url = "{}/{}".format(url, remote_file_name)
+
+                    # Compress and upload the results to the server. The digest runs at the
+                    # same time, so the compression gets the cores the digest doesn't use.
+                    workers = None
+                    if digest is not None:
+                        workers = max(1, (os.cpu_count() or 1) - digest.workers)
+                    stage("Compressing and uploading results")
+                    report = self.simbot._upload_archive(self.result_dir, remote_path, mode=upload_mode,
+                                                         workers=workers, progress=self.upload_progress,
+                                                         visit=digest.add if digest is not None else None)
+                    if not report.upload.ok:
+                        # The chunks that failed are listed with the upload errors.
+                        upload_error = "The archive could not be uploaded."
+            except Exception as e:
+                self.simbot.metrics.inc("simbot_errors_total", op="upload", type=type(e).__name__)
+                upload_error = "{}: {}".format(type(e).__name__, e)
         else:
             url = ""
 
-        if len(self.cases) > 7:
-            cases_text = ", ".join([x.strip() for x in self.cases[0:3]]) + ", ... ," + \
-                    ", ".join([x.strip() for x in self.cases[-3:]])
-        else:
-            cases_text = ", ".join([x.strip() for x in self.cases])
+        self.cases.close()
+        cases_text = self.cases.summary()
 
+        if succesfull is None:
+            succesfull = self.cases.n_ok
         successful_text = "{} out of {}".format(succesfull, self.n_cases)
+        if self.cases.n_failed or self.cases.n_skipped:
+            successful_text += " ({} failed, {} skipped)".format(self.cases.n_failed, self.cases.n_skipped)
 
         fields = [
             {
@@ -203,9 +486,77 @@ class BatchMsgHandle(MsgHandle):
                 "title": "Download",
                 "value": url,
                 "short": False
-            } if self.result_dir is not None else {},
+            } if self.result_dir is not None and upload_error is None else {},
         ]
 
+        if upload_error is not None:
+            fields.append({
+                "title": "Upload failed",
+                "value": upload_error,
+                "short": False
+            })
+
+        if elapsed > 0:
+            exceeded = overhead / elapsed > self.simbot.overhead_threshold
+            if exceeded:
+                self.simbot.metrics.inc("simbot_overhead_exceeded_total")
+            fields.append({
+                "title": "Simbot overhead" + (" :warning:" if exceeded else ""),
+                "value": "{:.2f} s ({:.2%} of the batch)".format(overhead, overhead / elapsed),
+                "short": True
+            })
+
+        if digest is not None:
+            fields.extend(digest.close().fields())
+
+        if resources is not None:
+            from slack_simbot.resources import format_bytes
+            fields.append({
+                "title": "Resources",
+                "value": "cpu {:.0f}% · peak rss {}\nread {} · written {}".format(
+                    resources.cpu, format_bytes(resources.rss_peak),
+                    format_bytes(resources.read_bytes), format_bytes(resources.write_bytes)),
+                "short": True
+            })
+            peaks = self.case_peaks.by_rss()
+            if peaks:
+                fields.append({
+                    "title": "Peak cases",
+                    "value": "\n".join("{}: rss {} · cpu {:.0f}%".format(peak.case, format_bytes(peak.rss), peak.cpu)
+                                       for peak in peaks),
+                    "short": True
+                })
+
+        upload = getattr(report, "upload", None)
+        if upload is not None and upload.bytes:
+            fields.append({
+                "title": "Upload",
+                "value": "{:.1f} MB in {:.0f} s ({:.1f} MB/s)".format(
+                    upload.bytes / 1e6, upload.duration, upload.throughput),
+                "short": True
+            })
+
+        if getattr(report, "errors", None):
+            fields.append({
+                "title": "Upload errors",
+                "value": "{} {} could not be uploaded:\n{}".format(
+                    len(report.errors),
+                    "file" if len(report.errors) == 1 else "files",
+                    "\n".join("{}: {}".format(path, error) for path, error in report.errors[:5])),
+                "short": False
+            })
+
+        if self.history is not None:
+            upload = getattr(report, "upload", None)
+            elapsed = (self.last_update_time - self.start_time).total_seconds() if self.last_update_time else 0
+            self.history.finish(
+                self.history_run, self.cases.n_ok, self.cases.n_failed, self.cases.n_skipped,
+                status={self.COMPLETED: "completed", self.CANCELLED: "cancelled"}.get(status, "exception"),
+                throughput=len(self.cases) / elapsed if elapsed > 0 else None,
+                artifact_bytes=getattr(report, "bytes_out", None),
+                upload_bytes=upload.bytes if upload is not None else getattr(report, "bytes_uploaded", None),
+                upload_seconds=upload.duration if upload is not None else None)
+
         if succesfull == self.n_cases:
             color = "good"  # green
         elif succesfull > 0:
@@ -213,7 +564,10 @@ class BatchMsgHandle(MsgHandle):
         else:
             color = "danger"  # danger
 
-        if status == self.COMPLETED:
+        if status == self.COMPLETED and upload_error is not None:
+            attachment_title = "Simulation batch completed, uploading the results failed"
+            color = "danger"
+        elif status == self.COMPLETED:
             attachment_title = "Simulation batch completed"
         elif status == self.CANCELLED:
             attachment_title = "Simulation batch cancelled"
@@ -228,30 +582,37 @@ class BatchMsgHandle(MsgHandle):
                     "short": False
                 })
 
+        attachments = self.renderer.finish(attachment_title, color, fields)
+
+        stage("Sending notification")
+
+        if self.dashboard is not None:
+            # The summary replaces the progress of this batch in the dashboard.
+            self.dashboard.set(self, attachments, finished=True)
+            return
+
+        # Make sure no queued update lands after the old msg is deleted. The
+        # outbox sends the calls on a message in order, so it doesn't have to wait.
+        if self.simbot.outbox is None:
+            self.flush()
+
         # Delete the old msg
         self.simbot.delete_msg(self)
 
         # Send notification on slack
-        r = self.simbot.slack_client.api_call(
-            "chat.postMessage",
+        handle = self.simbot.post_message(
             channel=self.channel,
             text="@channel",
             as_user="1",
             parse="full",
             link_names="1",
-            attachments=[
-                {
-                    "fallback": self.title,
-                    "color": color,
-                    "title": attachment_title,
-                    # "text": "*{}* {}".format(self.title, self.description),
-                    "fields": fields,
-                    "mrkdwn_in": ["text", 'fields']
-                }
-            ]
+            attachments=attachments
         )
 
-        if r['ok']:
-            self.ts = r['ts']
-            self.channel = r['channel']
+        if handle is not None:
+            self.outbox_id = handle.outbox_id
+            self.ts = handle.ts
+            self.channel = handle.channel
+            if self.ts is None:
+                self.simbot.outbox.bind(self)
 
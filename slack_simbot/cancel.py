@@ -0,0 +1,41 @@
+"""This module contains the token used to ask a running batch to stop."""
+
+import threading
+import time
+
+
+class BatchCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """
+    Flag set when someone asks a batch to stop, which the simulation loop polls.
+
+    Cancelling doesn't interrupt anything. The simulation checks `cancelled`
+    or calls `raise_if_cancelled` between cases and finishes the batch as
+    cancelled.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.by = None
+        self.time = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, by=None):
+        if not self._event.is_set():
+            self.by = by
+            self.time = time.time()
+            self._event.set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise BatchCancelled("Cancelled by {}".format(self.by or "unknown"))
+
+    def wait(self, timeout=None):
+        """Blocks until the batch is cancelled or the timeout expires. Returns whether it was cancelled."""
+        return self._event.wait(timeout)
@@ -0,0 +1,103 @@
+"""This module contains the bounded memory log of the cases finished in a batch."""
+
+import json
+import threading
+from collections import deque
+
+
+STATUSES = ("ok", "failed", "skipped")
+
+
+class CaseLog:
+    """
+    Keeps track of the finished cases of a batch in constant memory.
+
+    Only the number of cases per status, the names of the first `head`
+    cases and the names of the last `tail` cases are kept in memory. If
+    `spill_path` is given, every case is also appended to that file as a
+    json line, so the full log is available after the batch without
+    holding it in memory.
+
+    :param head: Number of names of the first cases to keep.
+    :param tail: Number of names of the last cases to keep.
+    :param spill_path: Optional path of the file the full log is written to.
+    """
+
+    def __init__(self, head=3, tail=3, spill_path=None):
+        self.counts = dict.fromkeys(STATUSES, 0)
+        self.head = []
+        self.tail = deque(maxlen=tail)
+        self.n_head = head
+        self.spill_path = spill_path
+        self._spill_file = None
+        self._lock = threading.Lock()
+        if spill_path is not None:
+            self._spill_file = open(spill_path, "a", buffering=1)
+
+    def append(self, case_name, status="ok", start_time=None, end_time=None):
+        """
+        Records a finished case.
+
+        :param case_name: Name of the case.
+        :param status: One of 'ok', 'failed' or 'skipped'.
+        :param start_time: Unix time the case started at, only written to the spill file.
+        :param end_time: Unix time the case finished at, only written to the spill file.
+        """
+        if status not in self.counts:
+            raise ValueError("Unknown case status '{}', should be one of {}".format(status, ", ".join(STATUSES)))
+        with self._lock:
+            self.counts[status] += 1
+            if len(self.head) < self.n_head:
+                self.head.append(case_name)
+            self.tail.append(case_name)
+            if self._spill_file is not None:
+                self._spill_file.write(json.dumps(
+                    {"case": case_name, "status": status, "start": start_time, "end": end_time}) + "\n")
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    @property
+    def last(self):
+        """Name of the last finished case, or None."""
+        return self.tail[-1] if self.tail else None
+
+    @property
+    def n_ok(self):
+        return self.counts["ok"]
+
+    @property
+    def n_failed(self):
+        return self.counts["failed"]
+
+    @property
+    def n_skipped(self):
+        return self.counts["skipped"]
+
+    def summary(self, separator=", "):
+        """Returns the names of the first and last cases, with '...' in between if some are left out."""
+        n = len(self)
+        if n <= len(self.head) + len(self.tail):
+            # All cases are still known, the ones in the tail that are also in the head are skipped.
+            names = self.head + list(self.tail)[len(self.head) + len(self.tail) - n:]
+            return separator.join(x.strip() for x in names)
+        return separator.join(x.strip() for x in self.head) + separator + "..." + separator + \
+            separator.join(x.strip() for x in self.tail)
+
+    def read(self):
+        """Yields the entries of the spill file as dictionaries."""
+        if self.spill_path is None:
+            raise ValueError("The case log is not written to a file")
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.flush()
+        with open(self.spill_path) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def close(self):
+        """Closes the spill file."""
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
@@ -0,0 +1,256 @@
+"""This module contains the chunked, parallel and resumable uploader used for large archives."""
+
+import hashlib
+import json
+import os
+import queue
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from slack_simbot.transfer import UploadReport
+
+
+class ChecksumError(IOError):
+    pass
+
+
+class ChunkedUploader:
+    """
+    Uploads a file in chunks over several sftp channels at the same time.
+
+    Each chunk is written at its offset in '<remote_path>.part' and its
+    sha256 is compared with a hash computed on the server. Confirmed chunks
+    are recorded in '<local_path>.upload.json', so an interrupted upload
+    of the same file resumes with the chunks that are still missing, both
+    when retried in the same process and after a restart. Once all chunks
+    are confirmed the file is renamed to remote_path.
+
+    Failures that retrying won't fix, a chunk whose checksum still doesn't
+    match after all retries, or a '.part' file that can't be created or
+    renamed, remove the state file, so the next upload starts over.
+
+    The server side hash uses the sftp 'check-file' extension when the server
+    supports it and falls back to running `sha256sum` over ssh.
+
+    :param ssh_pool: SSHPool of the server. It should allow at least
+                     `channels` connections.
+    :param chunk_size: Size of the chunks in bytes.
+    :param channels: Number of chunks uploaded in parallel.
+    :param max_retries: Number of times failed chunks are retried.
+    :param progress: Optional callable called with the number of bytes
+                     uploaded, the total number of bytes and the throughput
+                     in MB/s each time a chunk is confirmed.
+    """
+
+    def __init__(self, ssh_pool, chunk_size=16 * 1024 * 1024, channels=4, max_retries=3, progress=None):
+        self.ssh_pool = ssh_pool
+        self.chunk_size = chunk_size
+        self.channels = channels
+        self.max_retries = max_retries
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._check_method = None
+        self._last_error = None
+        self._permanent = False
+
+    def upload(self, local_path, remote_path):
+        """
+        Uploads a file, resuming a previous upload of it if possible.
+
+        :return: UploadReport
+        """
+        st = os.stat(local_path)
+        state_path = self.state_path(local_path)
+        part_path = remote_path + ".part"
+        n_chunks = max(1, -(-st.st_size // self.chunk_size))
+        state = self._load_state(state_path, remote_path, st)
+
+        with self.ssh_pool.sftp() as sftp:
+            if state["done"]:
+                try:
+                    sftp.stat(part_path)
+                except IOError:
+                    state["done"] = {}
+            if not state["done"]:
+                # Create or truncate the remote file.
+                with self._permanent_errors(state_path):
+                    sftp.open(part_path, "wb").close()
+        self._save_state(state_path, state)
+
+        report = UploadReport()
+        report.n_chunks = n_chunks
+        report.n_resumed = len(state["done"])
+        done_bytes = [sum(self._chunk_length(int(i), st.st_size) for i in state["done"])]
+        t0 = time.perf_counter()
+
+        def confirmed(index, digest):
+            with self._lock:
+                state["done"][str(index)] = digest
+                self._save_state(state_path, state)
+                length = self._chunk_length(index, st.st_size)
+                report.bytes += length
+                done_bytes[0] += length
+                if self.progress is not None:
+                    self.progress(done_bytes[0], st.st_size, report.bytes / 1e6 / (time.perf_counter() - t0))
+
+        pending = [i for i in range(n_chunks) if str(i) not in state["done"]]
+        for attempt in range(self.max_retries + 1):
+            if not pending:
+                break
+            if attempt:
+                time.sleep(2 ** (attempt - 1))
+            self._permanent = False
+
+            chunk_queue = queue.Queue()
+            for index in pending:
+                chunk_queue.put(index)
+            failed = []
+            with ThreadPoolExecutor(min(self.channels, len(pending))) as executor:
+                for _ in range(min(self.channels, len(pending))):
+                    executor.submit(self._channel, local_path, part_path, st.st_size, chunk_queue, failed, confirmed)
+
+            # Chunks left in the queue because all channels failed are retried as well.
+            while not chunk_queue.empty():
+                failed.append(chunk_queue.get_nowait())
+            pending = sorted(failed)
+            report.n_retried += len(failed)
+
+        report.duration = time.perf_counter() - t0
+        if pending:
+            report.errors.append((local_path, "{} chunks failed after {} retries, last error: {}".format(
+                len(pending), self.max_retries, self._last_error)))
+            if self._permanent:
+                self._remove_state(state_path)
+            return report
+
+        with self.ssh_pool.sftp() as sftp:
+            with self._permanent_errors(state_path):
+                sftp.posix_rename(part_path, remote_path)
+        self._remove_state(state_path)
+        return report
+
+    @staticmethod
+    def state_path(local_path):
+        """Returns the path of the file the progress of an upload of `local_path` is saved in."""
+        return local_path + ".upload.json"
+
+    @classmethod
+    def saved_state(cls, local_path):
+        """
+        Returns the saved state of an interrupted upload of a file, or None
+        if there is none or the file changed since.
+        """
+        try:
+            st = os.stat(local_path)
+            with open(cls.state_path(local_path)) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(state, dict) or (state.get("size"), state.get("mtime_ns")) != (st.st_size, st.st_mtime_ns):
+            return None
+        return state
+
+    @contextmanager
+    def _permanent_errors(self, state_path):
+        # Errors of the server about the file itself won't go away by resuming.
+        try:
+            yield
+        except (FileNotFoundError, PermissionError):
+            self._remove_state(state_path)
+            raise
+
+    @staticmethod
+    def _remove_state(state_path):
+        try:
+            os.remove(state_path)
+        except FileNotFoundError:
+            pass
+
+    def _chunk_length(self, index, size):
+        return max(0, min(self.chunk_size, size - index * self.chunk_size))
+
+    def _channel(self, local_path, part_path, size, chunk_queue, failed, confirmed):
+        # Uploads chunks from the queue over a single connection until the queue
+        # is empty. On an error the chunk is marked as failed and the channel
+        # stops, since its connection may be broken. The other channels carry on.
+        index = None
+        try:
+            with self.ssh_pool.connection() as ssh_client:
+                sftp = ssh_client.open_sftp()
+                try:
+                    with open(local_path, "rb") as local_file, sftp.open(part_path, "r+b") as remote_file:
+                        remote_file.set_pipelined(True)
+                        while True:
+                            try:
+                                index = chunk_queue.get_nowait()
+                            except queue.Empty:
+                                index = None
+                                return
+
+                            offset = index * self.chunk_size
+                            local_file.seek(offset)
+                            data = local_file.read(self._chunk_length(index, size))
+                            digest = hashlib.sha256(data).hexdigest()
+
+                            remote_file.seek(offset)
+                            remote_file.write(data)
+                            remote_file.flush()
+                            # The server handles requests in order, so once the stat returns all writes are done.
+                            remote_file.stat()
+
+                            if self._remote_sha256(ssh_client, remote_file, part_path, offset, len(data)) != digest:
+                                raise ChecksumError("Checksum mismatch of chunk {}".format(index))
+                            confirmed(index, digest)
+                finally:
+                    sftp.close()
+        except Exception as e:
+            with self._lock:
+                self._last_error = "{}: {}".format(type(e).__name__, e)
+                # Only the outcome of the last attempt counts, a mismatch may have been a broken connection.
+                self._permanent = isinstance(e, ChecksumError)
+                if index is not None:
+                    failed.append(index)
+
+    def _remote_sha256(self, ssh_client, remote_file, path, offset, length):
+        if self._check_method != "exec":
+            try:
+                digest = remote_file.check("sha256", offset, length, 0).hex()
+                self._check_method = "check"
+                return digest
+            except IOError:
+                if self._check_method == "check":
+                    raise
+                self._check_method = "exec"
+
+        _, stdout, _ = ssh_client.exec_command("tail -c +{} {} | head -c {} | sha256sum".format(
+            offset + 1, shlex.quote(path), length))
+        return stdout.read().split()[0].decode()
+
+    def _load_state(self, state_path, remote_path, st):
+        state = {
+            "remote_path": remote_path,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "chunk_size": self.chunk_size,
+            "done": {},
+        }
+        try:
+            with open(state_path) as f:
+                old_state = json.load(f)
+        except (IOError, ValueError):
+            return state
+
+        # Only resume uploads of the same file, to the same place, with the same chunks.
+        if all(old_state.get(key) == state[key] for key in ("remote_path", "size", "mtime_ns", "chunk_size")):
+            state["done"] = old_state.get("done", {})
+        return state
+
+    @staticmethod
+    def _save_state(state_path, state):
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, state_path)
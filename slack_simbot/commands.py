@@ -0,0 +1,212 @@
+"""This module contains the handler of the /simbot slash command, served over http or Socket Mode."""
+
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+import sys
+import time
+from collections import deque
+from urllib.parse import parse_qs
+
+from slack_simbot.event_loop import get_event_loop
+
+
+HELP_TEXT = ("`/simbot status` shows all running batches.\n"
+             "`/simbot status <batch>` shows the progress of a batch.\n"
+             "`/simbot cancel <batch>` asks a batch to stop.")
+
+
+def status_text(batch):
+    """Returns the status of a running batch, from its in-memory state."""
+    elapsed = datetime.datetime.now() - batch.start_time
+    lines = ["*{}* _{}_".format(batch.title, batch.description),
+             "*progress* {}/{}".format(len(batch.cases), batch.n_cases)]
+    if batch.cases.n_failed or batch.cases.n_skipped:
+        lines.append("*failed* {}, *skipped* {}".format(batch.cases.n_failed, batch.cases.n_skipped))
+    lines.append("*last case* {}".format(batch.cases.last or "none"))
+    lines.append("*running for* {}".format(str(elapsed).split(".")[0]))
+    lines.append("*eta* {}".format(batch.eta_text()))
+    if batch.resources is not None:
+        lines.append("*resources* {}".format(batch.resources.text()))
+    if batch.cancel_token.cancelled:
+        lines.append("*cancel requested* by {}".format(batch.cancel_token.by or "unknown"))
+    return "\n".join(lines)
+
+
+class CommandHandler:
+    """
+    Answers `/simbot status` and `/simbot cancel` from the state of the running batches.
+
+    The batches are the ones registered with the simbot, which every batch
+    of an active simbot is until it finishes. Batches are found by their
+    title, case insensitively, or by a unique prefix of it. Because status
+    is available on demand, push updates can be sent less often, e.g. with
+    a larger `update_interval`.
+
+    Commands reach the handler through `serve_http`, a local http endpoint
+    a Slack app's slash command can point to, or `connect_socket_mode`,
+    which needs no public endpoint. Both run on the secondary event loop
+    and require the `aiohttp` package.
+
+    :param simbot: SimBot whose batches are reported on.
+    :param signing_secret: Signing secret of the Slack app. Requests to the
+                           http endpoint aren't verified if None.
+    :param allowed_users: Optional ids of the users allowed to cancel batches.
+    """
+
+    def __init__(self, simbot, signing_secret=None, allowed_users=None):
+        self.simbot = simbot
+        self.signing_secret = signing_secret
+        self.allowed_users = set(allowed_users) if allowed_users is not None else None
+        self.loop = get_event_loop(debug_enabled=False)
+        self.n_commands = 0
+        self.errors = deque(maxlen=100)
+        self._runner = None
+        self._socket_task = None
+        self.port = None
+
+    def find(self, name):
+        """Returns the running batches matching a title or title prefix."""
+        batches = self.simbot.running_batches()
+        name = name.strip().lower()
+        exact = [batch for batch in batches if batch.title.lower() == name]
+        return exact or [batch for batch in batches if batch.title.lower().startswith(name)]
+
+    def handle(self, text, user_id=None):
+        """Runs a command and returns the response as a dictionary Slack can show."""
+        self.n_commands += 1
+        self.simbot.metrics.inc("simbot_commands_total")
+        command, _, argument = (text or "").strip().partition(" ")
+        command = command.lower()
+
+        if command == "status" and not argument.strip():
+            batches = self.simbot.running_batches()
+            if not batches:
+                return self._response("No batches are running.")
+            return self._response("\n".join("*{}* {}/{}, eta {}".format(
+                batch.title, len(batch.cases), batch.n_cases, batch.eta_text()) for batch in batches))
+
+        if command not in ("status", "cancel"):
+            return self._response(HELP_TEXT)
+
+        batches = self.find(argument)
+        if not batches:
+            return self._response("No running batch matches '{}'.".format(argument.strip()))
+        if len(batches) > 1:
+            return self._response("'{}' matches {}.".format(
+                argument.strip(), ", ".join("'{}'".format(batch.title) for batch in batches)))
+        batch, = batches
+
+        if command == "status":
+            return self._response(status_text(batch))
+
+        if self.allowed_users is not None and user_id not in self.allowed_users:
+            return self._response("You are not allowed to cancel batches.")
+        batch.cancel_token.cancel("<@{}>".format(user_id) if user_id else None)
+        return self._response("Asked batch '{}' to stop at {}/{}.".format(batch.title, len(batch.cases),
+                                                                          batch.n_cases), in_channel=True)
+
+    @staticmethod
+    def _response(text, in_channel=False):
+        return {"response_type": "in_channel" if in_channel else "ephemeral", "text": text}
+
+    def verify(self, body, timestamp, signature, now=None):
+        """Checks the signature Slack sends with a request. Always True without a signing secret."""
+        if self.signing_secret is None:
+            return True
+        try:
+            if abs((time.time() if now is None else now) - int(timestamp)) > 300:
+                return False
+        except (TypeError, ValueError):
+            return False
+        base = b"v0:" + str(timestamp).encode() + b":" + body
+        expected = "v0=" + hmac.new(self.signing_secret.encode(), base, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature or "")
+
+    # Http endpoint
+
+    def serve_http(self, host="127.0.0.1", port=0, path="/slack/commands"):
+        """
+        Starts answering slash commands posted to http://host:port/path.
+
+        :return: The port the endpoint listens on.
+        """
+        asyncio.run_coroutine_threadsafe(self._serve_http(host, port, path), self.loop).result()
+        return self.port
+
+    async def _serve_http(self, host, port, path):
+        from aiohttp import web
+
+        async def handle(request):
+            body = await request.read()
+            if not self.verify(body, request.headers.get("X-Slack-Request-Timestamp"),
+                               request.headers.get("X-Slack-Signature")):
+                return web.Response(status=401)
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            return web.json_response(self.handle(form.get("text"), form.get("user_id")))
+
+        app = web.Application()
+        app.router.add_post(path, handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    # Socket Mode
+
+    def connect_socket_mode(self, app_token, url="https://slack.com/api/apps.connections.open", reconnect_delay=5.):
+        """
+        Starts receiving slash commands over a Socket Mode websocket.
+
+        A websocket url is requested from `url` with the app level token,
+        and requested again whenever Slack closes the connection.
+
+        :param app_token: App level token, starting with 'xapp-'.
+        """
+        self._socket_task = asyncio.run_coroutine_threadsafe(
+            self._socket_mode(app_token, url, reconnect_delay), self.loop)
+
+    async def _socket_mode(self, app_token, url, reconnect_delay):
+        import aiohttp
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.post(url, headers={"Authorization": "Bearer " + app_token}) as response:
+                        result = await response.json()
+                    if not result.get("ok"):
+                        raise ConnectionError("apps.connections.open failed: {}".format(result.get("error")))
+                    async with session.ws_connect(result["url"], heartbeat=30) as ws:
+                        async for message in ws:
+                            if message.type != aiohttp.WSMsgType.TEXT:
+                                break
+                            if not await self._on_envelope(ws, json.loads(message.data)):
+                                break
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    self.errors.append(sys.exc_info())
+                await asyncio.sleep(reconnect_delay)
+
+    async def _on_envelope(self, ws, envelope):
+        # Returns False when Slack asks to reconnect.
+        if envelope.get("type") == "disconnect":
+            return False
+        if "envelope_id" not in envelope:
+            return True
+        ack = {"envelope_id": envelope["envelope_id"]}
+        if envelope.get("type") == "slash_commands":
+            payload = envelope.get("payload", {})
+            ack["payload"] = self.handle(payload.get("text"), payload.get("user_id"))
+        await ws.send_str(json.dumps(ack))
+        return True
+
+    def close(self):
+        if self._socket_task is not None:
+            self._socket_task.cancel()
+            self._socket_task = None
+        if self._runner is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result()
+            self._runner = None
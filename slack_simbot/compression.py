@@ -0,0 +1,434 @@
+"""This module contains the streaming, parallel zip compressor used to archive result directories."""
+
+import os
+import stat
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+
+# Zip compression methods.
+STORED = 0
+DEFLATED = 8
+ZSTANDARD = 93
+
+CODECS = {
+    "none": STORED,
+    "deflate": DEFLATED,
+    "zstd": ZSTANDARD,
+}
+
+DEFAULT_LEVELS = {
+    "none": None,
+    "deflate": 6,
+    "zstd": 3,
+}
+
+# Files with these extensions are already compressed and are stored as is.
+STORED_EXTENSIONS = frozenset([
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".lzma", ".zst", ".7z", ".rar", ".npz",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".ogg", ".mp4", ".mkv", ".avi", ".webm",
+])
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_MAX = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+# Final, empty deflate block used to terminate the stream of a file that failed half way.
+_DEFLATE_END = zlib.compressobj(6, zlib.DEFLATED, -15).flush()
+
+
+class CompressionReport:
+    """Summary of a compression run, including the files that could not be archived."""
+
+    def __init__(self, path, codec):
+        self.path = path
+        self.codec = codec
+        self.n_files = 0
+        self.n_dirs = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.duration = 0.
+        self.errors = []
+        self.upload = None
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    @property
+    def ratio(self):
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.
+
+    def __repr__(self):
+        return "<CompressionReport {} files, {} -> {} bytes, {} errors>".format(
+            self.n_files, self.bytes_in, self.bytes_out, len(self.errors))
+
+
+# CRC-32 combination as done by zlib's crc32_combine. The crc of two
+# concatenated chunks is computed from the crc of each chunk, so the chunks
+# of a file can be compressed independently in different processes.
+
+def _gf2_matrix_times(mat, vec):
+    s = 0
+    i = 0
+    while vec:
+        if vec & 1:
+            s ^= mat[i]
+        vec >>= 1
+        i += 1
+    return s
+
+
+def _gf2_matrix_square(mat):
+    return [_gf2_matrix_times(mat, mat[n]) for n in range(32)]
+
+
+@lru_cache(maxsize=16)
+def _crc32_zeros_operator(length):
+    # Operator for a single zero bit, squared three times to get one for a zero byte.
+    op = [0xEDB88320] + [1 << n for n in range(31)]
+    for _ in range(3):
+        op = _gf2_matrix_square(op)
+
+    result = None
+    while length:
+        if length & 1:
+            result = op if result is None else [_gf2_matrix_times(op, v) for v in result]
+        length >>= 1
+        if length:
+            op = _gf2_matrix_square(op)
+    return result
+
+
+def crc32_combine(crc1, crc2, length2):
+    """Returns the crc32 of two concatenated blocks of data given the crc32 of each and the length of the second."""
+    if length2 == 0:
+        return crc1
+    return _gf2_matrix_times(_crc32_zeros_operator(length2), crc1) ^ crc2
+
+
+def _deflate_chunk(path, offset, length, level, last):
+    # Runs in the worker processes. The chunk is compressed as an independent
+    # raw deflate stream. All but the last one end with a full flush so they
+    # can be concatenated into a single valid stream.
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    out = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+    return out, zlib.crc32(data), len(data)
+
+
+class _InlineFuture:
+    # Stands in for a concurrent future when no process pool is used.
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def result(self):
+        return self.fn(*self.args)
+
+    def cancel(self):
+        return True
+
+
+def _dos_date_time(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class _Entry:
+    def __init__(self, path, arcname, st, method):
+        self.path = path
+        self.arcname = arcname
+        self.is_dir = stat.S_ISDIR(st.st_mode)
+        self.size = 0 if self.is_dir else st.st_size
+        self.mtime = st.st_mtime
+        self.mode = st.st_mode
+        self.method = method
+        self.zip64 = self.size * 1.05 > ZIP64_LIMIT
+        self.crc = 0
+        self.compressed = 0
+        self.uncompressed = 0
+        self.offset = None
+        self.failed = False
+
+
+class ZipStreamWriter:
+    """
+    Writes a zip archive to a write-only stream.
+
+    The stream only needs a `write` method, so the archive can be written
+    directly into a socket or remote file. Entries use data descriptors and
+    zip64 extensions when needed.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.entries = []
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def begin(self, entry):
+        entry.offset = self.offset
+        name = entry.arcname.encode("utf-8")
+        dos_time, dos_date = _dos_date_time(entry.mtime)
+        flags = 0x800 if entry.is_dir else 0x808
+        if entry.zip64:
+            extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+            size = ZIP_MAX
+        else:
+            extra = b""
+            size = 0
+        self._write(struct.pack("<IHHHHHIIIHH", 0x04034B50, self._version(entry), flags, entry.method,
+                                dos_time, dos_date, 0, size, size, len(name), len(extra)))
+        self._write(name)
+        self._write(extra)
+        self.entries.append(entry)
+
+    def write(self, entry, data, crc, length):
+        self._write(data)
+        entry.crc = crc32_combine(entry.crc, crc, length)
+        entry.compressed += len(data)
+        entry.uncompressed += length
+
+    def end(self, entry):
+        if entry.is_dir:
+            return
+        if entry.zip64:
+            self._write(struct.pack("<IIQQ", 0x08074B50, entry.crc, entry.compressed, entry.uncompressed))
+        else:
+            self._write(struct.pack("<IIII", 0x08074B50, entry.crc, entry.compressed, entry.uncompressed))
+
+    @staticmethod
+    def _version(entry):
+        if entry.method == ZSTANDARD:
+            return 63
+        if entry.zip64:
+            return 45
+        return 20
+
+    def close(self):
+        """Writes the central directory."""
+        cd_offset = self.offset
+        for entry in self.entries:
+            name = entry.arcname.encode("utf-8")
+            dos_time, dos_date = _dos_date_time(entry.mtime)
+            flags = 0x800 if entry.is_dir else 0x808
+
+            zip64_fields = []
+            uncompressed, compressed, offset = entry.uncompressed, entry.compressed, entry.offset
+            if uncompressed >= ZIP_MAX or entry.zip64:
+                zip64_fields.append(uncompressed)
+                uncompressed = ZIP_MAX
+            if compressed >= ZIP_MAX or entry.zip64:
+                zip64_fields.append(compressed)
+                compressed = ZIP_MAX
+            if offset >= ZIP_MAX:
+                zip64_fields.append(offset)
+                offset = ZIP_MAX
+            extra = struct.pack("<HH{}Q".format(len(zip64_fields)), 1, 8 * len(zip64_fields),
+                                *zip64_fields) if zip64_fields else b""
+
+            external_attr = (entry.mode & 0xFFFF) << 16
+            if entry.is_dir:
+                external_attr |= 0x10
+            version = max(self._version(entry), 45 if zip64_fields else 20)
+            self._write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | version, version, flags,
+                                    entry.method, dos_time, dos_date, entry.crc, compressed, uncompressed,
+                                    len(name), len(extra), 0, 0, 0, external_attr, offset))
+            self._write(name)
+            self._write(extra)
+
+        cd_size = self.offset - cd_offset
+        n_entries = len(self.entries)
+        if n_entries > ZIP_MAX_ENTRIES or cd_size > ZIP_MAX or cd_offset > ZIP_MAX:
+            zip64_offset = self.offset
+            self._write(struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, (3 << 8) | 45, 45, 0, 0,
+                                    n_entries, n_entries, cd_size, cd_offset))
+            self._write(struct.pack("<IIQI", 0x07064B50, 0, zip64_offset, 1))
+            n_entries = min(n_entries, ZIP_MAX_ENTRIES)
+            cd_size = min(cd_size, ZIP_MAX)
+            cd_offset = min(cd_offset, ZIP_MAX)
+        self._write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, n_entries, n_entries, cd_size, cd_offset, 0))
+
+
+def walk_directory(dir_path):
+    """Yields (path, arcname, stat) of the directory and everything in it, with arc names relative to its parent."""
+    parent = os.path.dirname(os.path.abspath(dir_path))
+    for root, sub_dirs, files in os.walk(dir_path):
+        sub_dirs.sort()
+        for path in [root] + [os.path.join(root, name) for name in sorted(files)]:
+            arcname = os.path.relpath(os.path.abspath(path), parent).replace(os.sep, "/")
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                yield path, arcname, e
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                arcname += "/"
+            yield path, arcname, st
+
+
+def write_archive(dir_path, fileobj, codec="deflate", level=None, workers=None,
+                  chunk_size=DEFAULT_CHUNK_SIZE, stored_extensions=STORED_EXTENSIONS, visit=None):
+    """
+    Compresses a directory into a zip archive written to `fileobj`.
+
+    Large files are split into chunks that are deflated in parallel by a
+    process pool. At most two chunks per worker are in memory at any time.
+    Files with an extension in `stored_extensions` are stored without
+    recompressing them. The `zstd` codec requires the `zstandard` package
+    and uses its own worker threads instead of the process pool.
+
+    Files that cannot be read are left out of the archive or truncated and
+    listed in the errors of the returned report.
+
+    :param dir_path: Directory to compress.
+    :param fileobj: Writable binary stream the archive is written to.
+    :param codec: One of 'none', 'deflate' or 'zstd'.
+    :param level: Compression level. Uses the codec's default if None.
+    :param workers: Number of worker processes. Uses all cores if None.
+    :param chunk_size: Size of the chunks files are split into.
+    :param stored_extensions: Extensions of files that are stored as is.
+    :param visit: Optional callable called with the (path, arcname, stat) of
+                  everything walked, so others can reuse the walk, e.g. Digest.add.
+    :return: CompressionReport
+    """
+    if codec not in CODECS:
+        raise ValueError("Unknown codec '{}', expected one of {}".format(codec, ", ".join(CODECS)))
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    workers = workers or os.cpu_count() or 1
+
+    zstd_compressor = None
+    if codec == "zstd":
+        import zstandard
+        zstd_compressor = zstandard.ZstdCompressor(level=level, threads=workers)
+
+    t0 = time.perf_counter()
+    report = CompressionReport(getattr(fileobj, "name", None), codec)
+    writer = ZipStreamWriter(fileobj)
+    pool = ProcessPoolExecutor(workers) if codec == "deflate" and workers > 1 else None
+    window = deque()
+
+    def consume():
+        entry, offset, length, future = window.popleft()
+        if entry.failed:
+            if future is not None:
+                future.cancel()
+            return
+
+        if future is None:
+            _write_inline(writer, entry, report, chunk_size, zstd_compressor)
+            return
+
+        try:
+            data, crc, n_read = future.result()
+            if n_read != length:
+                raise OSError("File changed while it was being compressed")
+        except Exception as e:
+            entry.failed = True
+            report.errors.append((entry.path, str(e)))
+            if offset == 0:
+                return
+            # Terminate the partial deflate stream so the archive stays valid.
+            data, crc, n_read = _DEFLATE_END, 0, 0
+            writer.write(entry, data, crc, n_read)
+            writer.end(entry)
+            return
+
+        if offset == 0:
+            writer.begin(entry)
+            report.n_files += 1
+        writer.write(entry, data, crc, n_read)
+        report.bytes_in += n_read
+        if offset + length >= entry.size:
+            writer.end(entry)
+
+    try:
+        for path, arcname, st in walk_directory(dir_path):
+            if visit is not None:
+                visit(path, arcname, st)
+            if isinstance(st, Exception):
+                report.errors.append((path, str(st)))
+                continue
+
+            _, ext = os.path.splitext(path)
+            if stat.S_ISDIR(st.st_mode) or codec == "none" or ext.lower() in stored_extensions:
+                entry = _Entry(path, arcname, st, STORED)
+            else:
+                entry = _Entry(path, arcname, st, CODECS[codec])
+
+            if entry.method != DEFLATED:
+                window.append((entry, 0, entry.size, None))
+            else:
+                for offset in range(0, max(entry.size, 1), chunk_size):
+                    length = min(chunk_size, entry.size - offset)
+                    last = offset + length >= entry.size
+                    if pool is None:
+                        future = _InlineFuture(_deflate_chunk, path, offset, length, level, last)
+                    else:
+                        future = pool.submit(_deflate_chunk, path, offset, length, level, last)
+                    window.append((entry, offset, length, future))
+                    while len(window) > 2 * workers:
+                        consume()
+            while len(window) > 2 * workers:
+                consume()
+
+        while window:
+            consume()
+        writer.close()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    report.n_dirs = sum(1 for entry in writer.entries if entry.is_dir)
+    report.bytes_out = writer.offset
+    report.duration = time.perf_counter() - t0
+    return report
+
+
+def _write_inline(writer, entry, report, chunk_size, zstd_compressor):
+    # Writes directories, stored files and zstd compressed files from the calling thread.
+    if entry.is_dir:
+        writer.begin(entry)
+        return
+
+    try:
+        f = open(entry.path, "rb")
+    except OSError as e:
+        report.errors.append((entry.path, str(e)))
+        return
+
+    with f:
+        writer.begin(entry)
+        report.n_files += 1
+        compressor = zstd_compressor.compressobj() if entry.method == ZSTANDARD else None
+        remaining = entry.size
+        try:
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    raise OSError("File changed while it was being compressed")
+                remaining -= len(data)
+                out = data if compressor is None else compressor.compress(data)
+                writer.write(entry, out, zlib.crc32(data), len(data))
+                report.bytes_in += len(data)
+        except Exception as e:
+            report.errors.append((entry.path, str(e)))
+        finally:
+            if compressor is not None:
+                writer.write(entry, compressor.flush(), 0, 0)
+            writer.end(entry)
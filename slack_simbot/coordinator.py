@@ -0,0 +1,161 @@
+"""This module contains the coordinator aggregating case reports of a batch run by several processes or nodes."""
+
+import asyncio
+import functools
+import json
+import os
+import socket
+import tempfile
+import time
+
+from slack_simbot.event_loop import get_event_loop
+
+
+class BatchCoordinator:
+    """
+    Receives case reports from worker processes and forwards them to a batch.
+
+    Listens on a unix socket, or on a tcp address for workers on other
+    nodes, on the secondary event loop. Workers send one json object per
+    line using a BatchReporter. Each report is passed to the batch's
+    `update`, so the owning process renders a single progress message. The
+    updates run on the event loop's default executor, since they may write
+    to the outbox or the run history. The batch's updates are switched to
+    the asynchronous dispatcher, so slack traffic is coalesced no matter
+    how many workers report.
+
+    :param batch: BatchMsgHandle the reports are forwarded to.
+    :param address: Path of the unix socket or (host, port) tuple. A unix
+                    socket in the temporary directory is used if None.
+    :param secret: Optional string workers have to send along with their reports.
+    """
+
+    def __init__(self, batch, address=None, secret=None):
+        self.batch = batch
+        self.secret = secret
+        self.n_reports = 0
+        self.n_rejected = 0
+        self.loop = get_event_loop(debug_enabled=False)
+        self.address = address or os.path.join(
+            tempfile.gettempdir(), "simbot_{}_{}.sock".format(os.getpid(), id(self)))
+        batch.async_updates = True
+        if batch.simbot.active:
+            # The dispatcher waits for the event loop when it's created, so it
+            # can't be created lazily by an update running on the loop.
+            batch.simbot.dispatcher
+        self.server = asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    async def _start(self):
+        if isinstance(self.address, str):
+            return await asyncio.start_unix_server(self._handle, path=self.address)
+        host, port = self.address
+        server = await asyncio.start_server(self._handle, host, port)
+        # Use the actual port in case port 0 was requested.
+        self.address = (host, server.sockets[0].getsockname()[1])
+        return server
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    report = json.loads(line.decode("utf-8"))
+                    case_name = report["case"]
+                except (ValueError, KeyError, TypeError):
+                    self.n_rejected += 1
+                    continue
+                if self.secret is not None and report.get("secret") != self.secret:
+                    self.n_rejected += 1
+                    continue
+                self.n_reports += 1
+                await self.loop.run_in_executor(None, functools.partial(
+                    self.batch.update, case_name, start_time=report.get("start"), end_time=report.get("end"),
+                    status=report.get("status", "ok")))
+        finally:
+            writer.close()
+
+    def reporter(self):
+        """Returns a BatchReporter connected to this coordinator. It can be passed to other processes."""
+        address = self.address
+        if not isinstance(address, str) and address[0] in ("", "0.0.0.0", "::"):
+            address = (socket.getfqdn(), address[1])
+        return BatchReporter(address, secret=self.secret)
+
+    async def _close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def close(self):
+        """Stops listening for reports."""
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop).result()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class BatchReporter:
+    """
+    Reports finished cases to a BatchCoordinator.
+
+    Reporters are picklable and connect lazily, so one can be passed to the
+    workers of a multiprocessing pool or sent to another node. Each process
+    opens its own connection.
+    """
+
+    def __init__(self, address, secret=None):
+        self.address = address
+        self.secret = secret
+        self._socket = None
+        self._pid = None
+
+    def _connect(self):
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.address)
+        else:
+            sock = socket.create_connection(tuple(self.address))
+        self._socket = sock
+        self._pid = os.getpid()
+
+    def report(self, case_name, status="ok", start_time=None, end_time=None):
+        """
+        Reports a finished case.
+
+        :param case_name: Name of the case.
+        :param status: One of 'ok', 'failed' or 'skipped'.
+        :param start_time: Unix time the case started at, if known.
+        :param end_time: Unix time the case finished at. Defaults to now.
+        """
+        report = {
+            "case": case_name,
+            "status": status,
+            "start": start_time,
+            "end": time.time() if end_time is None else end_time,
+        }
+        if self.secret is not None:
+            report["secret"] = self.secret
+        data = (json.dumps(report) + "\n").encode("utf-8")
+
+        # Reconnect once if the connection was lost or was inherited from a parent process.
+        for attempt in range(2):
+            if self._socket is None or self._pid != os.getpid():
+                self._connect()
+            try:
+                self._socket.sendall(data)
+                return
+            except OSError:
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self._socket is not None and self._pid == os.getpid():
+            self._socket.close()
+        self._socket = None
+
+    def __getstate__(self):
+        return {"address": self.address, "secret": self.secret}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
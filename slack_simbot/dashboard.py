@@ -0,0 +1,116 @@
+"""This module contains the dashboard summarizing many batches in a single message."""
+
+import asyncio
+import sys
+import threading
+from collections import deque
+
+from slack_simbot.event_loop import get_event_loop
+
+
+# Slack shows at most 100 attachments per message.
+MAX_ATTACHMENTS = 100
+
+
+class BatchDashboard:
+    """
+    Single Slack message showing the progress of several batches.
+
+    Batches created with `dashboard=` don't post messages of their own.
+    Their updates only replace their attachment in the dashboard, and the
+    message is re-rendered every `interval` seconds from the secondary event
+    loop if anything changed. The number of api calls therefore depends on
+    the interval, not on the number of batches or cases. Finished batches
+    keep their final summary in the dashboard.
+
+    :param simbot: SimBot used to send the message.
+    :param title: Title shown at the top of the message.
+    :param channel: Channel of the message. Uses the simbot's default channel if None.
+    :param interval: Number of seconds between re-renders.
+    """
+
+    def __init__(self, simbot, title="Simulation batches", channel=None, interval=5.):
+        self.simbot = simbot
+        self.title = title
+        self.interval = interval
+        self.n_renders = 0
+        self.errors = deque(maxlen=100)
+        self._batches = {}
+        self._version = 0
+        self._rendered_version = 0
+        self._lock = threading.Lock()
+
+        self.handle = simbot.post_message(
+            channel=channel or simbot.default_channel,
+            text=self._header(),
+            as_user="1",
+            parse="full",
+            link_names="1"
+        )
+        if simbot.outbox is None:
+            # Create the dispatcher here, it can't be created from the event loop.
+            simbot.dispatcher
+        self.loop = get_event_loop(debug_enabled=False)
+        self._task = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+
+    def add(self, batch):
+        """Adds a batch to the dashboard. Called by BatchMsgHandle."""
+        self.set(batch, [{"title": batch.title, "text": "_{}_\n*starting*".format(batch.description),
+                          "color": "#3AA3E3", "mrkdwn_in": ["text"]}])
+
+    def set(self, batch, attachments, finished=False):
+        """Replaces the attachments shown for a batch. They are sent with the next render."""
+        with self._lock:
+            self._batches[id(batch)] = (attachments, finished)
+            self._version += 1
+
+    def _header(self):
+        n_finished = sum(finished for _, finished in self._batches.values())
+        return "*{}*  {} running, {} finished".format(self.title, len(self._batches) - n_finished, n_finished)
+
+    def render(self):
+        """Returns the text and attachments of the message."""
+        with self._lock:
+            attachments = [attachment for batch_attachments, _ in self._batches.values()
+                           for attachment in batch_attachments]
+            text = self._header()
+        if len(attachments) > MAX_ATTACHMENTS:
+            n_hidden = len(attachments) - MAX_ATTACHMENTS + 1
+            attachments = attachments[:MAX_ATTACHMENTS - 1] + [{"text": "... and {} more".format(n_hidden)}]
+        return text, attachments
+
+    def refresh(self):
+        """Sends the current state of the batches if it changed since the last render."""
+        with self._lock:
+            version = self._version
+        if version == self._rendered_version or self.handle is None:
+            return False
+        text, attachments = self.render()
+        self._rendered_version = version
+        self.n_renders += 1
+        kwargs = dict(text=text, attachments=attachments, parse="full", link_names="1", as_user="1")
+        if self.simbot.outbox is not None:
+            self.simbot.message_call("chat.update", self.handle, **kwargs)
+        else:
+            # The dispatcher doesn't block, so this can run on the event loop.
+            self.simbot.dispatcher.submit("chat.update", ts=self.handle.ts, channel=self.handle.channel, **kwargs)
+        return True
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception:
+                # Keep rendering, a later render sends the latest state anyway.
+                self.errors.append(sys.exc_info())
+
+    def close(self, timeout=None):
+        """Stops re-rendering after sending the final state of the batches."""
+        self._task.cancel()
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), self.loop).result()
+        self.refresh()
+        if self.simbot.outbox is not None:
+            self.simbot.outbox.flush(timeout)
+        else:
+            self.simbot.dispatcher.flush(timeout)
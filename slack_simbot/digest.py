@@ -0,0 +1,304 @@
+"""This module contains the digest summarizing the contents of a result directory."""
+
+import heapq
+import itertools
+import os
+import stat
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from slack_simbot.compression import walk_directory
+from slack_simbot.resources import format_bytes
+
+
+# Files the column statistics are computed of. numpy is needed for all of
+# them and h5py for hdf5 files. Files of which the package is missing are
+# only counted.
+CSV_EXTENSIONS = frozenset([".csv", ".tsv"])
+NPY_EXTENSIONS = frozenset([".npy"])
+HDF5_EXTENSIONS = frozenset([".h5", ".hdf5", ".hdf"])
+
+# Number of rows read at a time, which bounds the memory used per file.
+DEFAULT_BLOCK_ROWS = 65536
+
+
+class ColumnStats:
+    """Count, NaN count, minimum, maximum and sum of a column, which can be merged with those of other files."""
+
+    __slots__ = ("count", "nan", "min", "max", "sum")
+
+    def __init__(self, count=0, nan=0, min=None, max=None, sum=0.):
+        self.count = count
+        self.nan = nan
+        self.min = min
+        self.max = max
+        self.sum = sum
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def merge(self, other):
+        self.count += other.count
+        self.nan += other.nan
+        self.sum += other.sum
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def __repr__(self):
+        return "<ColumnStats count={} nan={} min={} max={} mean={}>".format(
+            self.count, self.nan, self.min, self.max, self.mean)
+
+
+def _block_stats(np, block):
+    # Returns the ColumnStats of each column of a 2d float block, computed with a few vectorized passes.
+    nan_mask = np.isnan(block)
+    nan = nan_mask.sum(axis=0)
+    count = block.shape[0] - nan
+    stats = []
+    with np.errstate(invalid="ignore"):
+        sums = np.nansum(block, axis=0)
+        filled_low = np.where(nan_mask, np.inf, block).min(axis=0) if block.shape[0] else None
+        filled_high = np.where(nan_mask, -np.inf, block).max(axis=0) if block.shape[0] else None
+    for i in range(block.shape[1]):
+        if count[i]:
+            stats.append(ColumnStats(int(count[i]), int(nan[i]), float(filled_low[i]), float(filled_high[i]),
+                                     float(sums[i])))
+        else:
+            stats.append(ColumnStats(0, int(nan[i])))
+    return stats
+
+
+def _merge_columns(columns, names, stats):
+    for name, column_stats in zip(names, stats):
+        columns.setdefault(name, ColumnStats()).merge(column_stats)
+
+
+def _csv_stats(np, path, block_rows):
+    delimiter = "\t" if path.lower().endswith(".tsv") else ","
+    columns = {}
+    with open(path, errors="replace") as f:
+        header = f.readline().strip().split(delimiter)
+        # Numeric first rows are data, the columns are then named by their index.
+        try:
+            first = [float(value) for value in header]
+            names = [str(i) for i in range(len(header))]
+            _merge_columns(columns, names, _block_stats(np, np.array([first])))
+        except ValueError:
+            names = [name.strip().strip('"') for name in header]
+
+        while True:
+            lines = list(itertools.islice(f, block_rows))
+            if not lines:
+                break
+            block = np.genfromtxt(lines, delimiter=delimiter, dtype=float, invalid_raise=False, ndmin=2)
+            if block.size:
+                _merge_columns(columns, names, _block_stats(np, block[:, :len(names)]))
+    return columns
+
+
+def _array_stats(np, name, array, block_rows):
+    # Works on numpy arrays, memory mapped arrays and hdf5 datasets, reading `block_rows` rows at a time.
+    if array.dtype.kind not in "biuf" or array.size == 0:
+        return {}
+    if array.ndim == 0:
+        return {name: _block_stats(np, np.asarray(array, dtype=float).reshape(1, 1))[0]}
+
+    n_columns = 1 if array.ndim == 1 else int(np.prod(array.shape[1:]))
+    names = [name] if n_columns == 1 else ["{}[{}]".format(name, i) for i in range(n_columns)]
+    columns = {}
+    for start in range(0, array.shape[0], block_rows):
+        block = np.asarray(array[start:start + block_rows], dtype=float).reshape(-1, n_columns)
+        _merge_columns(columns, names, _block_stats(np, block))
+    return columns
+
+
+def _npy_stats(np, path, block_rows):
+    array = np.load(path, mmap_mode="r", allow_pickle=False)
+    return _array_stats(np, os.path.splitext(os.path.basename(path))[0], array, block_rows)
+
+
+def _hdf5_stats(np, path, block_rows):
+    import h5py
+    columns = {}
+    with h5py.File(path, "r") as f:
+        datasets = []
+        f.visititems(lambda name, obj: datasets.append(name) if isinstance(obj, h5py.Dataset) else None)
+        for name in datasets:
+            columns.update(_array_stats(np, name, f[name], block_rows))
+    return columns
+
+
+def file_stats(path, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Returns a dictionary with the ColumnStats of each column in a csv, npy or hdf5 file.
+
+    Columns of csv files are named after their header, arrays after their
+    file or dataset name, with the column index for 2d arrays. Runs in the
+    worker processes of a Digest.
+    """
+    import numpy as np
+    ext = os.path.splitext(path)[1].lower()
+    if ext in CSV_EXTENSIONS:
+        return _csv_stats(np, path, block_rows)
+    elif ext in NPY_EXTENSIONS:
+        return _npy_stats(np, path, block_rows)
+    elif ext in HDF5_EXTENSIONS:
+        return _hdf5_stats(np, path, block_rows)
+    return {}
+
+
+def _available(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+class Digest:
+    """
+    Summary of the files in a result directory.
+
+    Counts the files and bytes per extension, keeps the largest files and
+    computes the count, NaN count, minimum, maximum and mean of each column
+    of the csv, npy and hdf5 files, merged over all files with the same
+    column names. The statistics of each file are computed by a process
+    pool, reading the files in blocks of `block_rows` rows, or memory
+    mapped for npy files. At most two files per worker are in flight, so
+    the memory used doesn't depend on the size of the directory.
+
+    Files are added with `add`, which takes the same arguments as the
+    `visit` callback of `write_archive`, so the digest can be computed
+    during the compression's walk of the directory. `scan` walks a
+    directory itself. Column statistics need numpy and, for hdf5 files,
+    h5py. Without them files are only counted.
+
+    :param workers: Number of worker processes. Uses a quarter of the cores
+                    if None, it usually runs next to the compression.
+    :param block_rows: Number of rows read at a time.
+    :param n_largest: Number of largest files kept.
+    """
+
+    def __init__(self, workers=None, block_rows=DEFAULT_BLOCK_ROWS, n_largest=3):
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 4)
+        self.block_rows = block_rows
+        self.n_largest = n_largest
+        self.n_files = 0
+        self.n_bytes = 0
+        self.n_empty = 0
+        self.extensions = {}
+        self.columns = {}
+        self.errors = []
+        self._largest = []
+        self._extensions = set()
+        if _available("numpy"):
+            self._extensions |= CSV_EXTENSIONS | NPY_EXTENSIONS
+            if _available("h5py"):
+                self._extensions |= HDF5_EXTENSIONS
+        self._pool = None
+        self._window = deque()
+
+    def add(self, path, arcname=None, st=None):
+        """Adds a file. Directories and stat errors are skipped."""
+        if st is None:
+            st = os.stat(path)
+        if isinstance(st, Exception) or stat.S_ISDIR(st.st_mode):
+            return
+
+        ext = os.path.splitext(path)[1].lower()
+        self.n_files += 1
+        self.n_bytes += st.st_size
+        self.n_empty += st.st_size == 0
+        n, size = self.extensions.get(ext, (0, 0))
+        self.extensions[ext] = (n + 1, size + st.st_size)
+        entry = (st.st_size, arcname or path)
+        if len(self._largest) < self.n_largest:
+            heapq.heappush(self._largest, entry)
+        elif entry > self._largest[0]:
+            heapq.heapreplace(self._largest, entry)
+
+        if ext not in self._extensions or st.st_size == 0:
+            return
+        if self._pool is None and self.workers > 1:
+            self._pool = ProcessPoolExecutor(self.workers)
+        if self._pool is None:
+            self._window.append((path, None))
+        else:
+            self._window.append((path, self._pool.submit(file_stats, path, self.block_rows)))
+        while len(self._window) > 2 * self.workers:
+            self._consume()
+
+    def _consume(self):
+        path, future = self._window.popleft()
+        try:
+            columns = file_stats(path, self.block_rows) if future is None else future.result()
+        except Exception as e:
+            self.errors.append((path, str(e)))
+            return
+        for name, column_stats in columns.items():
+            self.columns.setdefault(name, ColumnStats()).merge(column_stats)
+
+    def scan(self, dir_path):
+        """Adds all files in a directory."""
+        for path, arcname, st in walk_directory(dir_path):
+            self.add(path, arcname, st)
+        return self
+
+    def close(self):
+        """Waits for the statistics of all added files."""
+        try:
+            while self._window:
+                self._consume()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+        return self
+
+    @property
+    def largest(self):
+        return sorted(self._largest, reverse=True)
+
+    def fields(self, max_columns=10):
+        """Returns Slack attachment fields with the summary."""
+        extensions = sorted(self.extensions.items(), key=lambda item: item[1][1], reverse=True)
+        files_text = "{} files, {}".format(self.n_files, format_bytes(self.n_bytes))
+        if self.n_empty:
+            files_text += ", {} empty".format(self.n_empty)
+        files_text += "\n" + ", ".join("{} {}".format(n, ext or "no extension") for ext, (n, _) in extensions[:5])
+        fields = [{
+            "title": "Files",
+            "value": files_text,
+            "short": True
+        }, {
+            "title": "Largest files",
+            "value": "\n".join("{} {}".format(name, format_bytes(size)) for size, name in self.largest),
+            "short": True
+        }]
+
+        if self.columns:
+            # Columns with NaNs first, they are the ones to look at.
+            names = sorted(self.columns, key=lambda name: (-self.columns[name].nan, name))
+            lines = ["{:<20} {:>10} {:>10} {:>10} {:>6}".format("column", "min", "max", "mean", "nan")]
+            for name in names[:max_columns]:
+                column = self.columns[name]
+                lines.append("{:<20} {:>10.4g} {:>10.4g} {:>10.4g} {:>6}".format(
+                    name[:20], *(float("nan") if value is None else value
+                                 for value in (column.min, column.max, column.mean)), column.nan))
+            if len(names) > max_columns:
+                lines.append("... and {} more".format(len(names) - max_columns))
+            fields.append({
+                "title": "Columns",
+                "value": "```{}```".format("\n".join(lines)),
+                "short": False
+            })
+
+        if self.errors:
+            fields.append({
+                "title": "Digest errors",
+                "value": "\n".join("{}: {}".format(path, error) for path, error in self.errors[:5]),
+                "short": False
+            })
+        return fields
@@ -0,0 +1,277 @@
+"""This module contains the cached directory of the users and channels of the workspace."""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Fields of the users and channels kept in the directory and its snapshot.
+USER_FIELDS = ("id", "name", "deleted", "is_bot", "updated")
+PROFILE_FIELDS = ("email", "real_name", "display_name", "image_192")
+CHANNEL_FIELDS = ("id", "name", "is_archived", "is_private", "created")
+
+
+def slim_user(user):
+    slim = {key: user[key] for key in USER_FIELDS if key in user}
+    profile = user.get("profile") or {}
+    slim["profile"] = {key: profile[key] for key in PROFILE_FIELDS if key in profile}
+    return slim
+
+
+def slim_channel(channel):
+    return {key: channel[key] for key in CHANNEL_FIELDS if key in channel}
+
+
+class Directory:
+    """
+    Cache of the users and channels of the workspace with indexed lookups.
+
+    The lists are downloaded page by page using cursor pagination. The users
+    and channels are downloaded at the same time but cached separately, so
+    the users can be looked up even if the token can't list the channels.
+    The next page is requested as soon as its cursor is known, while the
+    previous page is being indexed. Lookups by id, email and display or
+    user name are dictionary lookups and never call the api. Once the cache
+    is older than `ttl` seconds a lookup returns the cached entry and starts
+    a refresh in the background. Single users can be refreshed or looked up
+    by email without downloading the full list.
+
+    The directory is saved to `snapshot_path`, if given, so a new process
+    starts with a warm cache.
+
+    :param api_call: Callable calling a Slack api method, e.g. `SlackClient.api_call`.
+    :param ttl: Age in seconds after which the directory is refreshed.
+    :param snapshot_path: Optional path of the json snapshot.
+    :param page_size: Number of entries requested per page.
+    :param channel_method: Api method listing the channels.
+    :param max_retries: Number of times a rate limited page is retried.
+    """
+
+    def __init__(self, api_call, ttl=3600, snapshot_path=None, page_size=200, channel_method="channels.list",
+                 max_retries=5):
+        self.api_call = api_call
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.page_size = page_size
+        self.channel_method = channel_method
+        self.max_retries = max_retries
+        # Times the users and the channels were downloaded.
+        self.users_updated = None
+        self.channels_updated = None
+        self.n_pages = 0
+        self._users = {}
+        self._users_by_email = {}
+        self._users_by_name = {}
+        self._channels = {}
+        self._channels_by_name = {}
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+
+        if snapshot_path is not None:
+            self.load()
+
+    # Downloading
+
+    def _call(self, method, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            r = self.api_call(method, **kwargs)
+            if r.get("ok") or r.get("error") != "ratelimited" or attempt == self.max_retries:
+                break
+            time.sleep(float((r.get("headers") or {}).get("Retry-After", 1)))
+        if not r.get("ok"):
+            raise IOError("Slack api call '{}' failed: {}".format(method, r.get("error")))
+        return r
+
+    def _fetch_all(self, method, key, slim, executor):
+        """Downloads all pages of a list, requesting the next page before processing the current one."""
+        entries = []
+        future = executor.submit(self._call, method, limit=self.page_size)
+        while future is not None:
+            r = future.result()
+            self.n_pages += 1
+            cursor = (r.get("response_metadata") or {}).get("next_cursor")
+            future = executor.submit(self._call, method, limit=self.page_size, cursor=cursor) if cursor else None
+            entries.extend(slim(entry) for entry in r.get(key, []))
+        return entries
+
+    def refresh(self, users=True, channels=True):
+        """
+        Downloads the users and channels and replaces the cached ones.
+
+        If one of the lists can't be downloaded, the other one is still
+        replaced before the error is raised.
+        """
+        futures = []
+        errors = []
+        # Two lists and one prefetched page for each.
+        with ThreadPoolExecutor(4, thread_name_prefix="simbot_directory") as executor:
+            if users:
+                futures.append((self._set_users, executor.submit(
+                    self._fetch_all, "users.list", "members", slim_user, executor)))
+            if channels:
+                futures.append((self._set_channels, executor.submit(
+                    self._fetch_all, self.channel_method, "channels", slim_channel, executor)))
+            for set_entries, future in futures:
+                try:
+                    set_entries(future.result(), time.time())
+                except Exception as e:
+                    errors.append(e)
+        if len(errors) < len(futures) and self.snapshot_path is not None:
+            self.save()
+        if errors:
+            raise errors[0]
+        return self
+
+    def refresh_in_background(self):
+        """Starts a refresh in a background thread, unless one is already running."""
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return self._refresh_thread
+            self._refresh_thread = threading.Thread(target=self._background_refresh, name="simbot_directory",
+                                                    daemon=True)
+            self._refresh_thread.start()
+            return self._refresh_thread
+
+    def _background_refresh(self):
+        try:
+            self.refresh(users=self._is_stale(self.users_updated), channels=self._is_stale(self.channels_updated))
+        except Exception:
+            # Keep serving the cached directory, the next lookup tries again.
+            pass
+
+    def refresh_user(self, user_id):
+        """Downloads a single user and updates it in the directory."""
+        user = slim_user(self._call("users.info", user=user_id)["user"])
+        self._add_user(user)
+        return user
+
+    def _is_stale(self, updated):
+        return updated is None or time.time() - updated > self.ttl
+
+    @property
+    def is_stale(self):
+        return self._is_stale(self.users_updated) or self._is_stale(self.channels_updated)
+
+    def ensure_fresh(self, users=True, channels=True):
+        """
+        Downloads the users or channels if they aren't cached yet and refreshes them in the background if they're stale.
+        """
+        users_missing = users and self.users_updated is None
+        channels_missing = channels and self.channels_updated is None
+        if users_missing or channels_missing:
+            self.refresh(users=users_missing, channels=channels_missing)
+        elif (users and self._is_stale(self.users_updated)) or (channels and self._is_stale(self.channels_updated)):
+            self.refresh_in_background()
+
+    # Indexes
+
+    def _set_users(self, users, updated):
+        users_by_id = {}
+        users_by_email = {}
+        users_by_name = {}
+        for user in users:
+            self._index_user(user, users_by_id, users_by_email, users_by_name)
+
+        # Swap the indexes in one go, so lookups never see a half built directory.
+        with self._lock:
+            self._users, self._users_by_email, self._users_by_name = users_by_id, users_by_email, users_by_name
+            self.users_updated = updated
+
+    def _set_channels(self, channels, updated):
+        channels_by_id = {channel["id"]: channel for channel in channels}
+        channels_by_name = {channel["name"]: channel for channel in channels if "name" in channel}
+        with self._lock:
+            self._channels, self._channels_by_name = channels_by_id, channels_by_name
+            self.channels_updated = updated
+
+    @staticmethod
+    def _index_user(user, users_by_id, users_by_email, users_by_name):
+        users_by_id[user["id"]] = user
+        profile = user["profile"]
+        if profile.get("email"):
+            users_by_email[profile["email"].lower()] = user
+        # Prefer active users when names clash.
+        for name in (user.get("name"), profile.get("display_name")):
+            if name and (not user.get("deleted") or name.lower() not in users_by_name):
+                users_by_name[name.lower()] = user
+
+    def _add_user(self, user):
+        with self._lock:
+            # Copy on write so lookups without the lock stay consistent.
+            users_by_id, users_by_email, users_by_name = \
+                dict(self._users), dict(self._users_by_email), dict(self._users_by_name)
+            self._index_user(user, users_by_id, users_by_email, users_by_name)
+            self._users, self._users_by_email, self._users_by_name = users_by_id, users_by_email, users_by_name
+
+    # Lookups
+
+    def user(self, user_id):
+        self.ensure_fresh(channels=False)
+        return self._users.get(user_id)
+
+    def user_by_email(self, email, fetch=True):
+        """Returns the user with an email address. Unknown addresses are looked up with the api if `fetch`."""
+        self.ensure_fresh(channels=False)
+        user = self._users_by_email.get(email.lower())
+        if user is None and fetch:
+            try:
+                user = slim_user(self._call("users.lookupByEmail", email=email)["user"])
+            except IOError:
+                return None
+            self._add_user(user)
+        return user
+
+    def user_by_name(self, name):
+        """Returns the user with a user or display name, with or without a leading '@'."""
+        self.ensure_fresh(channels=False)
+        return self._users_by_name.get(name.lstrip("@").lower())
+
+    def channel(self, channel_id):
+        self.ensure_fresh(users=False)
+        return self._channels.get(channel_id)
+
+    def channel_by_name(self, name):
+        self.ensure_fresh(users=False)
+        return self._channels_by_name.get(name.lstrip("#"))
+
+    @property
+    def users(self):
+        self.ensure_fresh(channels=False)
+        return list(self._users.values())
+
+    @property
+    def channels(self):
+        self.ensure_fresh(users=False)
+        return list(self._channels.values())
+
+    # Snapshot
+
+    def save(self, path=None):
+        path = path or self.snapshot_path
+        with self._lock:
+            snapshot = {"users_updated": self.users_updated,
+                        "channels_updated": self.channels_updated,
+                        "users": list(self._users.values()),
+                        "channels": list(self._channels.values())}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path=None):
+        """Loads a snapshot. Returns False if there is no valid snapshot."""
+        try:
+            with open(path or self.snapshot_path) as f:
+                snapshot = json.load(f)
+            # Snapshots of earlier versions have a single time.
+            updated = snapshot.get("updated")
+            self._set_users(snapshot["users"], snapshot.get("users_updated", updated))
+            self._set_channels(snapshot["channels"], snapshot.get("channels_updated", updated))
+            return True
+        except (IOError, ValueError, KeyError, TypeError):
+            return False
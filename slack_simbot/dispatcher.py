@@ -0,0 +1,171 @@
+"""This module contains the dispatcher sending Slack API calls from the secondary event loop."""
+
+import asyncio
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from slack_simbot.event_loop import get_event_loop
+from slack_simbot.rate_limit import TokenBucket
+from slack_simbot.metrics import registry
+
+
+class DispatchError(Exception):
+    pass
+
+
+class Dispatcher:
+    """
+    Queues Slack API calls and sends them in the background.
+
+    Calls are submitted from any thread and return immediately. They are
+    drained in order by a coroutine running on the secondary event loop.
+    The blocking api calls themselves run on a single worker thread so
+    the event loop stays responsive.
+
+    `chat.update` calls are coalesced per (channel, ts). Only the latest
+    pending update of a message is sent and each message is updated at most
+    once every `min_interval` seconds. All calls share a token bucket and
+    rate limited calls are retried after the time given by Slack in the
+    Retry-After header.
+    """
+
+    def __init__(self, slack_client, debug=False, min_interval=1.0, rate_limit=None, max_retries=5):
+        self.slack_client = slack_client
+        self.debug = debug
+        self.min_interval = min_interval
+        self.rate_limit = rate_limit or TokenBucket.for_tier(3)
+        self.max_retries = max_retries
+        self.loop = get_event_loop(debug_enabled=False)
+        self.errors = deque(maxlen=100)
+        self.n_calls = 0
+        self.n_ratelimited = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="simbot_dispatch")
+
+        # Pending update per (channel, ts), the time each message was last
+        # updated and the timers of updates waiting for their interval.
+        # These are only accessed from the event loop thread.
+        self._pending = {}
+        self._last_sent = {}
+        self._timers = {}
+        self._forced = 0
+
+        # The queue has to be created on the event loop thread.
+        self._queue = asyncio.run_coroutine_threadsafe(self._create_queue(), self.loop).result()
+        self._drain_future = asyncio.run_coroutine_threadsafe(self._drain(), self.loop)
+
+    async def _create_queue(self):
+        return asyncio.Queue()
+
+    def submit(self, method, **kwargs):
+        """Enqueues an api call and returns without waiting for it to be sent."""
+        if method == "chat.update":
+            key = (kwargs.get('channel'), kwargs.get('ts'))
+            self.loop.call_soon_threadsafe(self._put_update, key, kwargs)
+        else:
+            self.loop.call_soon_threadsafe(self._queue.put_nowait, (method, None, kwargs))
+
+    def _put_update(self, key, kwargs):
+        # Only the first pending update of a message is queued. Later ones
+        # replace its payload until it is sent.
+        queued = key in self._pending
+        self._pending[key] = kwargs
+        if not queued:
+            self._queue.put_nowait(("chat.update", key, None))
+
+    def _defer(self, item, delay):
+        # The item is put back in the queue once its interval has passed. The
+        # queue's task is only marked as done after that, so join() keeps waiting.
+        _, key, _ = item
+        self._timers[key] = (self.loop.call_later(delay, self._requeue, item), item)
+
+    def _requeue(self, item):
+        _, key, _ = item
+        timer, _ = self._timers.pop(key)
+        timer.cancel()
+        self._queue.put_nowait(item)
+        self._queue.task_done()
+
+    async def _drain(self):
+        while True:
+            item = await self._queue.get()
+            method, key, kwargs = item
+            deferred = False
+            try:
+                if key is not None:
+                    if key not in self._pending:
+                        # Already sent while retrying an earlier update of the same message.
+                        continue
+                    delay = self._last_sent.get(key, float("-inf")) + self.min_interval - self.loop.time()
+                    if delay > 0 and not self._forced:
+                        self._defer(item, delay)
+                        deferred = True
+                        continue
+                await self._send(method, key, kwargs)
+            except Exception:
+                self.errors.append(sys.exc_info())
+            finally:
+                if not deferred:
+                    self._queue.task_done()
+
+    async def _send(self, method, key, kwargs):
+        for _ in range(self.max_retries + 1):
+            # Always send the latest payload of a coalesced update, also when retrying.
+            if key is not None:
+                kwargs = self._pending.pop(key, kwargs)
+
+            await self.rate_limit.acquire()
+            self.n_calls += 1
+            r = await self.loop.run_in_executor(self._executor,
+                                                partial(self.slack_client.api_call, method, **kwargs))
+
+            if key is not None:
+                self._last_sent[key] = self.loop.time()
+                self.loop.call_later(self.min_interval, self._forget, key, self._last_sent[key])
+
+            if r.get('error') == "ratelimited":
+                self.n_ratelimited += 1
+                registry.inc("slack_api_retries_total", component="dispatcher")
+                self.rate_limit.block(float(r.get('headers', {}).get('Retry-After', 1)))
+                continue
+
+            if not r.get('ok', False):
+                raise DispatchError("'{}' failed: {}".format(method, r.get('error')))
+            return r
+
+        raise DispatchError("'{}' failed: still rate limited after {} retries".format(method, self.max_retries))
+
+    def _forget(self, key, sent_time):
+        if self._last_sent.get(key) == sent_time:
+            del self._last_sent[key]
+
+    async def _join(self):
+        # Send all deferred updates right away instead of waiting for their interval.
+        self._forced += 1
+        try:
+            for _, item in list(self._timers.values()):
+                self._requeue(item)
+            await self._queue.join()
+        finally:
+            self._forced -= 1
+
+    def flush(self, timeout=None):
+        """
+        Blocks until all calls submitted so far have been sent.
+
+        Pending updates are sent right away, ignoring `min_interval`. Must not
+        be called from the event loop thread. In debug mode the oldest error
+        raised by a background call is re-raised.
+        """
+        asyncio.run_coroutine_threadsafe(self._join(), self.loop).result(timeout)
+        if self.debug and self.errors:
+            _, exc, tb = self.errors.popleft()
+            raise exc.with_traceback(tb)
+
+    join = flush
+
+    def close(self):
+        """Stops draining the queue. Calls that have not been sent yet are dropped."""
+        self._drain_future.cancel()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,199 @@
+"""This module contains the estimators used to predict when a batch will be done."""
+
+import datetime
+import time
+from collections import namedtuple, deque
+
+
+class Eta(namedtuple("Eta", ["expected", "low", "high"])):
+    """Expected time of arrival with the lower and upper end of its confidence band, as datetimes."""
+    __slots__ = ()
+
+
+def quantile(values, q):
+    """Returns the q-quantile of a list of values using linear interpolation."""
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class RunningAverage:
+    def __init__(self, initial=None, weight=0.8):
+        self.value = initial
+        self.weight = weight
+
+    def update(self, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value = ((1-self.weight) * self.value + self.weight * value)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class EwmaEstimator:
+    """
+    Exponentially weighted moving average of the time between finished cases.
+
+    This is the original estimator. It assumes cases run one after the
+    other and gives no confidence band.
+    """
+
+    def __init__(self, weight=0.8):
+        self.case_dt = RunningAverage(weight=weight)
+        self.last_end_time = None
+
+    def begin(self, start_time):
+        pass
+
+    def seed(self, rates):
+        """Starts from the expected throughput of (expected, low, high) rates, e.g. from earlier runs."""
+        self.case_dt.value = 1 / rates[0]
+
+    def record(self, end_time, start_time=None):
+        if self.last_end_time is not None:
+            self.case_dt.update(end_time - self.last_end_time)
+        self.last_end_time = end_time
+
+    def rate(self):
+        if not self.case_dt.value:
+            return None
+        return 1 / self.case_dt.value
+
+    def estimate(self, remaining, now=None):
+        rate = self.rate()
+        if rate is None:
+            return None
+        now = time.time() if now is None else now
+        expected = datetime.datetime.fromtimestamp(now + remaining / rate)
+        return Eta(expected, expected, expected)
+
+
+class ThroughputEstimator:
+    """
+    Robust throughput estimator that works with cases running in parallel.
+
+    The last `window` finished cases are split into `n_blocks` blocks of
+    consecutive completions. The throughput of each block is the number of
+    cases in it divided by the time between the end of the previous block
+    and its last completion. The median block throughput is used as the
+    estimate and the `band` quantiles of the block throughputs give the
+    confidence band. Because the completions of all workers are counted
+    together, the throughput already includes the effect of concurrency.
+
+    When the start time of cases is known, the time in which no case of a
+    block was running, such as after a pause, is not counted. Until enough
+    cases have finished for the blocks, the throughput is estimated as the
+    number of workers divided by the mean case duration, or from the time
+    between completions if no durations are known. If the estimator was
+    seeded with the throughput of earlier runs, that is used instead.
+
+    :param window: Number of recent cases used.
+    :param n_blocks: Number of blocks the window is split in.
+    :param band: Quantiles of the block throughputs used for the confidence band.
+    :param workers: Number of cases running in parallel, if known. Only used
+                    until enough cases have finished.
+    """
+
+    def __init__(self, window=100, n_blocks=5, band=(0.1, 0.9), workers=None):
+        self.window = window
+        self.n_blocks = n_blocks
+        self.band = band
+        self.workers = workers
+        self.origin = None
+        self.prior = None
+        self.cases = deque(maxlen=window)
+        # End time of the last case that dropped out of the window.
+        self.window_start = None
+
+    def begin(self, start_time):
+        """Sets the time the batch started, which is the reference for the first finished cases."""
+        self.origin = start_time
+
+    def seed(self, rates):
+        """Sets the (expected, low, high) throughput used until enough cases have finished."""
+        self.prior = tuple(rates)
+
+    def record(self, end_time, start_time=None):
+        """Records a finished case. Times are unix timestamps."""
+        if len(self.cases) == self.cases.maxlen:
+            self.window_start = self.cases[0][1]
+        self.cases.append((start_time, end_time))
+
+    def _block_rates(self):
+        cases = sorted(self.cases, key=lambda case: case[1])
+        block_size = len(cases) // self.n_blocks
+        if block_size < 2:
+            return []
+
+        # The oldest cases are left out if the window does not divide into equal blocks.
+        first = len(cases) % self.n_blocks
+        if first:
+            previous_end = cases[first - 1][1]
+        elif self.window_start is not None:
+            previous_end = self.window_start
+        else:
+            previous_end = self.origin
+
+        rates = []
+        for i in range(first, len(cases), block_size):
+            block = cases[i:i + block_size]
+            begin = previous_end
+            starts = [start for start, _ in block if start is not None]
+            if starts:
+                # Don't count time in which none of the cases in the block were running yet.
+                begin = min(starts) if begin is None else max(begin, min(starts))
+
+            if begin is None:
+                begin, n = block[0][1], len(block) - 1
+            else:
+                n = len(block)
+            if block[-1][1] > begin:
+                rates.append(n / (block[-1][1] - begin))
+            previous_end = block[-1][1]
+        return rates
+
+    def rates(self):
+        """Returns the (expected, low, high) throughput in cases per second, or None if unknown."""
+        rates = self._block_rates()
+        if len(rates) >= 2:
+            low, high = self.band
+            return quantile(rates, 0.5), quantile(rates, low), quantile(rates, high)
+        if self.prior is not None:
+            return self.prior
+
+        timed = [(start, end) for start, end in self.cases if start is not None and end > start]
+        if timed:
+            if self.workers:
+                rate = self.workers * len(timed) / sum(end - start for start, end in timed)
+            else:
+                # The overlap of the cases gives the number of cases running in parallel.
+                rate = len(timed) / (max(end for _, end in timed) - min(start for start, _ in timed))
+            return rate, rate, rate
+
+        ends = sorted(end for _, end in self.cases)
+        if self.origin is not None:
+            ends.insert(0, self.origin)
+        if len(ends) >= 2 and ends[-1] > ends[0]:
+            rate = (len(ends) - 1) / (ends[-1] - ends[0])
+            return rate, rate, rate
+        return None
+
+    def rate(self):
+        rates = self.rates()
+        return None if rates is None else rates[0]
+
+    def estimate(self, remaining, now=None):
+        """Returns the Eta of the remaining cases, or None if it cannot be estimated yet."""
+        rates = self.rates()
+        if rates is None:
+            return None
+        now = time.time() if now is None else now
+        expected, low, high = rates
+        return Eta(datetime.datetime.fromtimestamp(now + remaining / expected),
+                   datetime.datetime.fromtimestamp(now + remaining / high),
+                   datetime.datetime.fromtimestamp(now + remaining / low))
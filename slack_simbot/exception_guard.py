@@ -1,13 +1,21 @@
 import sys
+from functools import wraps
+
+from slack_simbot.metrics import registry
 
 
 def guard(func):
+    @wraps(func)
     def decorator(self, *args, **kwargs):
-        try:
-            return func(self, *args, **kwargs)
-        except:
-            if self.debug:
-                raise
-            else:
-                return sys.exc_info()
+        metrics = getattr(self, "metrics", None) or registry
+        # Objects with a `blocking_time` keep the time spent in their own calls, e.g. a batch's overhead.
+        with metrics.blocking(func.__name__, getattr(self, "blocking_time", None)):
+            try:
+                return func(self, *args, **kwargs)
+            except:
+                metrics.inc("simbot_errors_total", op=func.__name__, type=type(sys.exc_info()[1]).__name__)
+                if self.debug:
+                    raise
+                else:
+                    return sys.exc_info()
     return decorator
@@ -0,0 +1,81 @@
+"""This module contains the worker pool finishing batches in the background."""
+
+import atexit
+# Imported here, so the exit handler of the compression's and digest's process
+# pools is registered before the Finisher's and runs after it, see `get_finisher`.
+import concurrent.futures.process
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class Finisher:
+    """
+    Runs the post-processing of finished batches on a bounded pool of threads.
+
+    At most `max_workers` batches are compressed and uploaded at the same
+    time, later ones wait in the queue. `wait_all` blocks until all batches
+    submitted so far are done. It's also called when the process exits,
+    before the thread and process pools are shut down, so the finishes
+    still running can use them and the final notifications are not lost.
+
+    :param max_workers: Maximum number of batches finished at the same time.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="simbot_finish")
+        self._futures = set()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues a call and returns its Future."""
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    @property
+    def n_pending(self):
+        with self._lock:
+            return len(self._futures)
+
+    def wait_all(self, timeout=None):
+        """
+        Blocks until all submitted calls are done.
+
+        :return: True if they are all done, False if the timeout expired first.
+        """
+        with self._lock:
+            futures = list(self._futures)
+        _, not_done = wait(futures, timeout)
+        return not not_done
+
+
+_finisher = None
+_finisher_lock = threading.Lock()
+
+
+def get_finisher(max_workers=2):
+    """Returns the process wide Finisher, creating it with `max_workers` threads on the first call."""
+    global _finisher
+    with _finisher_lock:
+        if _finisher is None:
+            _finisher = Finisher(max_workers)
+            # Threading exit handlers run in reverse order before the threads are joined, so this runs
+            # before concurrent.futures refuses new work. A plain atexit handler would run after that.
+            register = getattr(threading, "_register_atexit", atexit.register)
+            register(_wait_at_exit, os.getpid())
+        return _finisher
+
+
+def _wait_at_exit(pid):
+    # Forked children, like the workers of the process pools, inherit the handler but not the
+    # threads running the finishes, so they would wait forever.
+    if os.getpid() == pid and _finisher is not None:
+        _finisher.wait_all()
@@ -0,0 +1,179 @@
+"""This module contains the database with the timing of earlier runs of batches."""
+
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from slack_simbot.eta import quantile
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL,
+    n_cases INTEGER NOT NULL,
+    n_ok INTEGER,
+    n_failed INTEGER,
+    n_skipped INTEGER,
+    status TEXT,
+    throughput REAL,
+    artifact_bytes INTEGER,
+    upload_bytes INTEGER,
+    upload_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS runs_title ON runs (title, finished);
+CREATE TABLE IF NOT EXISTS cases (
+    run INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    start REAL,
+    end REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cases_title ON cases (title, name);
+CREATE INDEX IF NOT EXISTS cases_run ON cases (run);
+"""
+
+Run = namedtuple("Run", ["id", "title", "started", "finished", "n_cases", "n_ok", "n_failed", "n_skipped", "status",
+                         "throughput", "artifact_bytes", "upload_bytes", "upload_seconds"])
+Run.__doc__ = "Finished run of a batch. Times are unix timestamps, the throughput is in cases per second."
+
+CaseStats = namedtuple("CaseStats", ["name", "n_runs", "mean", "max"])
+CaseStats.__doc__ = "Number of finished runs of a case and its mean and maximum duration in seconds."
+
+
+class RunHistory:
+    """
+    SQLite database with the runs of batches and the cases in them.
+
+    Batches record their cases while they run and their totals, artifact
+    size and upload time when they finish. Runs are keyed by title and
+    cases by title and case name, so nightly reruns of the same batch can
+    be compared. The throughput of earlier runs seeds the eta of new runs,
+    and `runs`, `trend` and `case_stats` can be used for reports.
+
+    Cases are buffered in memory and written `batch_size` at a time, so
+    recording a case doesn't touch the disk.
+
+    :param path: Path of the SQLite database.
+    :param n_runs: Number of recent runs used for the baseline and the eta seed.
+    :param batch_size: Number of cases buffered before they are written.
+    """
+
+    def __init__(self, path, n_runs=10, batch_size=1000):
+        self.path = path
+        self.n_runs = n_runs
+        self.batch_size = batch_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    # Recording
+
+    def begin(self, title, n_cases, started=None):
+        """Records the start of a run and returns its id."""
+        with self._lock:
+            return self._db.execute("INSERT INTO runs (title, started, n_cases) VALUES (?, ?, ?)",
+                                    (title, time.time() if started is None else started, n_cases)).lastrowid
+
+    def add_case(self, run, title, name, status, start, end):
+        """Records a finished case of a run. Times are unix timestamps, `start` may be None."""
+        with self._lock:
+            self._buffer.append((run, title, name, status, start, end))
+            if len(self._buffer) >= self.batch_size:
+                self._write_cases()
+
+    def _write_cases(self):
+        self._db.executemany("INSERT INTO cases VALUES (?, ?, ?, ?, ?, ?)", self._buffer)
+        self._buffer = []
+
+    def finish(self, run, n_ok, n_failed, n_skipped, status="completed", throughput=None, artifact_bytes=None,
+               upload_bytes=None, upload_seconds=None, finished=None):
+        """Records the end of a run."""
+        with self._lock:
+            buffer = self._buffer
+            self._db.execute("BEGIN")
+            try:
+                self._write_cases()
+                self._db.execute("UPDATE runs SET finished=?, n_ok=?, n_failed=?, n_skipped=?, status=?, "
+                                 "throughput=?, artifact_bytes=?, upload_bytes=?, upload_seconds=? WHERE id=?",
+                                 (time.time() if finished is None else finished, n_ok, n_failed, n_skipped, status,
+                                  throughput, artifact_bytes, upload_bytes, upload_seconds, run))
+                self._db.execute("COMMIT")
+            except BaseException:
+                # SQLite rolls back by itself after some errors.
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                # The cases weren't written, they are written with the next batch.
+                self._buffer = buffer + self._buffer
+                raise
+
+    # Queries
+
+    def runs(self, title=None, limit=None):
+        """Returns the finished runs, of one title or all, newest first."""
+        query = "SELECT * FROM runs WHERE finished IS NOT NULL"
+        args = ()
+        if title is not None:
+            query += " AND title=?"
+            args = (title,)
+        query += " ORDER BY finished DESC"
+        if limit is not None:
+            query += " LIMIT {:d}".format(limit)
+        with self._lock:
+            return [Run(*row) for row in self._db.execute(query, args)]
+
+    def throughputs(self, title, limit=None):
+        """Returns the throughput of the last `limit` completed runs of a title, newest first."""
+        with self._lock:
+            return [rate for rate, in self._db.execute(
+                "SELECT throughput FROM runs WHERE title=? AND status='completed' AND throughput > 0 "
+                "ORDER BY finished DESC LIMIT ?", (title, limit or self.n_runs))]
+
+    def baseline(self, title):
+        """Returns the median throughput of the recent runs of a title, or None if there are none."""
+        rates = self.throughputs(title)
+        return quantile(rates, 0.5) if rates else None
+
+    def seed(self, title, band=(0.1, 0.9)):
+        """Returns the (expected, low, high) throughput of a title from its recent runs, or None."""
+        rates = self.throughputs(title)
+        if not rates:
+            return None
+        return quantile(rates, 0.5), quantile(rates, band[0]), quantile(rates, band[1])
+
+    def trend(self, title, column="throughput", since=None):
+        """
+        Returns (finished, value) tuples of a column of the runs of a title, oldest first.
+
+        :param column: Numeric column of the runs table, e.g. 'throughput', 'artifact_bytes' or 'upload_seconds'.
+        :param since: Only include runs finished after this unix time.
+        """
+        if column not in Run._fields:
+            raise ValueError("Unknown column '{}'".format(column))
+        with self._lock:
+            return self._db.execute(
+                "SELECT finished, {} FROM runs WHERE title=? AND finished > ? ORDER BY finished".format(column),
+                (title, since or 0)).fetchall()
+
+    def case_stats(self, title, limit=None):
+        """Returns the CaseStats of the cases of a title, slowest first."""
+        query = ("SELECT name, COUNT(*), AVG(end - start), MAX(end - start) FROM cases "
+                 "WHERE title=? AND start IS NOT NULL GROUP BY name ORDER BY AVG(end - start) DESC")
+        if limit is not None:
+            query += " LIMIT {:d}".format(limit)
+        with self._lock:
+            if self._buffer:
+                self._write_cases()
+            return [CaseStats(*row) for row in self._db.execute(query, (title,))]
+
+    def close(self):
+        with self._lock:
+            if self._buffer:
+                self._write_cases()
+            self._db.close()
@@ -0,0 +1,88 @@
+"""This module contains the manifest of file hashes used for incremental uploads."""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """Returns the sha256 hex digest of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    Size, modification time and sha256 of each file in a directory.
+
+    Files are keyed by their path relative to the directory, using '/' as
+    separator. When scanning, files with the same size and modification
+    time as in a previous manifest reuse its hash instead of being read.
+    """
+
+    def __init__(self, files=None):
+        self.files = files or {}
+
+    @classmethod
+    def scan(cls, dir_path, previous=None, workers=4):
+        """Creates the manifest of a directory."""
+        previous = previous or cls()
+        files = {}
+        to_hash = []
+        for root, _, names in os.walk(dir_path):
+            for name in names:
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, dir_path).replace(os.sep, "/")
+                st = os.stat(path)
+                entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                old = previous.files.get(rel_path)
+                if old is not None and old["size"] == entry["size"] and old["mtime_ns"] == entry["mtime_ns"]:
+                    entry["sha256"] = old["sha256"]
+                else:
+                    to_hash.append((rel_path, path))
+                files[rel_path] = entry
+
+        # hashlib releases the GIL, so files can be hashed in parallel threads.
+        with ThreadPoolExecutor(workers) as executor:
+            for (rel_path, _), digest in zip(to_hash, executor.map(hash_file, [p for _, p in to_hash])):
+                files[rel_path]["sha256"] = digest
+        return cls(files)
+
+    def changed(self, other):
+        """Returns the files that are new or have different content than in the other manifest."""
+        return sorted(rel_path for rel_path, entry in self.files.items()
+                      if other.files.get(rel_path, {}).get("sha256") != entry["sha256"])
+
+    def removed(self, other):
+        """Returns the files in the other manifest that are not in this one."""
+        return sorted(set(other.files) - set(self.files))
+
+    @property
+    def total_size(self):
+        return sum(entry["size"] for entry in self.files.values())
+
+    def dumps(self):
+        return json.dumps({"version": 1, "files": self.files}, sort_keys=True)
+
+    @classmethod
+    def loads(cls, text):
+        return cls(json.loads(text)["files"])
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.dumps())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a manifest from a file. Returns an empty manifest if the file does not exist."""
+        try:
+            with open(path) as f:
+                return cls.loads(f.read())
+        except FileNotFoundError:
+            return cls()
@@ -0,0 +1,235 @@
+"""This module contains the metrics recorded about the time and resources spent in simbot."""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., 30., 60., 120., 300., 600.)
+
+
+class Histogram:
+    """Histogram with fixed bucket upper bounds, like a Prometheus histogram."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Estimates a quantile by linear interpolation within its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum, "min": self.min, "max": self.max,
+                "p50": self.quantile(0.5), "p99": self.quantile(0.99),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts))}
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in items) + "}"
+
+
+class BlockingTime:
+    """Time the simulation spent waiting on the calls of one object, e.g. a batch, from any thread."""
+
+    def __init__(self):
+        self.seconds = 0.
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.seconds += seconds
+
+
+class Metrics:
+    """
+    Registry of counters and latency histograms.
+
+    Metrics are identified by a name and a set of labels, e.g.
+    `slack_api_seconds{method="chat.update"}`. They can be exported in the
+    Prometheus text format, e.g. for node_exporter's textfile collector, or
+    as json. Hooks registered with `add_hook` are called with
+    (kind, name, value, labels) for every recorded value, so metrics can be
+    forwarded elsewhere. Recording only takes a lock and a few additions.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.hooks = []
+        self.created = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def inc(self, name, value=1, **labels):
+        """Adds a value to a counter."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._call_hooks("counter", name, value, labels)
+
+    def observe(self, name, value, **labels):
+        """Adds a value, usually a duration in seconds, to a histogram."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+        self._call_hooks("histogram", name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Context manager observing the time spent in it."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    @contextmanager
+    def blocking(self, op, account=None):
+        """
+        Context manager timing a call into simbot made by the simulation.
+
+        The time is added to 'simbot_call_seconds'. Only the outermost call of
+        a thread is added to 'simbot_blocking_seconds_total', and to the
+        BlockingTime `account` of the object called if given, so nested calls
+        are not counted twice.
+        """
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            dt = time.perf_counter() - t0
+            self._local.depth = depth
+            self.observe("simbot_call_seconds", dt, op=op)
+            if depth == 0:
+                self.inc("simbot_blocking_seconds_total", dt)
+                if account is not None:
+                    account.add(dt)
+
+    @property
+    def blocking_seconds(self):
+        """Total time spent waiting on simbot calls, by all threads and batches of the process."""
+        return self.counters.get(("simbot_blocking_seconds_total", ()), 0.)
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _call_hooks(self, kind, name, value, labels):
+        for hook in self.hooks:
+            try:
+                hook(kind, name, value, labels)
+            except Exception:
+                # A broken hook should never break a notification.
+                pass
+
+    def get(self, name, **labels):
+        """Returns the value of a counter or the Histogram of a metric, or None if it wasn't recorded."""
+        key = (name, _label_key(labels))
+        return self.counters.get(key, self.histograms.get(key))
+
+    def total(self, name):
+        """Returns the sum of a counter or histogram over all its labels."""
+        with self._lock:
+            return sum(value for (metric, _), value in self.counters.items() if metric == name) + \
+                sum(histogram.sum for (metric, _), histogram in self.histograms.items() if metric == name)
+
+    def prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for metric in sorted({name for name, _ in self.counters}):
+                lines.append("# TYPE {} counter".format(metric))
+                for (name, key), value in sorted(self.counters.items()):
+                    if name == metric:
+                        lines.append("{}{} {}".format(name, _format_labels(key), value))
+            for metric in sorted({name for name, _ in self.histograms}):
+                lines.append("# TYPE {} histogram".format(metric))
+                for (name, key), histogram in sorted(self.histograms.items()):
+                    if name != metric:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip([str(b) for b in histogram.buckets] + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append("{}_bucket{} {}".format(name, _format_labels(key, [("le", bound)]), cumulative))
+                    lines.append("{}_sum{} {}".format(name, _format_labels(key), histogram.sum))
+                    lines.append("{}_count{} {}".format(name, _format_labels(key), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "created": self.created,
+                "time": time.time(),
+                "counters": [{"name": name, "labels": dict(key), "value": value}
+                             for (name, key), value in sorted(self.counters.items())],
+                "histograms": [dict(histogram.to_dict(), name=name, labels=dict(key))
+                               for (name, key), histogram in sorted(self.histograms.items())],
+            }
+
+    def write_prometheus(self, path):
+        """Writes the metrics in the Prometheus text format, atomically so collectors never read half a file."""
+        self._write(path, self.prometheus())
+
+    def write_json(self, path):
+        self._write(path, json.dumps(self.to_dict(), indent=1))
+
+    @staticmethod
+    def _write(path, text):
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+# Process wide registry used by default.
+registry = Metrics()
+
+
+def get_metrics():
+    """Returns the process wide metrics registry."""
+    return registry
@@ -1,7 +1,6 @@
-
-
 class MsgHandle:
-    def __init__(self, ts, channel):
+    def __init__(self, ts, channel, outbox_id=None):
         self.ts = ts
         self.channel = channel
-
+        # Id of the message in the outbox, if it's sent through one.
+        self.outbox_id = outbox_id
@@ -0,0 +1,343 @@
+"""This module contains the persistent outbox messages are sent through."""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+
+from slack_simbot.msg_handle import MsgHandle
+from slack_simbot.rate_limit import TokenBucket
+from slack_simbot.metrics import registry
+
+
+# Errors returned by Slack after which a call is retried.
+RETRYABLE_ERRORS = {"ratelimited", "internal_error", "fatal_error", "service_unavailable", "request_timeout"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS handles (
+    id TEXT PRIMARY KEY,
+    channel TEXT,
+    ts TEXT,
+    state TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS handles_message ON handles (channel, ts);
+CREATE TABLE IF NOT EXISTS ops (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    method TEXT NOT NULL,
+    handle TEXT,
+    creates INTEGER NOT NULL DEFAULT 0,
+    kwargs TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_try REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS ops_state ON ops (state, id);
+CREATE INDEX IF NOT EXISTS ops_handle ON ops (handle, id);
+"""
+
+
+class Outbox:
+    """
+    Durable queue of the Slack api calls of a SimBot.
+
+    Calls are written to a SQLite database before they are sent, and a
+    background thread sends them in order, in batches, with retries. Calls
+    that fail because of the network or a transient Slack error are retried
+    with exponential backoff until they succeed, so a Slack outage does not
+    block the simulation or drop the final notification. Calls that are
+    still queued or were in flight when the process stopped are sent again
+    when an outbox is opened on the same file, so a call may be sent twice
+    after a crash, but is never lost.
+
+    Messages are referred to by a handle id, because their ts is not known
+    until the message has been posted. The channel and ts of each message
+    are stored, so updates of a batch message queued before a restart still
+    reach the right message. Calls on the same message are sent in order.
+    Queued `chat.update` calls of a message are coalesced, and a message is
+    updated at most once every `min_interval` seconds.
+
+    :param path: Path of the SQLite database.
+    :param api_call: Callable sending an api call, e.g. `SlackClient.api_call`.
+    :param min_interval: Minimum number of seconds between updates of a message.
+    :param rate_limit: TokenBucket shared by all calls. Slack's tier 3 by default.
+    :param batch_size: Maximum number of calls taken from the database at once.
+    :param max_attempts: Number of times a call is attempted before it's marked as failed.
+                         Transient errors are retried forever if None.
+    :param backoff: Delay in seconds before the first retry. It's doubled after each attempt.
+    :param max_backoff: Maximum delay between retries in seconds.
+    """
+
+    def __init__(self, path, api_call, min_interval=1.0, rate_limit=None, batch_size=20, max_attempts=None,
+                 backoff=1., max_backoff=60.):
+        self.path = path
+        self.api_call = api_call
+        self.min_interval = min_interval
+        self.rate_limit = rate_limit or TokenBucket.for_tier(3)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.n_calls = 0
+        self.n_retried = 0
+
+        self._condition = threading.Condition()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        # Calls in flight when the previous process stopped are sent again.
+        self._db.execute("UPDATE ops SET state='pending' WHERE state='inflight'")
+
+        self._last_update = {}
+        self._responses = {}
+        self._bound = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._target, name="simbot_outbox", daemon=True)
+        self._thread.start()
+
+    # Handles
+
+    def new_handle(self):
+        """Returns the id of a new message that still has to be posted."""
+        handle_id = uuid.uuid4().hex
+        with self._condition:
+            self._db.execute("INSERT INTO handles (id, state, created) VALUES (?, 'pending', ?)",
+                             (handle_id, time.time()))
+        return handle_id
+
+    def handle_id(self, msg_handle):
+        """Returns the handle id of a MsgHandle, registering messages not posted through the outbox."""
+        if getattr(msg_handle, "outbox_id", None) is None:
+            with self._condition:
+                row = self._db.execute("SELECT id FROM handles WHERE channel=? AND ts=?",
+                                       (msg_handle.channel, msg_handle.ts)).fetchone()
+                if row is None:
+                    handle_id = uuid.uuid4().hex
+                    self._db.execute("INSERT INTO handles (id, channel, ts, state, created) "
+                                     "VALUES (?, ?, ?, 'live', ?)",
+                                     (handle_id, msg_handle.channel, msg_handle.ts, time.time()))
+                else:
+                    handle_id = row[0]
+            msg_handle.outbox_id = handle_id
+        return msg_handle.outbox_id
+
+    def message_handle(self, handle_id):
+        """Returns a MsgHandle of a message in the outbox, e.g. of a batch started before a restart."""
+        with self._condition:
+            row = self._db.execute("SELECT channel, ts FROM handles WHERE id=?", (handle_id,)).fetchone()
+        if row is None:
+            return None
+        msg_handle = MsgHandle(row[1], row[0], outbox_id=handle_id)
+        if msg_handle.ts is None:
+            self.bind(msg_handle)
+        return msg_handle
+
+    def bind(self, msg_handle):
+        """Fills in the ts and channel of a MsgHandle once its message has been posted."""
+        with self._condition:
+            row = self._db.execute("SELECT channel, ts FROM handles WHERE id=?", (msg_handle.outbox_id,)).fetchone()
+            if row is not None and row[1] is not None:
+                msg_handle.channel, msg_handle.ts = row
+            else:
+                self._bound.setdefault(msg_handle.outbox_id, weakref.WeakSet()).add(msg_handle)
+
+    def live_handles(self):
+        """Returns the ids of the messages that have not been deleted."""
+        with self._condition:
+            return [row[0] for row in self._db.execute(
+                "SELECT id FROM handles WHERE state IN ('pending', 'live') ORDER BY created")]
+
+    # Queueing
+
+    def submit(self, method, handle=None, creates=False, **kwargs):
+        """
+        Queues an api call.
+
+        :param method: Api method.
+        :param handle: Handle id of the message the call is about. Its channel
+                       and ts are added to the arguments when it's sent.
+        :param creates: True if the call posts the message of `handle`.
+        :param kwargs: Arguments of the call.
+        :return: Id of the queued call.
+        """
+        with self._condition:
+            op_id = self._insert(method, handle, creates, kwargs)
+            self._condition.notify_all()
+        return op_id
+
+    def call(self, method, handle=None, creates=False, timeout=5., **kwargs):
+        """
+        Queues an api call and waits up to `timeout` seconds for it to be sent.
+
+        :return: The response, or None if the call has not been sent yet. It
+                 stays queued in that case.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            op_id = self._insert(method, handle, creates, kwargs)
+            self._responses[op_id] = None
+            self._condition.notify_all()
+            try:
+                while self._responses[op_id] is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+                return self._responses[op_id]
+            finally:
+                del self._responses[op_id]
+
+    def _insert(self, method, handle, creates, kwargs):
+        if method == "chat.update" and handle is not None:
+            # Replace the payload of the last queued update, unless another call on the message comes after it.
+            row = self._db.execute("SELECT id, method, state FROM ops WHERE handle=? ORDER BY id DESC LIMIT 1",
+                                   (handle,)).fetchone()
+            if row is not None and row[1] == "chat.update" and row[2] == "pending":
+                self._db.execute("UPDATE ops SET kwargs=? WHERE id=?", (json.dumps(kwargs), row[0]))
+                return row[0]
+        return self._db.execute(
+            "INSERT INTO ops (method, handle, creates, kwargs, state, created) VALUES (?, ?, ?, ?, 'pending', ?)",
+            (method, handle, int(creates), json.dumps(kwargs), time.time())).lastrowid
+
+    def pending(self):
+        """Returns the number of calls that have not been sent yet."""
+        with self._condition:
+            return self._db.execute("SELECT COUNT(*) FROM ops WHERE state IN ('pending', 'inflight')").fetchone()[0]
+
+    def failed(self):
+        """Returns (method, kwargs, error) of the calls that failed permanently."""
+        with self._condition:
+            return [(method, json.loads(kwargs), error) for method, kwargs, error in self._db.execute(
+                "SELECT method, kwargs, error FROM ops WHERE state='failed' ORDER BY id")]
+
+    def flush(self, timeout=None):
+        """Waits until all queued calls have been sent or failed. Returns False on a timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            # Send updates waiting for their interval right away.
+            self._last_update.clear()
+            self._db.execute("UPDATE ops SET next_try=0 WHERE state='pending' AND method='chat.update'")
+            self._condition.notify_all()
+            while self._db.execute("SELECT 1 FROM ops WHERE state IN ('pending', 'inflight') LIMIT 1").fetchone():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    join = flush
+
+    # Sending
+
+    def _target(self):
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                # Calls on a message are sent in order, and only once the message has been posted.
+                ops = self._db.execute(
+                    "SELECT ops.id, method, handle, creates, kwargs, attempts, handles.channel, handles.ts, "
+                    "handles.state FROM ops LEFT JOIN handles ON ops.handle = handles.id "
+                    "WHERE ops.state='pending' AND next_try <= ? "
+                    "AND (ops.handle IS NULL OR ops.creates OR handles.ts IS NOT NULL OR handles.state='failed') "
+                    "AND NOT EXISTS (SELECT 1 FROM ops AS previous WHERE previous.handle = ops.handle "
+                    "AND previous.id < ops.id AND previous.state != 'failed') "
+                    "ORDER BY ops.id LIMIT ?",
+                    (time.time(), self.batch_size)).fetchall()
+                if not ops:
+                    row = self._db.execute("SELECT MIN(next_try) FROM ops WHERE state='pending'").fetchone()
+                    self._condition.wait(1. if row[0] is None else min(1., max(0.01, row[0] - time.time())))
+                    continue
+                self._db.executemany("UPDATE ops SET state='inflight' WHERE id=?", [(op[0],) for op in ops])
+
+            for op in ops:
+                self._send(*op)
+
+    def _requeue(self, op_id, next_try):
+        with self._condition:
+            self._db.execute("UPDATE ops SET state='pending', next_try=? WHERE id=?", (next_try, op_id))
+
+    def _send(self, op_id, method, handle, creates, kwargs, attempts, channel, ts, handle_state):
+        kwargs = json.loads(kwargs)
+        if handle is not None and not creates:
+            if handle_state == "failed":
+                self._finish(op_id, "failed", error="the message could not be posted")
+                return
+            kwargs.update(channel=channel, ts=ts)
+
+        if method == "chat.update":
+            next_update = self._last_update.get(handle, float("-inf")) + self.min_interval
+            if next_update > time.monotonic():
+                self._requeue(op_id, time.time() + next_update - time.monotonic())
+                return
+
+        while not self.rate_limit.take():
+            time.sleep(self.rate_limit.delay())
+
+        self.n_calls += 1
+        try:
+            r = self.api_call(method, **kwargs)
+            error = None if r.get("ok") else r.get("error")
+        except Exception as e:
+            r = None
+            error = "{}: {}".format(type(e).__name__, e)
+
+        if method == "chat.update":
+            self._last_update[handle] = time.monotonic()
+
+        if error is None:
+            self._finish(op_id, "sent", r, handle, creates, method)
+            return
+
+        if error == "ratelimited":
+            registry.inc("slack_api_retries_total", component="outbox")
+            self.rate_limit.block(float((r.get("headers") or {}).get("Retry-After", 1)))
+            self._requeue(op_id, 0)
+            return
+
+        attempts += 1
+        if (r is None or error in RETRYABLE_ERRORS) and (self.max_attempts is None or attempts < self.max_attempts):
+            self.n_retried += 1
+            registry.inc("slack_api_retries_total", component="outbox")
+            with self._condition:
+                self._db.execute("UPDATE ops SET state='pending', attempts=?, next_try=?, error=? WHERE id=?",
+                                 (attempts, time.time() + min(self.backoff * 2 ** (attempts - 1), self.max_backoff),
+                                  error, op_id))
+            return
+
+        self._finish(op_id, "failed", r, handle, creates, method, error)
+
+    def _finish(self, op_id, state, r=None, handle=None, creates=False, method=None, error=None):
+        with self._condition:
+            if state == "sent":
+                # Sent calls are removed, so the database only holds what is still to do.
+                self._db.execute("DELETE FROM ops WHERE id=?", (op_id,))
+                if creates:
+                    self._db.execute("UPDATE handles SET channel=?, ts=?, state='live' WHERE id=?",
+                                     (r.get("channel"), r.get("ts"), handle))
+                    for msg_handle in self._bound.pop(handle, ()):
+                        if msg_handle.outbox_id == handle:
+                            msg_handle.channel, msg_handle.ts = r.get("channel"), r.get("ts")
+                elif method == "chat.delete":
+                    self._db.execute("UPDATE handles SET state='deleted' WHERE id=?", (handle,))
+            else:
+                self._db.execute("UPDATE ops SET state='failed', error=? WHERE id=?", (error, op_id))
+                if creates:
+                    self._db.execute("UPDATE handles SET state='failed' WHERE id=?", (handle,))
+            if op_id in self._responses:
+                self._responses[op_id] = r or {"ok": False, "error": error}
+            self._condition.notify_all()
+
+    def close(self, timeout=None):
+        """Stops sending after waiting up to `timeout` seconds for the queued calls. Unsent calls stay queued."""
+        if timeout:
+            self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._db.close()
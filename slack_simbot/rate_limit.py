@@ -0,0 +1,86 @@
+"""This module contains the token bucket used to stay within Slack's api rate limits."""
+
+import asyncio
+import threading
+import time
+
+
+# Approximate number of calls per minute allowed by each of Slack's Web API rate limit tiers.
+TIERS = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+}
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    Tokens are added at `rate` per second up to `capacity`. Each call takes
+    one token. `block` drains the bucket for a given time, which is used to
+    honour the Retry-After header of a rate limited response. A bucket can
+    be shared between threads and the event loop.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.last = clock()
+        self.blocked_until = self.last
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_tier(cls, tier, burst=None):
+        """Creates a bucket matching one of Slack's rate limit tiers."""
+        per_minute = TIERS[tier]
+        return cls(per_minute / 60, burst or max(1, per_minute // 5))
+
+    def _refill(self, now):
+        start = max(self.last, self.blocked_until)
+        if now > start:
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self.last = max(self.last, now)
+
+    def delay(self):
+        """Returns the number of seconds until a token is available."""
+        with self._lock:
+            return self._delay()
+
+    def _delay(self):
+        now = self.clock()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """Takes a token if one is available. Returns True on success."""
+        with self._lock:
+            if self._delay() > 0:
+                return False
+            self.tokens -= 1
+            return True
+
+    def block(self, seconds):
+        """Blocks the bucket for the given number of seconds, after which a single call is allowed."""
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.tokens = 1
+            self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def wait(self):
+        """Blocks the calling thread until a token is available and takes it."""
+        while not self.take():
+            time.sleep(self.delay())
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
+        while not self.take():
+            await asyncio.sleep(self.delay())
@@ -0,0 +1,105 @@
+"""This module contains the templates the messages of a batch are rendered with."""
+
+import json
+
+# Message templates. The fields that don't change while a batch runs are
+# filled in once per batch by BatchRenderer, so only the changing fields
+# are formatted on each update.
+PROGRESS_TEMPLATE = "_{description}_\n*running* {{case}}\n*progress* {{done}}/{n_cases}\n*eta* {{eta}}"
+RESOURCES_TEMPLATE = "\n*resources* {resources}"
+OVERRUN_TEMPLATE = "_{description}_\n*done*"
+DONE_TEMPLATE = "_{description}_\n*Done*\n{{stage}}"
+HEADER_TEMPLATE = "*{title}*\n_{description}_"
+
+PROGRESS_COLOR = "#3AA3E3"
+
+
+def _escape(text):
+    # Keeps braces in titles and descriptions from being taken for template fields.
+    return str(text).replace("{", "{{").replace("}", "}}")
+
+
+def _section(text):
+    return json.dumps({"type": "section", "text": {"type": "mrkdwn", "text": text}}, separators=(",", ":"))
+
+
+class BatchRenderer:
+    """
+    Renders the progress, done and finish messages of a batch.
+
+    The templates are compiled once per batch, with the title, description
+    and number of cases already filled in. Messages are rendered either as
+    attachments, like the messages of earlier versions, or as Block Kit
+    blocks. Blocks are passed to the api as compact json. The header block
+    is serialized once and only the section with the progress is rendered
+    and serialized on each update. Block messages also leave out `parse`,
+    which Slack ignores for blocks, and only have the title as fallback text.
+    Every update still sends the whole message, and block messages are
+    about as large as attachments, so `blocks` is a choice of layout, not
+    of speed. Rendering is a small part of the cost of an update.
+
+    :param title: Title of the batch.
+    :param description: Description of the batch.
+    :param n_cases: Number of cases in the batch.
+    :param blocks: Whether to render Block Kit blocks instead of attachments.
+    """
+
+    def __init__(self, title, description, n_cases, blocks=False):
+        self.title = title
+        self.blocks = blocks
+        fields = dict(description=_escape(description), n_cases=n_cases)
+        self._progress = PROGRESS_TEMPLATE.format(**fields)
+        self._overrun = OVERRUN_TEMPLATE.format(description=description)
+        self._done = DONE_TEMPLATE.format(**fields)
+        if blocks:
+            self._blocks_head = "[" + _section(HEADER_TEMPLATE.format(title=title, description=description)) + ","
+
+    def progress(self, case, done, eta, resources=None):
+        """Returns the api arguments of the progress message."""
+        if case is None:
+            text = self._overrun
+        else:
+            text = self._progress.format(case=case, done=done, eta=eta)
+        if resources is not None:
+            text += RESOURCES_TEMPLATE.format(resources=resources)
+        return self._payload(text)
+
+    def done(self, stage):
+        """Returns the api arguments of the message shown while the results are processed."""
+        return self._payload(self._done.format(stage=stage))
+
+    def _payload(self, text):
+        if self.blocks:
+            # The description is in the header, so the section only has the lines after it.
+            return {
+                "text": self.title,
+                "link_names": "1",
+                "as_user": "1",
+                "blocks": self._blocks_head + _section(text.split("\n", 1)[1]) + "]"
+            }
+        return {
+            "parse": "full",
+            "link_names": "1",
+            "as_user": "1",
+            "attachments": [
+                {
+                    "fallback": text,
+                    "color": PROGRESS_COLOR,
+                    "title": self.title,
+                    "text": text,
+                    "mrkdwn_in": ["text"]
+                }
+            ]
+        }
+
+    def finish(self, title, color, fields):
+        """Returns the attachments of the final notification."""
+        return [
+            {
+                "fallback": self.title,
+                "color": color,
+                "title": title,
+                "fields": fields,
+                "mrkdwn_in": ["text", 'fields']
+            }
+        ]
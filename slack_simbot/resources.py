@@ -0,0 +1,258 @@
+"""This module contains a background sampler of the cpu, memory and io usage of a process tree."""
+
+import heapq
+import os
+import threading
+import time
+from collections import namedtuple, deque
+
+from slack_simbot.metrics import registry
+
+
+Sample = namedtuple("Sample", ["time", "cpu", "rss", "read_rate", "write_rate"])
+Sample.__doc__ = "Cpu usage in percent of one core, resident memory in bytes and io rates in bytes/s of the tree."
+
+ResourceSummary = namedtuple("ResourceSummary", ["cpu", "rss", "rss_peak", "read_rate", "write_rate",
+                                                 "read_bytes", "write_bytes"])
+
+CasePeak = namedtuple("CasePeak", ["case", "cpu", "rss"])
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return "{:.0f} {}".format(n, unit) if unit == "B" else "{:.1f} {}".format(n, unit)
+        n /= 1024
+    return "{:.1f} TB".format(n)
+
+
+def _read_stat(pid):
+    # Returns the cpu time in clock ticks and the rss in pages of a process.
+    with open("/proc/{}/stat".format(pid), "rb") as f:
+        data = f.read()
+    # The command name can contain spaces and parentheses, so split after the last one.
+    fields = data[data.rindex(b")") + 2:].split()
+    return int(fields[11]) + int(fields[12]), int(fields[21])
+
+
+def _read_io(pid):
+    # Returns the bytes read from and written to storage by a process, or zeros if not allowed to read them.
+    read_bytes = write_bytes = 0
+    try:
+        with open("/proc/{}/io".format(pid), "rb") as f:
+            for line in f:
+                if line.startswith(b"read_bytes:"):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith(b"write_bytes:"):
+                    write_bytes = int(line.split()[1])
+    except OSError:
+        pass
+    return read_bytes, write_bytes
+
+
+def _children(pid):
+    # Uses the children files of the threads if the kernel has them, otherwise scans all processes.
+    children = []
+    if os.path.exists("/proc/thread-self/children"):
+        try:
+            for tid in os.listdir("/proc/{}/task".format(pid)):
+                try:
+                    with open("/proc/{}/task/{}/children".format(pid, tid)) as f:
+                        children.extend(int(child) for child in f.read().split())
+                except OSError:
+                    # The thread exited in the meantime.
+                    pass
+        except OSError:
+            pass
+        return children
+
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/{}/stat".format(entry), "rb") as f:
+                    data = f.read()
+                if int(data[data.rindex(b")") + 2:].split()[1]) == pid:
+                    children.append(int(entry))
+            except (OSError, ValueError):
+                pass
+    return children
+
+
+class ResourceSampler:
+    """
+    Samples the cpu, memory and io usage of a process and its children from a background thread.
+
+    Reads /proc, so it only samples on Linux. Elsewhere `available` is False
+    and no thread is started. Keeps the last `window` samples for rolling
+    averages, and the peaks since the last call to `take_peak`, which a
+    batch uses to find the peaks of each case.
+
+    The cost of sampling is bounded. If a sample takes longer than
+    `max_overhead` of the interval, for example because the process tree
+    is very large, the interval is increased.
+
+    :param pid: Root of the process tree. Defaults to this process.
+    :param interval: Seconds between samples.
+    :param window: Number of samples the rolling averages are taken over.
+    :param children: Whether to include the children of the process.
+    :param max_overhead: Maximum fraction of the time spent sampling.
+    """
+
+    def __init__(self, pid=None, interval=1., window=60, children=True, max_overhead=0.01, metrics=None):
+        self.pid = os.getpid() if pid is None else pid
+        self.interval = interval
+        self.children = children
+        self.max_overhead = max_overhead
+        self.metrics = metrics or registry
+        self.samples = deque(maxlen=window)
+        self.available = os.path.exists("/proc/{}/stat".format(self.pid))
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.rss_peak = 0
+        self._peak_cpu = 0.
+        self._peak_rss = 0
+        self._previous = {}
+        self._previous_time = None
+        self._ticks = os.sysconf("SC_CLK_TCK") if self.available else 100
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if self.available else 4096
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.available and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="simbot-resources", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        # The first sample, the baseline of the rates, is taken here too, so
+        # the thread calling `start` never walks the process tree.
+        while True:
+            t0 = time.perf_counter()
+            try:
+                self.sample()
+            except Exception:
+                # The root process is gone.
+                return
+            duration = time.perf_counter() - t0
+            self.metrics.observe("simbot_resource_sample_seconds", duration)
+            if duration > self.max_overhead * self.interval:
+                self.interval = duration / self.max_overhead
+            if self._stop.wait(self.interval):
+                return
+
+    def _pids(self):
+        pids = [self.pid]
+        if self.children:
+            i = 0
+            while i < len(pids):
+                pids.extend(_children(pids[i]))
+                i += 1
+        return pids
+
+    def sample(self):
+        """Takes a sample now and returns it. Returns None for the first sample, which has no rates."""
+        now = time.monotonic()
+        current = {}
+        rss = 0
+        for pid in self._pids():
+            try:
+                cpu_ticks, rss_pages = _read_stat(pid)
+            except (OSError, ValueError):
+                # The process exited in the meantime.
+                continue
+            current[pid] = (cpu_ticks,) + _read_io(pid)
+            rss += rss_pages * self._page_size
+
+        # Processes that started since the previous sample count from zero,
+        # processes that exited are dropped.
+        deltas = [0, 0, 0]
+        for pid, values in current.items():
+            previous = self._previous.get(pid, (0, 0, 0))
+            for i in range(3):
+                deltas[i] += max(values[i] - previous[i], 0)
+
+        with self._lock:
+            previous_time = self._previous_time
+            self._previous = current
+            self._previous_time = now
+            self.read_bytes += deltas[1]
+            self.write_bytes += deltas[2]
+            self.rss_peak = max(self.rss_peak, rss)
+            self._peak_rss = max(self._peak_rss, rss)
+            if previous_time is None:
+                return None
+            dt = max(now - previous_time, 1e-6)
+            sample = Sample(now, 100 * deltas[0] / self._ticks / dt, rss, deltas[1] / dt, deltas[2] / dt)
+            self.samples.append(sample)
+            self._peak_cpu = max(self._peak_cpu, sample.cpu)
+        return sample
+
+    def summary(self):
+        """Returns the averages over the window as a ResourceSummary, or None if there are no samples yet."""
+        with self._lock:
+            if not self.samples:
+                return None
+            n = len(self.samples)
+            return ResourceSummary(
+                cpu=sum(sample.cpu for sample in self.samples) / n,
+                rss=self.samples[-1].rss,
+                rss_peak=self.rss_peak,
+                read_rate=sum(sample.read_rate for sample in self.samples) / n,
+                write_rate=sum(sample.write_rate for sample in self.samples) / n,
+                read_bytes=self.read_bytes,
+                write_bytes=self.write_bytes)
+
+    def take_peak(self):
+        """Returns the peak cpu usage and rss since the previous call and resets them."""
+        with self._lock:
+            peak = self._peak_cpu, self._peak_rss
+            self._peak_cpu = self.samples[-1].cpu if self.samples else 0.
+            self._peak_rss = self.samples[-1].rss if self.samples else 0
+        return peak
+
+    def text(self):
+        """Returns the rolling averages as a line for a progress message."""
+        summary = self.summary()
+        if summary is None:
+            return "tbd"
+        return "cpu {:.0f}% · rss {} (peak {}) · read {}/s · write {}/s".format(
+            summary.cpu, format_bytes(summary.rss), format_bytes(summary.rss_peak),
+            format_bytes(summary.read_rate), format_bytes(summary.write_rate))
+
+    def close(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+class CasePeaks:
+    """
+    Keeps the cases with the highest peak rss and cpu usage of a batch, in constant memory.
+
+    :param n: Number of cases to keep for each.
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self._rss = []
+        self._cpu = []
+        self._count = 0
+
+    def add(self, case_name, cpu, rss):
+        # The counter breaks ties, so case names are never compared.
+        self._count += 1
+        peak = CasePeak(case_name, cpu, rss)
+        for heap, key in ((self._rss, rss), (self._cpu, cpu)):
+            if len(heap) < self.n:
+                heapq.heappush(heap, (key, self._count, peak))
+            elif key > heap[0][0]:
+                heapq.heapreplace(heap, (key, self._count, peak))
+
+    def by_rss(self):
+        return [peak for _, _, peak in sorted(self._rss, reverse=True)]
+
+    def by_cpu(self):
+        return [peak for _, _, peak in sorted(self._cpu, reverse=True)]
@@ -1,16 +1,18 @@
+import glob
+import hashlib
 import os
+import re
 import shutil
+import stat
+import tempfile
+import threading
+import uuid
+import weakref
 from collections import namedtuple
 from contextlib import closing
+from typing import TYPE_CHECKING
 
 from io import BytesIO
-import zipfile
-
-from slackclient import SlackClient
-from scp import SCPClient
-
-import paramiko
-import paramiko.client
 
 import datetime
 
@@ -20,11 +22,57 @@ import time
 from slack_simbot.msg_handle import MsgHandle
 from slack_simbot.batch_msg_handle import BatchMsgHandle
 from slack_simbot.exception_guard import guard
+from slack_simbot.directory import Directory
+from slack_simbot.metrics import get_metrics
+
+# slackclient, paramiko, scp, asyncio and the modules using them take long to
+# import, so they are imported on first use. Short lived processes that only
+# send a few messages, or run with an inactive simbot, never load them.
+if TYPE_CHECKING:
+    from slack_simbot.dispatcher import Dispatcher
+    from slack_simbot.rate_limit import TokenBucket
+    from slack_simbot.dashboard import BatchDashboard
+    from slack_simbot.watchdog import BatchWatchdog
+    from slack_simbot.finisher import Finisher
+    from slack_simbot.commands import CommandHandler
+
+# Local archives of the chunked uploads running in this process. They aren't interrupted uploads to resume.
+_uploading = set()
+_uploading_lock = threading.Lock()
 
 
 class SimBot:
-    def __init__(self, default_channel="#sim_notifications", debug=False, active=True, token=None):
+    """
+    Sends simulation notifications to Slack and uploads results.
+
+    A SimBot and its batches can be used from many threads at once:
+
+    - The slack client, dispatcher, directory and ssh pool are created once,
+      under a lock, and shared. The outbox, dispatcher, metrics and ssh pool
+      are thread safe themselves.
+    - Api calls on the same message are serialized by a lock per message,
+      see `message_lock`, so they reach Slack in the order they were made.
+      Other calls run in parallel.
+    - Each BatchMsgHandle has its own lock around its progress state, so
+      batches don't wait for each other. Progress messages rendered by
+      different threads are numbered, and one older than the last one sent
+      is dropped instead of overwriting newer progress.
+    - Progress updates are coalesced to one per `update_interval` per
+      message, and all updates share the token bucket in `rate_limit`,
+      whether they're sent directly or by the dispatcher.
+    - Archives get a unique name on the server, see `remote_file_name`.
+      Local archives are named after their remote path and written to a
+      temporary file first, so concurrent uploads of the same directory,
+      or of batches with the same title, don't write to the same file.
+    """
+
+    def __init__(self, default_channel="#sim_notifications", debug=False, active=True, token=None,
+                 async_updates=False, update_interval=1.0, directory_ttl=3600, directory_path=None,
+                 outbox_path=None, outbox_timeout=5., metrics=None, overhead_threshold=0.01, slack_client=None,
+                 history_path=None, finish_workers=2):
         self.debug = debug
+        self.async_updates = async_updates
+        self.update_interval = update_interval
         self.token = token or os.environ.get('SIMBOT_TOKEN')
         self.default_channel = "#simbot_testing" if debug else default_channel
         self._active = active
@@ -32,40 +80,253 @@ class SimBot:
         if self.token is None:
             print("Warning: No access to simbot.")
 
-        self.slack_client = SlackClient(self.token)
-
-        self.ssh_client = None
+        # Any object with SlackClient's api_call can be used instead, e.g. to talk to a local stand-in.
+        # Otherwise a SlackClient is created on the first api call.
+        self._slack_client = slack_client
+        self.metrics = metrics or get_metrics()
+        self.overhead_threshold = overhead_threshold
+
+        # Guards the creation of the shared clients and the message locks.
+        self._lock = threading.Lock()
+        self._message_locks = weakref.WeakValueDictionary()
+
+        self.ssh_pool = None
+        self._dispatcher = None
+        self._rate_limit = None
+        self.directory_ttl = directory_ttl
+        self.directory_path = directory_path or os.path.join(
+            os.path.expanduser("~"), ".cache", "slack_simbot",
+            "directory_{}.json".format(hashlib.sha1((self.token or "").encode()).hexdigest()[:12]))
+        self._directory = None
+
+        # With an outbox all messages are stored on disk and sent from a background thread.
+        self.outbox_timeout = outbox_timeout
+        self.outbox = None
+        if outbox_path is not None and self.active:
+            from slack_simbot.outbox import Outbox
+            self.outbox = Outbox(outbox_path, self.api_call, min_interval=update_interval)
+
+        # Batches that haven't finished yet, which slash commands report on.
+        self._batches = []
+        self._batches_lock = threading.Lock()
+        self._commands = None
+
+        # Number of batches finished at the same time with finish(detach=True).
+        self.finish_workers = finish_workers
+
+        # With a history the timing of each batch is recorded and seeds the eta of its next runs.
+        self.history = None
+        if history_path is not None and self.active:
+            from slack_simbot.history import RunHistory
+            self.history = RunHistory(history_path)
 
     @property
     def active(self):
         # return False
         return self.token is not None and self._active
 
+    @property
+    def slack_client(self):
+        if self._slack_client is None:
+            from slackclient import SlackClient
+            with self._lock:
+                if self._slack_client is None:
+                    self._slack_client = SlackClient(self.token)
+        return self._slack_client
+
+    @slack_client.setter
+    def slack_client(self, slack_client):
+        self._slack_client = slack_client
+
+    @property
+    def rate_limit(self) -> "TokenBucket":
+        """Returns the token bucket limiting the message updates of this simbot to Slack's tier 3."""
+        if self._rate_limit is None:
+            from slack_simbot.rate_limit import TokenBucket
+            with self._lock:
+                if self._rate_limit is None:
+                    self._rate_limit = TokenBucket.for_tier(3)
+        return self._rate_limit
+
+    @rate_limit.setter
+    def rate_limit(self, rate_limit):
+        self._rate_limit = rate_limit
+
+    @property
+    def dispatcher(self) -> "Dispatcher":
+        """Returns the dispatcher sending api calls from the secondary event loop."""
+        if self._dispatcher is None:
+            from slack_simbot.dispatcher import Dispatcher
+            rate_limit = self.rate_limit
+            with self._lock:
+                if self._dispatcher is None:
+                    # The dispatcher calls the api through this simbot, so its calls are recorded in the metrics.
+                    self._dispatcher = Dispatcher(self, debug=self.debug, min_interval=self.update_interval,
+                                                  rate_limit=rate_limit)
+        return self._dispatcher
+
+    @property
+    def finisher(self) -> "Finisher":
+        """Returns the process wide pool running detached finishes."""
+        from slack_simbot.finisher import get_finisher
+        return get_finisher(self.finish_workers)
+
+    def wait_all(self, timeout=None):
+        """
+        Blocks until all batches finished with finish(detach=True) are done.
+
+        :return: True if they are all done, False if the timeout expired first.
+        """
+        from slack_simbot import finisher
+        return finisher._finisher is None or finisher._finisher.wait_all(timeout)
+
+    def running_batches(self):
+        """Returns the batches of this simbot that haven't finished yet."""
+        with self._batches_lock:
+            return list(self._batches)
+
+    def _register_batch(self, batch):
+        with self._batches_lock:
+            self._batches.append(batch)
+
+    def _unregister_batch(self, batch):
+        with self._batches_lock:
+            if batch in self._batches:
+                self._batches.remove(batch)
+
+    @guard
+    def commands(self, signing_secret=None, allowed_users=None, http_address=None, app_token=None) -> "CommandHandler":
+        """
+        Starts answering `/simbot status` and `/simbot cancel` about the running batches.
+
+        :param signing_secret: Signing secret of the Slack app, used to verify http requests.
+        :param allowed_users: Optional ids of the users allowed to cancel batches.
+        :param http_address: (host, port) of a local http endpoint to answer slash commands on.
+        :param app_token: App level token to receive slash commands over Socket Mode.
+        :return: CommandHandler, or None if the simbot is inactive.
+        """
+        if not self.active:
+            return None
+        if self._commands is None:
+            from slack_simbot.commands import CommandHandler
+            self._commands = CommandHandler(self, signing_secret=signing_secret, allowed_users=allowed_users)
+        if http_address is not None:
+            self._commands.serve_http(*http_address)
+        if app_token is not None:
+            self._commands.connect_socket_mode(app_token)
+        return self._commands
+
+    @property
+    def directory(self) -> Directory:
+        """Returns the cached directory of users and channels, loaded from its snapshot if there is one."""
+        if self._directory is None:
+            with self._lock:
+                if self._directory is None:
+                    self._directory = Directory(self.api_call, ttl=self.directory_ttl,
+                                                snapshot_path=self.directory_path)
+        return self._directory
+
+    def message_lock(self, handle: MsgHandle):
+        """
+        Returns the lock serializing the api calls on a message.
+
+        The handle keeps the lock alive. Once no handle of the message is
+        left, the lock is dropped, also if the message is never deleted.
+        """
+        key = handle.outbox_id or (handle.channel, handle.ts)
+        with self._lock:
+            lock = self._message_locks.get(key)
+            if lock is None:
+                lock = self._message_locks[key] = threading.RLock()
+            handle._message_lock = lock
+            return lock
+
+    def _forget_message(self, handle: MsgHandle):
+        with self._lock:
+            self._message_locks.pop(handle.outbox_id or (handle.channel, handle.ts), None)
+
+    def api_call(self, method, **kwargs):
+        """
+        Calls a Slack api method with the slack client, recording its latency and outcome in the metrics.
+
+        An inactive simbot doesn't call slack and returns {"ok": False, "error": "inactive"}.
+        """
+        if not self.active:
+            return {"ok": False, "error": "inactive"}
+        t0 = time.perf_counter()
+        try:
+            r = self.slack_client.api_call(method, **kwargs)
+        except Exception as e:
+            self.metrics.inc("slack_api_errors_total", method=method, error=type(e).__name__)
+            raise
+        finally:
+            self.metrics.observe("slack_api_seconds", time.perf_counter() - t0, method=method)
+
+        self.metrics.inc("slack_api_calls_total", method=method)
+        if r.get("error") == "ratelimited":
+            self.metrics.inc("slack_api_ratelimited_total", method=method)
+        elif not r.get("ok"):
+            self.metrics.inc("slack_api_errors_total", method=method, error=r.get("error"))
+        return r
+
+    def post_message(self, **kwargs) -> MsgHandle:
+        """
+        Posts a message, through the outbox if there is one.
+
+        If the outbox can't send the message within `outbox_timeout` seconds,
+        it stays queued and the returned handle's ts is filled in once it has
+        been sent. Updates and deletes of the handle are queued after it.
+
+        :return: MsgHandle, or None if slack refused the message.
+        """
+        if self.outbox is None:
+            r = self.api_call("chat.postMessage", **kwargs)
+            if r['ok']:
+                return MsgHandle(r['ts'], r['channel'])
+            else:
+                return None
+
+        outbox_id = self.outbox.new_handle()
+        r = self.outbox.call("chat.postMessage", handle=outbox_id, creates=True, timeout=self.outbox_timeout,
+                             **kwargs)
+        if r is None:
+            handle = MsgHandle(None, kwargs.get("channel"), outbox_id=outbox_id)
+            self.outbox.bind(handle)
+            return handle
+        elif r['ok']:
+            return MsgHandle(r['ts'], r['channel'], outbox_id=outbox_id)
+        else:
+            return None
+
+    def message_call(self, method, handle: MsgHandle, **kwargs):
+        """
+        Calls an api method on an existing message, like 'chat.update' or 'chat.delete'.
+
+        With an outbox the call is queued and {"ok": True, "queued": True} is returned.
+        """
+        with self.message_lock(handle):
+            if self.outbox is None:
+                return self.api_call(method, ts=handle.ts, channel=handle.channel, **kwargs)
+            self.outbox.submit(method, handle=self.outbox.handle_id(handle), **kwargs)
+            return {"ok": True, "queued": True}
+
     @guard
     def send_msg(self, msg, channel=None) -> MsgHandle:
         if self.active:
-            channel = channel or self.default_channel
-            r = self.slack_client.api_call(
-                "chat.postMessage",
-                channel=channel,
+            return self.post_message(
+                channel=channel or self.default_channel,
                 text=msg,
                 as_user="1",
                 parse="full",
                 link_names="1"
             )
 
-            if r['ok']:
-                return MsgHandle(r['ts'], r['channel'])
-            else:
-                return None
-
     @guard
     def update_msg(self, handle: MsgHandle, msg):
         if self.active:
-            return self.slack_client.api_call(
+            return self.message_call(
                 "chat.update",
-                ts=handle.ts,
-                channel=handle.channel,
+                handle,
                 text=msg,
                 parse="full",
                 link_names="1",
@@ -75,59 +336,292 @@ class SimBot:
     @guard
     def delete_msg(self, handle: MsgHandle):
         if self.active:
-            return self.slack_client.api_call(
-                "chat.delete",
-                channel=handle.channel,
-                ts=handle.ts
-            )
+            r = self.message_call("chat.delete", handle)
+            self._forget_message(handle)
+            return r
 
     @guard
-    def get_channel_list(self):
-        return self.slack_client.api_call("channels.list")
+    def get_channel_list(self, refresh=False):
+        """Returns all channels in the format of a channels.list response, from the directory cache."""
+        if not self.active:
+            return {"ok": True, "channels": []}
+        if refresh:
+            self.directory.refresh(users=False)
+        return {"ok": True, "channels": self.directory.channels}
 
     @guard
-    def connect_ssh(self, hostname="daresim.tk", username="daresimserver", key_filename=None, password=None):
+    def connect_ssh(self, hostname="daresim.tk", username="daresimserver", key_filename=None, password=None,
+                    port=22, max_size=4):
+        """
+        Selects the ssh server results are uploaded to.
+
+        Connections come from a process wide pool per host, which reconnects
+        broken connections and allows up to `max_size` parallel transfers.
+        One connection is opened right away so connection errors surface here.
+
+        :return: SSHPool
+        """
+        return self._connect_ssh(hostname, username, key_filename, password, port, max_size)
+
+    def _connect_ssh(self, hostname="daresim.tk", username="daresimserver", key_filename=None, password=None, port=22,
+                     max_size=4):
+        # The guarded methods call unguarded versions like this one, which raise, so callers that report the
+        # failure themselves, like BatchMsgHandle.finish, see the exception instead of exc_info.
         if self.active:
+            import paramiko
+            from slack_simbot.ssh_pool import get_pool, drop_pool
+            # get_pool returns the same pool to threads connecting at the same time.
+            ssh_pool = get_pool(hostname, username=username, port=port, key_filename=key_filename,
+                                password=password, max_size=max_size)
             try:
-                if self.ssh_client is None:
-                    ssh_client = paramiko.SSHClient()
-                    ssh_client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
-                    ssh_client.load_system_host_keys()
-                    ssh_client.connect(hostname, username=username, key_filename=key_filename, password=password)
-                    self.ssh_client = ssh_client
-                return
-
-            except paramiko.BadHostKeyException:
-                pass
+                with ssh_pool.connection():
+                    pass
             except paramiko.AuthenticationException:
-                pass
-            except paramiko.SSHException:
-                pass
-            self.ssh_client = None
+                # Later calls with the same settings get a new pool and try again, instead of a broken one.
+                drop_pool(ssh_pool)
+                raise
+            self.ssh_pool = ssh_pool
+            return ssh_pool
 
     @guard
-    def compress_directory(self, dir_path):
-        _, dir_name = os.path.split(dir_path)
+    def compress_directory(self, dir_path, codec="deflate", level=None, workers=None, visit=None, zip_path=None):
+        """
+        Compresses a directory into '../<dir_name>.zip' next to it, or into `zip_path`.
+
+        The archive is written to a temporary file that is renamed once it's
+        complete, so threads compressing the same directory don't mix their
+        output and the archive at the path is always complete.
+
+        :param dir_path: Directory to compress.
+        :param codec: One of 'none', 'deflate' or 'zstd'.
+        :param level: Compression level. Uses the codec's default if None.
+        :param workers: Number of worker processes. Uses all cores if None.
+        :param visit: Optional callable called with each walked file, see `write_archive`.
+        :param zip_path: Path of the archive.
+        :return: CompressionReport with the path of the archive and the files
+                 that could not be archived. None if the directory does not exist.
+        """
+        return self._compress_directory(dir_path, codec, level, workers, visit, zip_path)
+
+    def _compress_directory(self, dir_path, codec="deflate", level=None, workers=None, visit=None, zip_path=None):
+        from slack_simbot.compression import write_archive
+        _, dir_name = os.path.split(os.path.normpath(dir_path))
 
         if os.path.isdir(dir_path):
-            zip_path = os.path.abspath(os.path.join(dir_path, "../{}.zip".format(dir_name)))
-            # Open zip file.
-            with zipfile.ZipFile(zip_path, "w") as zf:
-                # Walk through target directory
-                for dir_name, sub_dirs, files in os.walk(dir_path):
-                    # Path of this directory inside the zip file.
-                    arc_dir_name = os.path.relpath(dir_name, os.path.normpath(os.path.join(dir_path, '..')))
+            zip_path = os.path.abspath(zip_path or os.path.join(dir_path, "../{}.zip".format(dir_name)))
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(zip_path) + ".", suffix=".tmp",
+                                            dir=os.path.dirname(zip_path))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    report = write_archive(dir_path, f, codec=codec, level=level, workers=workers, visit=visit)
+                os.replace(tmp_path, zip_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            report.path = zip_path
+            self._record_compression(report)
+            return report
+        else:
+            return None
+
+    @guard
+    def upload_archive(self, dir_path, remote_path, mode="stream", codec="deflate", workers=None, progress=None,
+                       visit=None):
+        """
+        Compresses a directory and uploads the archive to the ssh server.
+
+        In 'stream' mode the archive is written straight into an sftp file
+        while it is being compressed, so no local archive is needed and the
+        upload overlaps with compression. It is written to '<remote_path>.part'
+        and renamed once complete. In 'file' mode the archive is first written
+        next to the directory, named after the remote path, copied with scp
+        and removed. 'chunked' mode also
+        writes the archive locally first and then uploads it in verified
+        chunks over several connections. If an earlier upload of the archive
+        to `remote_path` was interrupted, the archive is not compressed again
+        and the upload resumes where it left off. The archive is kept until
+        the upload succeeds or fails for good. See ChunkedUploader.
+
+        :param dir_path: Directory to upload.
+        :param remote_path: Path of the archive on the server.
+        :param mode: One of 'stream', 'file' or 'chunked'.
+        :param codec: One of 'none', 'deflate' or 'zstd'.
+        :param workers: Number of worker processes used for compression.
+        :param progress: Optional callable receiving the bytes uploaded, the
+                         total bytes and the throughput in MB/s. Only used in
+                         'chunked' mode.
+        :param visit: Optional callable called with each walked file, see `write_archive`.
+        :return: CompressionReport with an UploadReport as its `upload` attribute.
+        """
+        return self._upload_archive(dir_path, remote_path, mode, codec, workers, progress, visit)
+
+    def _upload_archive(self, dir_path, remote_path, mode="stream", codec="deflate", workers=None, progress=None,
+                        visit=None):
+        from slack_simbot.compression import write_archive
+        from slack_simbot.transfer import BackgroundWriter, UploadReport
+        if mode == "stream":
+            t0 = time.perf_counter()
+            part_path = remote_path + ".part"
+            with self.ssh_pool.sftp() as sftp:
+                try:
+                    with sftp.open(part_path, "wb") as f:
+                        # Don't wait for the server to acknowledge each write.
+                        f.set_pipelined(True)
+                        with BackgroundWriter(f) as writer:
+                            report = write_archive(dir_path, writer, codec=codec, workers=workers, visit=visit)
+                except BaseException:
+                    # Don't leave the partial archive behind on the server.
                     try:
-                        # Create directory inside zip file
-                        zf.write(dir_name, arc_dir_name)
-                        # Loop through all files in the directory and put them in the zip file.
-                        for filename in files:
-                            zf.write(os.path.join(dir_name, filename), os.path.join(arc_dir_name, filename))
-                    except:
+                        sftp.remove(part_path)
+                    except Exception:
+                        # The connection may be gone as well.
                         pass
-            return zip_path
+                    raise
+                sftp.rename(part_path, remote_path)
+            self._record_compression(report)
+            report.upload = UploadReport()
+            report.upload.bytes = report.bytes_out
+            report.upload.duration = time.perf_counter() - t0
+        elif mode == "file":
+            from scp import SCPClient
+            report = self._compress_directory(dir_path, codec=codec, workers=workers, visit=visit,
+                                              zip_path=self._archive_path(dir_path, remote_path))
+            if report is None:
+                raise FileNotFoundError("No such directory: '{}'".format(dir_path))
+            t0 = time.perf_counter()
+            try:
+                with self.ssh_pool.connection() as ssh_client:
+                    with SCPClient(ssh_client.get_transport()) as scp:
+                        scp.put(report.path, remote_path)
+            finally:
+                # Don't leave the archive next to the results, also if the copy failed.
+                os.remove(report.path)
+            report.upload = UploadReport()
+            report.upload.bytes = report.bytes_out
+            report.upload.duration = time.perf_counter() - t0
+        elif mode == "chunked":
+            from slack_simbot.chunked_upload import ChunkedUploader
+            zip_path = self._archive_path(dir_path, remote_path)
+            state = ChunkedUploader.saved_state(zip_path)
+            if state is not None and state.get("remote_path") == remote_path:
+                # Resume the interrupted upload with the archive compressed back then. Compressing
+                # again would change the archive and throw away the progress.
+                report = self._archive_report(dir_path, zip_path, codec, visit)
+            else:
+                report = self._compress_directory(dir_path, codec=codec, workers=workers, visit=visit,
+                                                  zip_path=zip_path)
+                if report is None:
+                    raise FileNotFoundError("No such directory: '{}'".format(dir_path))
+            uploader = ChunkedUploader(self.ssh_pool, channels=self.ssh_pool.max_size, progress=progress)
+            with _uploading_lock:
+                _uploading.add(zip_path)
+            try:
+                report.upload = uploader.upload(report.path, remote_path)
+            finally:
+                with _uploading_lock:
+                    _uploading.discard(zip_path)
+                # The archive is kept as long as the upload can be resumed.
+                if not os.path.exists(ChunkedUploader.state_path(report.path)):
+                    os.remove(report.path)
+            report.errors.extend(report.upload.errors)
         else:
-            return None
+            raise ValueError("Unknown upload mode '{}', expected 'stream', 'file' or 'chunked'".format(mode))
+
+        self.metrics.inc("simbot_upload_bytes_total", report.upload.bytes, mode=mode)
+        self.metrics.observe("simbot_upload_seconds", report.upload.duration, mode=mode)
+        if report.upload.n_retried:
+            self.metrics.inc("simbot_upload_retries_total", report.upload.n_retried, mode=mode)
+        return report
+
+    @staticmethod
+    def _archive_report(dir_path, zip_path, codec, visit):
+        # Report of an archive compressed earlier. The directory is still walked for `visit`.
+        from slack_simbot.compression import CompressionReport, walk_directory
+        report = CompressionReport(zip_path, codec)
+        report.bytes_out = os.path.getsize(zip_path)
+        for path, arcname, st in walk_directory(dir_path):
+            if visit is not None:
+                visit(path, arcname, st)
+            if isinstance(st, Exception):
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                report.n_dirs += 1
+            else:
+                report.n_files += 1
+                report.bytes_in += st.st_size
+        return report
+
+    def interrupted_upload(self, dir_path, remote_dir):
+        """
+        Returns the remote path of an interrupted chunked upload of a directory into `remote_dir`.
+
+        Uploads can be resumed as long as their archive and the saved
+        progress are still next to the directory. Returns the most recent
+        one if there are several, or None if there are none.
+        """
+        from slack_simbot.chunked_upload import ChunkedUploader
+        candidates = []
+        pattern = glob.escape(os.path.abspath(dir_path)) + ".*.zip"
+        for zip_path in glob.glob(pattern):
+            with _uploading_lock:
+                if zip_path in _uploading:
+                    # Still being uploaded by another thread.
+                    continue
+            state = ChunkedUploader.saved_state(zip_path)
+            if state is None or not isinstance(state.get("remote_path"), str):
+                continue
+            remote_path = state["remote_path"]
+            if os.path.normpath(os.path.dirname(remote_path)) == os.path.normpath(remote_dir) \
+                    and zip_path == self._archive_path(dir_path, remote_path):
+                candidates.append((os.path.getmtime(ChunkedUploader.state_path(zip_path)), remote_path))
+        return max(candidates)[1] if candidates else None
+
+    def remote_file_name(self, name, dir_path, remote_dir, mode):
+        """
+        Returns the name a directory's archive gets on the server.
+
+        Names are '<name>_<date>_<time>_<random suffix>.zip'. In 'chunked' mode an interrupted upload of the directory into
+        `remote_dir` is resumed under the name it already has.
+        """
+        if mode == "chunked":
+            resumed = self.interrupted_upload(dir_path, remote_dir)
+            if resumed is not None and re.fullmatch(re.escape(name) + r"_\d{8}_\d{6}_[0-9a-f]{8}\.zip",
+                                                    os.path.basename(resumed)):
+                return os.path.basename(resumed)
+        # The random suffix keeps batches with the same title finishing in the same second apart.
+        return "{}_{}_{}.zip".format(name, datetime.datetime.now().strftime('%Y%m%d_%H%M%S'), uuid.uuid4().hex[:8])
+
+    @staticmethod
+    def _archive_path(dir_path, remote_path):
+        # Archive next to the directory, named after where it's uploaded to. Concurrent uploads of the
+        # directory don't share a file, while an interrupted chunked upload finds its archive again.
+        return "{}.{}.zip".format(os.path.abspath(dir_path), hashlib.sha1(remote_path.encode()).hexdigest()[:12])
+
+    def _record_compression(self, report):
+        self.metrics.inc("simbot_compression_input_bytes_total", report.bytes_in, codec=report.codec)
+        self.metrics.inc("simbot_compression_output_bytes_total", report.bytes_out, codec=report.codec)
+        self.metrics.observe("simbot_compression_seconds", report.duration, codec=report.codec)
+
+    @guard
+    def sync_directory(self, dir_path, remote_dir, manifest_path=None, title=None):
+        """
+        Incrementally uploads a directory to remote_dir on the ssh server.
+
+        Only files that changed since the last upload are transferred. See
+        `slack_simbot.transfer.sync_directory` for the layout on the server.
+
+        :return: SyncReport
+        """
+        return self._sync_directory(dir_path, remote_dir, manifest_path, title)
+
+    def _sync_directory(self, dir_path, remote_dir, manifest_path=None, title=None):
+        from slack_simbot.transfer import sync_directory
+        t0 = time.perf_counter()
+        with self.ssh_pool.sftp() as sftp:
+            report = sync_directory(sftp, dir_path, remote_dir, manifest_path=manifest_path, title=title)
+        self.metrics.inc("simbot_upload_bytes_total", report.bytes_uploaded, mode="incremental")
+        self.metrics.observe("simbot_upload_seconds", time.perf_counter() - t0, mode="incremental")
+        return report
 
     @guard
     def upload_directory(self,
@@ -136,25 +630,31 @@ class SimBot:
                          dir_path,
                          remote_path="/var/www/html/data",
                          url="http://daresim.tk/data",
-                         key_filename=None):
-        self.connect_ssh(key_filename=key_filename)
-        zip_path = self.compress_directory(dir_path)
+                         key_filename=None,
+                         mode="stream"):
+        if not self.active:
+            return
+        self._connect_ssh(key_filename=key_filename)
 
-        # Generate the name the file will have on the server.
         _, dir_name = os.path.split(dir_path)
-        remote_file_name = "{}_{}.zip".format(
-        dir_name,
-        datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+        if mode == "incremental":
+            # Only upload the files that changed since the last upload of this directory.
+            self._sync_directory(dir_path, os.path.join(remote_path, dir_name), title=title)
+            url = "{}/{}/".format(url, dir_name)
+        else:
+            # Generate the name the file will have on the server.
+            remote_file_name = self.remote_file_name(dir_name, dir_path, remote_path, mode)
 
-        # Generate the full path of the file on the server
-        remote_path = os.path.join(remote_path, remote_file_name)
+            # Generate the full path of the file on the server
+            remote_path = os.path.join(remote_path, remote_file_name)
 
-        # Generate url pointing to the file.
-        url = "{}/{}".format(url, remote_file_name)
+            # Generate url pointing to the file.
+            url = "{}/{}".format(url, remote_file_name)
 
-        # Upload file to server
-        with SCPClient(self.ssh_client.get_transport()) as scp:
-            scp.put(zip_path, remote_path)
+            # Compress and upload the directory to the server
+            report = self._upload_archive(dir_path, remote_path, mode=mode)
+            if not report.upload.ok:
+                raise IOError("Uploading '{}' failed: {}".format(dir_path, report.upload.errors[0][1]))
 
         fields = [
             {
@@ -169,8 +669,7 @@ class SimBot:
             },
         ]
 
-        r = self.slack_client.api_call(
-            "chat.postMessage",
+        return self.post_message(
             channel=self.default_channel,
             text="@channel",
             as_user="1",
@@ -188,34 +687,73 @@ class SimBot:
             ]
         )
 
-        if r['ok']:
-            return MsgHandle(r['ts'], r['channel'])
-        else:
+    @guard
+    def get_user_(self, title, n_cases, description, *, result_dir=None, channel=None, clear_result_dir=True,
+                  async_updates=None, eta_estimator=None, case_log_path=None, resume=None, dashboard=None,
+                  resources=None, watchdog=None, owner=None, history=None, blocks=False):
+        return BatchMsgHandle(self, title, n_cases, result_dir, description, channel=channel,
+                              clear_result_dir=clear_result_dir, async_updates=async_updates,
+                              eta_estimator=eta_estimator, case_log_path=case_log_path, resume=resume,
+                              dashboard=dashboard, resources=resources, watchdog=watchdog, owner=owner,
+                              history=history, blocks=blocks)
+
+    @guard
+    def dashboard(self, title="Simulation batches", channel=None, interval=5.) -> "BatchDashboard":
+        """
+        Posts a dashboard message several batches can share.
+
+        Pass it to `get_user_` as `dashboard` to show a batch in it instead of in a message of its own.
+        Returns None if the simbot is inactive, so the batches fall back to their own, unsent, messages.
+        """
+        if not self.active:
             return None
+        from slack_simbot.dashboard import BatchDashboard
+        return BatchDashboard(self, title=title, channel=channel, interval=interval)
 
     @guard
-    def get_user_(self, title, n_cases, description, *, result_dir=None, channel=None, clear_result_dir=True):
-        return BatchMsgHandle(self, title, n_cases, result_dir, description, channel=channel,
-                              clear_result_dir=clear_result_dir)
+    def watchdog(self, owner=None, interval=30., stall_factor=5., min_stall=60., regression=0.5,
+                 history_path=None) -> "BatchWatchdog":
+        """
+        Starts a watchdog alerting `owner` when a batch stalls or is slower than its earlier runs.
+
+        Pass it to `get_user_` as `watchdog` to watch a batch. The throughput
+        of earlier runs is taken from the simbot's run history if it has one.
+        Otherwise it's kept in `history_path`, which defaults to a file in
+        ~/.cache/slack_simbot. Returns None if the simbot is inactive.
+        """
+        if not self.active:
+            return None
+        from slack_simbot.watchdog import BatchWatchdog, ThroughputHistory
+        history = self.history or ThroughputHistory(history_path or os.path.join(
+            os.path.expanduser("~"), ".cache", "slack_simbot", "throughput.json"))
+        return BatchWatchdog(self, owner=owner, interval=interval, stall_factor=stall_factor, min_stall=min_stall,
+                             regression=regression, history=history)
 
     @guard
-    def get_users(self):
-        result = self.slack_client.api_call("users.list")
-        users = []
-        if result['ok']:
-            for user in result['members']:
-                try:
-                    if not user['deleted']:
-                        users.append((
-                            user['profile']['email'],
-                            user['profile']['real_name'],
-                            user['profile']['display_name'],
-                            user['profile']['image_192']
-                        ))
-                    # print(user["name"], user['profile']['email'], user['profile']['image_512'])
-                except:
-                    pass
-        return users
+    def get_users(self, refresh=False):
+        """Returns (email, real name, display name, image) tuples of all active users, from the directory cache."""
+        if not self.active:
+            return []
+        if refresh:
+            self.directory.refresh(channels=False)
+        from slack_simbot.async_simbot import parse_users
+        return parse_users({"ok": True, "members": self.directory.users})
+
+    @guard
+    def mention(self, user):
+        """
+        Returns the mention of a user for use in a message.
+
+        :param user: Email address, user or display name, or user id.
+        :return: '<@USER_ID>', or the name with a leading '@' if the user is unknown.
+        """
+        if not self.active:
+            return "@" + user.lstrip("@")
+        entry = self.directory.user_by_email(user) if "@" in user.strip("@") else \
+            self.directory.user_by_name(user) or self.directory.user(user)
+        if entry is None:
+            return "@" + user.lstrip("@")
+        return "<@{}>".format(entry["id"])
 
 
 if __name__ == "__main__":
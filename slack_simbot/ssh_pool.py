@@ -0,0 +1,169 @@
+"""This module contains the pool of ssh connections used to upload results."""
+
+import socket
+import threading
+import time
+from contextlib import contextmanager, closing
+
+import paramiko
+import paramiko.client
+
+from slack_simbot.metrics import registry
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(hostname, username=None, port=22, **kwargs):
+    """
+    Returns the process wide pool of connections to a host, creating it if necessary.
+
+    The keyword arguments are passed to SSHPool. Only calls with the same
+    arguments share a pool, so a pool never connects with other credentials
+    or another size than the ones asked for. See `drop_pool` for pools that
+    failed to authenticate.
+    """
+    key = (hostname, port, username, _settings_key(kwargs))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SSHPool(hostname, username=username, port=port, **kwargs)
+        return pool
+
+
+def drop_pool(pool):
+    """Removes a pool from the process wide pools and closes its connections, e.g. after its authentication failed."""
+    with _pools_lock:
+        for key, cached in list(_pools.items()):
+            if cached is pool:
+                del _pools[key]
+    pool.close()
+
+
+def _settings_key(kwargs):
+    # key_filename can be a list of files as well.
+    return tuple(sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in kwargs.items()))
+
+
+class SSHPool:
+    """
+    Bounded pool of ssh connections to a single host.
+
+    Connections are checked before being handed out and replaced when their
+    transport is no longer active. Keepalive packets are sent on idle
+    connections so dead peers are detected. Connecting is retried with
+    exponential backoff, except for authentication and host key errors.
+    Up to `max_size` connections are open at the same time, so several
+    transfers to the same host can run in parallel.
+    """
+
+    def __init__(self, hostname, username=None, port=22, key_filename=None, password=None, max_size=4,
+                 keepalive=30, max_retries=4, backoff=1., timeout=30):
+        self.hostname = hostname
+        self.username = username
+        self.port = port
+        self.key_filename = key_filename
+        self.password = password
+        self.max_size = max_size
+        self.keepalive = keepalive
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._idle = []
+        self._n_open = 0
+        self._condition = threading.Condition()
+
+    def _connect(self):
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            ssh_client = paramiko.SSHClient()
+            ssh_client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
+            ssh_client.load_system_host_keys()
+            try:
+                with registry.timer("ssh_connect_seconds", host=self.hostname):
+                    ssh_client.connect(self.hostname, port=self.port, username=self.username,
+                                       key_filename=self.key_filename, password=self.password, timeout=self.timeout)
+                ssh_client.get_transport().set_keepalive(self.keepalive)
+                return ssh_client
+            except (paramiko.BadHostKeyException, paramiko.AuthenticationException) as e:
+                ssh_client.close()
+                registry.inc("ssh_connect_errors_total", host=self.hostname, error=type(e).__name__)
+                raise
+            except (paramiko.SSHException, socket.error) as e:
+                ssh_client.close()
+                registry.inc("ssh_connect_errors_total", host=self.hostname, error=type(e).__name__)
+                if attempt == self.max_retries:
+                    raise
+                registry.inc("ssh_connect_retries_total", host=self.hostname)
+            time.sleep(delay)
+            delay *= 2
+
+    @staticmethod
+    def is_alive(ssh_client):
+        transport = ssh_client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def acquire(self, timeout=None):
+        """Returns a live connection, waiting for one to be released if the pool is full."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                while self._idle:
+                    ssh_client = self._idle.pop()
+                    if self.is_alive(ssh_client):
+                        return ssh_client
+                    ssh_client.close()
+                    self._n_open -= 1
+
+                if self._n_open < self.max_size:
+                    self._n_open += 1
+                    break
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No ssh connection to {} available".format(self.hostname))
+                self._condition.wait(remaining)
+
+        # Connect outside of the lock so other threads can use idle connections meanwhile.
+        try:
+            return self._connect()
+        except BaseException:
+            with self._condition:
+                self._n_open -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, ssh_client, discard=False):
+        """Returns a connection to the pool. Broken or discarded connections are closed."""
+        with self._condition:
+            if discard or not self.is_alive(ssh_client):
+                ssh_client.close()
+                self._n_open -= 1
+            else:
+                self._idle.append(ssh_client)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager acquiring a connection and releasing it afterwards."""
+        ssh_client = self.acquire(timeout)
+        try:
+            yield ssh_client
+        finally:
+            self.release(ssh_client)
+
+    @contextmanager
+    def sftp(self, timeout=None):
+        """Context manager opening an sftp session on a pooled connection."""
+        with self.connection(timeout) as ssh_client:
+            with closing(ssh_client.open_sftp()) as sftp:
+                yield sftp
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._condition:
+            for ssh_client in self._idle:
+                ssh_client.close()
+            self._n_open -= len(self._idle)
+            self._idle = []
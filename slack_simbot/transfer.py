@@ -0,0 +1,231 @@
+"""This module contains helpers used to transfer result archives to the server."""
+
+import datetime
+import html
+import os
+import posixpath
+import queue
+import sys
+from threading import Thread
+from urllib.parse import quote
+
+from slack_simbot.manifest import Manifest
+
+
+class BackgroundWriter:
+    """
+    File-like object writing to another file from a background thread.
+
+    Small writes are collected into blocks of `block_size` bytes. At most
+    `max_blocks` blocks are queued, which bounds memory and makes the
+    producer wait when the destination is slower than it. Used to overlap
+    producing an archive with sending it over the network.
+    """
+
+    def __init__(self, fileobj, block_size=1024 * 1024, max_blocks=8):
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.bytes_written = 0
+        self._buffer = []
+        self._buffered = 0
+        self._queue = queue.Queue(max_blocks)
+        self._exc_info = None
+        self._thread = Thread(target=self._target, name="simbot_writer", daemon=True)
+        self._thread.start()
+
+    def _target(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                return
+            if self._exc_info is None:
+                try:
+                    self.fileobj.write(block)
+                except Exception:
+                    # Keep consuming so the producer does not block forever.
+                    self._exc_info = sys.exc_info()
+
+    def _raise(self):
+        if self._exc_info is not None:
+            _, exc, tb = self._exc_info
+            raise exc.with_traceback(tb)
+
+    def write(self, data):
+        self._raise()
+        self._buffer.append(bytes(data))
+        self._buffered += len(data)
+        self.bytes_written += len(data)
+        if self._buffered >= self.block_size:
+            self._put_buffer()
+        return len(data)
+
+    def _put_buffer(self):
+        if self._buffer:
+            self._queue.put(b"".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        """Writes the remaining data and waits for the background thread to finish."""
+        if self._thread.is_alive():
+            self._put_buffer()
+            self._queue.put(None)
+            self._thread.join()
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class UploadReport:
+    """Summary of an upload."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.duration = 0.
+        self.n_chunks = 1
+        self.n_resumed = 0
+        self.n_retried = 0
+        self.errors = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    @property
+    def throughput(self):
+        """Upload speed in MB/s."""
+        return self.bytes / 1e6 / self.duration if self.duration else 0.
+
+    def __repr__(self):
+        return "<UploadReport {} bytes in {:.1f} s ({:.1f} MB/s), {} errors>".format(
+            self.bytes, self.duration, self.throughput, len(self.errors))
+
+
+class SyncReport:
+    """Summary of an incremental upload."""
+
+    def __init__(self):
+        self.uploaded = []
+        self.removed = []
+        self.n_unchanged = 0
+        self.bytes_total = 0
+        self.bytes_uploaded = 0
+        self.errors = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def __repr__(self):
+        return "<SyncReport {} uploaded, {} unchanged, {} removed, {}/{} bytes, {} errors>".format(
+            len(self.uploaded), self.n_unchanged, len(self.removed),
+            self.bytes_uploaded, self.bytes_total, len(self.errors))
+
+
+def sftp_makedirs(sftp, path, created=None):
+    """Creates a remote directory and its parents if they don't exist yet."""
+    created = set() if created is None else created
+    parts = []
+    while path not in ("", "/") and path not in created:
+        parts.append(path)
+        path = posixpath.dirname(path)
+    for part in reversed(parts):
+        try:
+            sftp.stat(part)
+        except IOError:
+            sftp.mkdir(part)
+        created.add(part)
+
+
+def sftp_put_atomic(sftp, local_path_or_data, remote_path):
+    """Uploads a local file, or bytes, to '<remote_path>.part' and renames it to remote_path."""
+    part_path = remote_path + ".part"
+    if isinstance(local_path_or_data, bytes):
+        with sftp.open(part_path, "wb") as f:
+            f.set_pipelined(True)
+            f.write(local_path_or_data)
+    else:
+        sftp.put(local_path_or_data, part_path)
+    sftp.posix_rename(part_path, remote_path)
+
+
+def render_index(title, manifest):
+    """Renders the html index listing the files of an incrementally uploaded directory."""
+    rows = "\n".join(
+        '<tr><td><a href="files/{0}">{1}</a></td><td>{2}</td></tr>'.format(
+            quote(rel_path), html.escape(rel_path), entry["size"])
+        for rel_path, entry in sorted(manifest.files.items()))
+    return ("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{0}</title></head><body>\n"
+            "<h1>{0}</h1>\n<p>Updated {1}</p>\n<table>\n{2}\n</table>\n</body></html>\n").format(
+        html.escape(title), datetime.datetime.now().strftime("%d-%b-%Y %H:%M:%S"), rows)
+
+
+def sync_directory(sftp, dir_path, remote_dir, manifest_path=None, title=None):
+    """
+    Incrementally uploads a directory to the server.
+
+    The files are mirrored in '<remote_dir>/files'. A manifest with the
+    hash of each file is kept both locally and in '<remote_dir>/manifest.json'.
+    Only files whose hash differs from the remote manifest are uploaded and
+    files that no longer exist locally are removed. An 'index.html' listing
+    the files is written to remote_dir.
+
+    :param sftp: paramiko SFTPClient.
+    :param dir_path: Local directory to upload.
+    :param remote_dir: Directory on the server.
+    :param manifest_path: Path of the local manifest. Defaults to
+                          '.<dir_name>.manifest.json' next to the directory.
+    :param title: Title of the index page.
+    :return: SyncReport
+    """
+    dir_path = os.path.abspath(dir_path)
+    parent, dir_name = os.path.split(dir_path)
+    manifest_path = manifest_path or os.path.join(parent, ".{}.manifest.json".format(dir_name))
+
+    manifest = Manifest.scan(dir_path, Manifest.load(manifest_path))
+    remote_manifest_path = posixpath.join(remote_dir, "manifest.json")
+    try:
+        with sftp.open(remote_manifest_path, "rb") as f:
+            remote_manifest = Manifest.loads(f.read().decode("utf-8"))
+    except IOError:
+        remote_manifest = Manifest()
+
+    report = SyncReport()
+    report.bytes_total = manifest.total_size
+    changed = manifest.changed(remote_manifest)
+    report.n_unchanged = len(manifest.files) - len(changed)
+
+    created = set()
+    files_dir = posixpath.join(remote_dir, "files")
+    sftp_makedirs(sftp, files_dir, created)
+    for rel_path in changed:
+        remote_path = posixpath.join(files_dir, rel_path)
+        try:
+            sftp_makedirs(sftp, posixpath.dirname(remote_path), created)
+            sftp_put_atomic(sftp, os.path.join(dir_path, *rel_path.split("/")), remote_path)
+            report.uploaded.append(rel_path)
+            report.bytes_uploaded += manifest.files[rel_path]["size"]
+        except (IOError, OSError) as e:
+            report.errors.append((rel_path, str(e)))
+            # Keep the manifest in line with what is on the server, so the file is uploaded again next time.
+            if rel_path in remote_manifest.files:
+                manifest.files[rel_path] = remote_manifest.files[rel_path]
+            else:
+                del manifest.files[rel_path]
+
+    for rel_path in manifest.removed(remote_manifest):
+        try:
+            sftp.remove(posixpath.join(files_dir, rel_path))
+            report.removed.append(rel_path)
+        except IOError as e:
+            report.errors.append((rel_path, str(e)))
+
+    sftp_put_atomic(sftp, manifest.dumps().encode("utf-8"), remote_manifest_path)
+    sftp_put_atomic(sftp, render_index(title or dir_name, manifest).encode("utf-8"),
+                    posixpath.join(remote_dir, "index.html"))
+    manifest.save(manifest_path)
+    return report
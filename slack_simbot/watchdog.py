@@ -0,0 +1,203 @@
+"""This module contains the watchdog alerting when running batches stall or slow down."""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from slack_simbot.eta import quantile
+from slack_simbot.event_loop import get_event_loop
+
+
+class ThroughputHistory:
+    """
+    Throughput of the last runs of each batch title, kept in a json file.
+
+    :param path: Path of the json file. Nothing is saved if None.
+    :param n_runs: Number of runs kept per title.
+    """
+
+    def __init__(self, path=None, n_runs=10):
+        self.path = path
+        self.n_runs = n_runs
+        self._runs = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self._runs = {title: list(rates) for title, rates in json.load(f).items()}
+            except (IOError, ValueError, AttributeError, TypeError):
+                pass
+
+    def record(self, title, rate):
+        """Records the throughput of a finished run in cases per second."""
+        with self._lock:
+            rates = self._runs.setdefault(title, [])
+            rates.append(rate)
+            del rates[:-self.n_runs]
+            runs = dict(self._runs)
+        if self.path is not None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(tmp_path, "w") as f:
+                json.dump(runs, f)
+            os.replace(tmp_path, self.path)
+
+    def baseline(self, title):
+        """Returns the median throughput of the earlier runs of a title, or None if there are none."""
+        with self._lock:
+            rates = self._runs.get(title)
+            return quantile(rates, 0.5) if rates else None
+
+
+class _Watched:
+    def __init__(self, batch, owner):
+        self.batch = batch
+        self.owner = owner
+        self.stalled = False
+        self.regressed = False
+
+
+class BatchWatchdog:
+    """
+    Posts an alert when a running batch stalls or is much slower than its earlier runs.
+
+    Every `interval` seconds a coroutine on the secondary event loop checks
+    the watched batches, so a batch that hangs is still noticed. A batch
+    has stalled when no case finished within `stall_factor` times the
+    expected time between cases, which is taken from its eta estimator,
+    or from earlier runs until the estimator has a throughput. It is never
+    less than `min_stall` seconds. A batch has regressed when, after
+    `min_cases` cases, its throughput is below `regression` times the
+    median throughput of earlier runs with the same title. The alerts
+    mention the owner of the batch. A batch that continues after a stall
+    gets a second message saying so.
+
+    :param simbot: SimBot used to send the alerts.
+    :param owner: Default owner mentioned in alerts. Email address, user name or user id.
+    :param interval: Number of seconds between checks.
+    :param stall_factor: Multiple of the expected time between cases after which a batch has stalled.
+    :param min_stall: Minimum number of seconds without progress before a batch has stalled.
+    :param regression: Fraction of the usual throughput below which a batch has regressed.
+    :param min_cases: Number of finished cases before the throughput is compared.
+    :param history: ThroughputHistory or RunHistory with the earlier runs. Runs are not compared if None.
+    """
+
+    def __init__(self, simbot, owner=None, interval=30., stall_factor=5., min_stall=60., regression=0.5,
+                 min_cases=10, history=None):
+        self.simbot = simbot
+        self.owner = owner
+        self.interval = interval
+        self.stall_factor = stall_factor
+        self.min_stall = min_stall
+        self.regression = regression
+        self.min_cases = min_cases
+        self.history = history
+        self.n_alerts = 0
+        self.errors = deque(maxlen=100)
+        self._watched = {}
+        self._lock = threading.Lock()
+
+        self.loop = get_event_loop(debug_enabled=False)
+        self._task = asyncio.run_coroutine_threadsafe(self._run(), self.loop)
+
+    def watch(self, batch, owner=None):
+        """Starts watching a batch. Called by BatchMsgHandle."""
+        with self._lock:
+            self._watched[id(batch)] = _Watched(batch, owner or self.owner)
+
+    def unwatch(self, batch):
+        """Stops watching a batch and records its throughput in the history. Called by BatchMsgHandle.finish."""
+        with self._lock:
+            watched = self._watched.pop(id(batch), None)
+        if watched is None or self.history is None or batch.last_update_time is None:
+            return
+        if getattr(batch, "history", None) is self.history:
+            # The batch records its run in the history itself.
+            return
+        elapsed = (batch.last_update_time - batch.start_time).total_seconds()
+        if len(batch.cases) and elapsed > 0:
+            self.history.record(batch.title, len(batch.cases) / elapsed)
+
+    def expected_interval(self, batch):
+        """Returns the expected number of seconds between finished cases, or None if unknown."""
+        rate = batch.throughput()
+        if rate is None and self.history is not None:
+            rate = self.history.baseline(batch.title)
+        return 1 / rate if rate else None
+
+    def check(self, now=None):
+        """
+        Checks all watched batches and returns the alerts as (batch, owner, text) tuples.
+
+        Each stall and regression is only reported once.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            watched = list(self._watched.values())
+
+        alerts = []
+        for entry in watched:
+            batch = entry.batch
+            last = (batch.last_update_time or batch.start_time).timestamp()
+            silence = now - last
+            expected = self.expected_interval(batch)
+            if expected is not None:
+                limit = max(self.stall_factor * expected, self.min_stall)
+                if silence > limit and not entry.stalled:
+                    entry.stalled = True
+                    alerts.append((batch, entry.owner,
+                                   "Batch '{}' has stalled: no case finished in {:.0f} s, usually one every "
+                                   "{:.0f} s. Last case: {}, progress {}/{}.".format(
+                                       batch.title, silence, expected, batch.cases.last or "none",
+                                       len(batch.cases), batch.n_cases)))
+                elif silence <= limit and entry.stalled:
+                    entry.stalled = False
+                    alerts.append((batch, entry.owner, "Batch '{}' continued, progress {}/{}.".format(
+                        batch.title, len(batch.cases), batch.n_cases)))
+
+            if self.history is None or entry.regressed or len(batch.cases) < self.min_cases:
+                continue
+            rate = batch.throughput()
+            baseline = self.history.baseline(batch.title)
+            if rate and baseline and rate < self.regression * baseline:
+                entry.regressed = True
+                alerts.append((batch, entry.owner,
+                               "Batch '{}' is running at {:.3g} cases/s, {:.0%} of the usual {:.3g} cases/s.".format(
+                                   batch.title, rate, rate / baseline, baseline)))
+        return alerts
+
+    def alert(self, batch, owner, text):
+        """Posts an alert in the channel of a batch. Blocks, so it's not called on the event loop."""
+        if owner is not None:
+            text = "{} {}".format(self.simbot.mention(owner), text)
+        self.n_alerts += 1
+        self.simbot.metrics.inc("simbot_watchdog_alerts_total")
+        self.simbot.post_message(
+            channel=batch.channel,
+            text=":warning: " + text,
+            as_user="1",
+            parse="full",
+            link_names="1"
+        )
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                for alert in self.check():
+                    await self.loop.run_in_executor(None, self.alert, *alert)
+            except Exception:
+                # Keep watching, the check is repeated anyway.
+                self.errors.append(sys.exc_info())
+
+    def close(self):
+        """Stops watching all batches."""
+        self._task.cancel()
+        with self._lock:
+            self._watched.clear()
@@ -0,0 +1,115 @@
+"""This module contains the Slack client stand-ins shared by the tests."""
+
+import threading
+import time
+
+
+class RecordingSlackClient:
+    """
+    Records the api calls made and answers them successfully.
+
+    :param users: Members returned by users.list.
+    :param unique_ts: Whether each chat.postMessage gets its own timestamp,
+                      instead of all messages having timestamp '1.0'.
+    """
+
+    def __init__(self, users=(), unique_ts=False):
+        self.users = list(users)
+        self.unique_ts = unique_ts
+        self.calls = []
+        self.n_posted = 0
+        self.lock = threading.Lock()
+
+    def api_call(self, method, **kwargs):
+        with self.lock:
+            self.calls.append((method, kwargs))
+            if method == "chat.postMessage":
+                self.n_posted += 1
+            ts = "{}.0".format(self.n_posted) if self.unique_ts and method == "chat.postMessage" else "1.0"
+        if method == "users.list":
+            return {"ok": True, "members": self.users, "response_metadata": {"next_cursor": ""}}
+        return {"ok": True, "ts": ts, "channel": kwargs.get("channel")}
+
+    def methods(self):
+        with self.lock:
+            return [method for method, _ in self.calls]
+
+    def messages(self, prefix=""):
+        """Returns the texts of the posted messages starting with `prefix`."""
+        with self.lock:
+            return [kwargs["text"] for method, kwargs in self.calls
+                    if method == "chat.postMessage" and kwargs.get("text", "").startswith(prefix)]
+
+
+class SlowSlackClient(RecordingSlackClient):
+    """
+    Takes `delay` seconds per call and answers the first `n_ratelimited` calls with a rate limit error.
+
+    :param slow: Optional callable taking the method and arguments of a call,
+                 returning whether the call is delayed. All calls are if None.
+    """
+
+    def __init__(self, delay=0.05, n_ratelimited=0, slow=None, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.n_ratelimited = n_ratelimited
+        self.slow = slow
+
+    def api_call(self, method, **kwargs):
+        if self.slow is None or self.slow(method, kwargs):
+            time.sleep(self.delay)
+        with self.lock:
+            ratelimited = self.n_ratelimited > 0
+            self.n_ratelimited -= ratelimited
+        if ratelimited:
+            return {"ok": False, "error": "ratelimited", "headers": {"Retry-After": "0.1"}}
+        return super().api_call(method, **kwargs)
+
+
+class CheckingSlackClient(RecordingSlackClient):
+    """Gives every message its own timestamp and counts calls overlapping other calls on the same message."""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("unique_ts", True)
+        super().__init__(**kwargs)
+        self.overlaps = 0
+        self.active = set()
+
+    def api_call(self, method, **kwargs):
+        key = (kwargs.get("channel"), kwargs.get("ts"))
+        with self.lock:
+            if method != "chat.postMessage" and key in self.active:
+                self.overlaps += 1
+            self.active.add(key)
+        try:
+            # Give other threads the chance to overlap.
+            time.sleep(0.0005)
+            return super().api_call(method, **kwargs)
+        finally:
+            with self.lock:
+                self.active.discard(key)
+
+
+class FlakySlackClient(RecordingSlackClient):
+    """
+    Raises connection errors while offline and for the first `n_failures` calls, or answers all calls with `error`.
+    """
+
+    def __init__(self, n_failures=0, error=None, **kwargs):
+        kwargs.setdefault("unique_ts", True)
+        super().__init__(**kwargs)
+        self.n_failures = n_failures
+        self.error = error
+        self.online = threading.Event()
+        self.online.set()
+
+    def api_call(self, method, **kwargs):
+        with self.lock:
+            if not self.online.is_set():
+                raise ConnectionError("Slack is down")
+            if self.n_failures:
+                self.n_failures -= 1
+                raise ConnectionError("Connection reset")
+            if self.error is not None:
+                return {"ok": False, "error": self.error}
+        return super().api_call(method, **kwargs)
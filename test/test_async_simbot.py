@@ -0,0 +1,104 @@
+import unittest
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+from slack_simbot.async_simbot import AsyncSimBot
+from slack_simbot.event_loop import get_event_loop
+from slack_simbot.msg_handle import MsgHandle
+
+
+class FakeSlack:
+    """Minimal Slack Web API running on the event loop."""
+
+    def __init__(self, delay=0.1, n_ratelimited=0):
+        self.delay = delay
+        self.n_ratelimited = n_ratelimited
+        self.calls = []
+        self.peers = set()
+        self.runner = None
+        self.port = None
+
+    async def handle(self, request):
+        self.peers.add(request.transport.get_extra_info("peername"))
+        data = dict(await request.post())
+        if self.n_ratelimited:
+            self.n_ratelimited -= 1
+            return web.Response(status=429, headers={"Retry-After": "0.1"})
+        await asyncio.sleep(self.delay)
+        method = request.match_info["method"]
+        self.calls.append((method, data, request.headers.get("Authorization")))
+        if method == "users.list":
+            return web.json_response({"ok": True, "members": [
+                {"deleted": False, "profile": {"email": "a@b.c", "real_name": "A", "display_name": "a",
+                                               "image_192": "img"}},
+                {"deleted": True, "profile": {}},
+            ]})
+        return web.json_response({"ok": True, "ts": "1.0", "channel": data.get("channel")},
+                                 headers={"X-Test": "1"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/api/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class TestAsyncSimBot(unittest.TestCase):
+    def setUp(self):
+        self.loop = get_event_loop(debug_enabled=False)
+
+    def start_server(self, **kwargs):
+        server = FakeSlack(**kwargs)
+        asyncio.run_coroutine_threadsafe(server.start(), self.loop).result()
+        self.addCleanup(lambda: asyncio.run_coroutine_threadsafe(server.stop(), self.loop).result())
+        bot = AsyncSimBot(token="xoxb-test", debug=True, max_connections=8,
+                          base_url="http://127.0.0.1:{}/api/".format(server.port))
+        self.addCleanup(bot.close)
+        return server, bot
+
+    def test_concurrent_updates(self):
+        server, bot = self.start_server(delay=0.2)
+        handles = [MsgHandle(str(i), "C1") for i in range(16)]
+
+        async def update_all():
+            return await asyncio.gather(*(bot.update_msg(handle, "msg") for handle in handles))
+
+        t0 = time.perf_counter()
+        results = bot.submit(update_all()).result()
+        duration = time.perf_counter() - t0
+
+        self.assertTrue(all(r["ok"] for r in results))
+        self.assertEqual(results[0]["headers"]["X-Test"], "1")
+        # 16 calls of 0.2 s over 8 connections take two rounds, not 3.2 s.
+        self.assertLess(duration, 1.5)
+        self.assertLessEqual(len(server.peers), 8)
+        self.assertEqual(server.calls[0][2], "Bearer xoxb-test")
+
+    def test_sync_wrappers(self):
+        server, bot = self.start_server(delay=0., n_ratelimited=2)
+        handle = bot.send_msg_sync("Hello", channel="C2")
+        self.assertEqual((handle.ts, handle.channel), ("1.0", "C2"))
+        self.assertEqual(bot.n_ratelimited, 2)
+
+        bot.update_msg_sync(handle, "Hello again")
+        bot.delete_msg_sync(handle)
+        r = bot.api_call_sync("chat.postMessage", channel="C2", attachments=[{"text": "x"}])
+        self.assertTrue(r["ok"])
+        self.assertEqual(json.loads(server.calls[-1][1]["attachments"]), [{"text": "x"}])
+        self.assertEqual(bot.get_users_sync(), [("a@b.c", "A", "a", "img")])
+
+        # Connections are reused between calls.
+        self.assertEqual(len(server.peers), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
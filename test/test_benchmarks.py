@@ -0,0 +1,40 @@
+import unittest
+
+from benchmarks.__main__ import compare
+from benchmarks.fake_slack import FakeSlackServer, HttpSlackClient
+from benchmarks.scenarios import metric, update_overhead, render
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_fake_slack(self):
+        server = FakeSlackServer(ratelimit_every=2, retry_after=3)
+        try:
+            client = HttpSlackClient(server.url)
+            result = client.api_call("chat.postMessage", channel="C1", attachments=[{"text": "hi"}])
+            self.assertTrue(result["ok"])
+            self.assertEqual(result["channel"], "C1")
+            result = client.api_call("chat.update", channel="C1", ts=result["ts"])
+            self.assertEqual(result["error"], "ratelimited")
+            self.assertEqual(result["headers"]["Retry-After"], "3")
+            self.assertEqual(server.calls, {"chat.postMessage": 1})
+        finally:
+            server.close()
+
+    def test_update_overhead(self):
+        results = update_overhead(quick=True, latency=0.)
+        self.assertEqual(sorted(results), ["async_mean_us", "async_p99_us", "sync_mean_us", "sync_p99_us"])
+
+    def test_render(self):
+        results = render(quick=True)
+        # Every progress update changes the message, so none are skipped.
+        self.assertEqual(results["attachments_api_calls"]["value"], 2000)
+        self.assertEqual(results["blocks_api_calls"]["value"], 2000)
+
+    def test_compare(self):
+        baseline = {"results": {"s": {"t": metric(1., "s"), "rate": metric(100., "1/s", "higher")}}}
+        results = {"results": {"s": {"t": metric(1.1, "s"), "rate": metric(70., "1/s", "higher")}}}
+        self.assertEqual(compare(results, baseline, 0.2), ["s.rate"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import os
+import tempfile
+
+from slack_simbot import SimBot
+from slack_simbot.case_log import CaseLog
+
+
+class TestCaseLog(unittest.TestCase):
+    def test_counts_and_summary(self):
+        log = CaseLog()
+        self.assertIsNone(log.last)
+        self.assertEqual(log.summary(), "")
+
+        for i in range(5):
+            log.append("case_{}".format(i))
+        self.assertEqual(log.summary(), "case_0, case_1, case_2, case_3, case_4")
+
+        for i in range(5, 1000):
+            log.append("case_{}".format(i), status="failed" if i % 10 == 0 else "ok")
+        log.append("case_x", status="skipped")
+
+        self.assertEqual(len(log), 1001)
+        self.assertEqual(log.last, "case_x")
+        self.assertEqual((log.n_ok, log.n_failed, log.n_skipped), (901, 99, 1))
+        self.assertEqual(log.summary(), "case_0, case_1, case_2, ..., case_998, case_999, case_x")
+        self.assertEqual(len(log.head) + len(log.tail), 6)
+
+        with self.assertRaises(ValueError):
+            log.append("case_y", status="unknown")
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "cases.jsonl")
+            log = CaseLog(spill_path=path)
+            for i in range(100):
+                log.append("case_{}".format(i), start_time=i, end_time=i + 1)
+            entries = list(log.read())
+            log.close()
+
+            self.assertEqual(len(entries), 100)
+            self.assertEqual(entries[42], {"case": "case_42", "status": "ok", "start": 42, "end": 43})
+
+        with self.assertRaises(ValueError):
+            list(CaseLog().read())
+
+    def test_batch_spill(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "cases.jsonl")
+            batch = SimBot(active=False).get_user_("Spill", 3, "Case log", case_log_path=path)
+            for i in range(3):
+                batch.update("case_{}".format(i))
+            self.assertEqual([entry["case"] for entry in batch.cases.read()], ["case_0", "case_1", "case_2"])
+            batch.cases.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+import os
+import shutil
+import tempfile
+import zipfile
+
+from benchmarks.fake_sftp import FakeSFTPServer
+from slack_simbot import SimBot
+from slack_simbot.chunked_upload import ChunkedUploader
+from slack_simbot.metrics import Metrics
+from slack_simbot.ssh_pool import SSHPool
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt(*args):
+    raise Interrupted()
+
+
+class MismatchingUploader(ChunkedUploader):
+    def _remote_sha256(self, ssh_client, remote_file, path, offset, length):
+        return "0" * 64
+
+
+class TestChunkedUploader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeSFTPServer()
+        cls.pool = SSHPool("127.0.0.1", username="test", port=cls.server.port, password="x", max_size=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.server.close()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.local_path = os.path.join(self.temp_dir, "results.zip")
+        with open(self.local_path, "wb") as f:
+            f.write(os.urandom(5 * CHUNK_SIZE + 1000))
+        self.remote_dir = os.path.join(self.temp_dir, "remote")
+        os.mkdir(self.remote_dir)
+        self.remote_path = os.path.join(self.remote_dir, "results.zip")
+        self.state_path = ChunkedUploader.state_path(self.local_path)
+
+    def assertUploaded(self):
+        with open(self.local_path, "rb") as local_file, open(self.remote_path, "rb") as remote_file:
+            self.assertEqual(local_file.read(), remote_file.read())
+        self.assertFalse(os.path.exists(self.remote_path + ".part"))
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_upload(self):
+        report = ChunkedUploader(self.pool, chunk_size=CHUNK_SIZE, channels=2).upload(self.local_path,
+                                                                                      self.remote_path)
+        self.assertTrue(report.ok, report.errors)
+        self.assertEqual(report.n_chunks, 6)
+        self.assertEqual(report.bytes, os.path.getsize(self.local_path))
+        self.assertUploaded()
+
+    def test_interrupt_and_resume(self):
+        def progress(n_bytes, total, throughput):
+            if n_bytes >= 2 * CHUNK_SIZE:
+                raise Interrupted()
+
+        # The upload is interrupted once two chunks are confirmed.
+        report = ChunkedUploader(self.pool, chunk_size=CHUNK_SIZE, channels=1, max_retries=0,
+                                 progress=progress).upload(self.local_path, self.remote_path)
+        self.assertFalse(report.ok)
+        self.assertIn("Interrupted", report.errors[0][1])
+        self.assertEqual(ChunkedUploader.saved_state(self.local_path)["remote_path"], self.remote_path)
+        self.assertFalse(os.path.exists(self.remote_path))
+
+        report = ChunkedUploader(self.pool, chunk_size=CHUNK_SIZE, channels=2).upload(self.local_path,
+                                                                                      self.remote_path)
+        self.assertTrue(report.ok, report.errors)
+        self.assertEqual(report.n_resumed, 2)
+        self.assertEqual(report.bytes, os.path.getsize(self.local_path) - 2 * CHUNK_SIZE)
+        self.assertUploaded()
+
+    def test_changed_file_starts_over(self):
+        with open(self.state_path, "w") as f:
+            f.write('{"remote_path": "elsewhere", "size": 1, "mtime_ns": 1, "chunk_size": 1, "done": {"0": ""}}')
+        self.assertIsNone(ChunkedUploader.saved_state(self.local_path))
+        report = ChunkedUploader(self.pool, chunk_size=CHUNK_SIZE).upload(self.local_path, self.remote_path)
+        self.assertEqual(report.n_resumed, 0)
+        self.assertUploaded()
+
+    def test_checksum_mismatch(self):
+        report = MismatchingUploader(self.pool, chunk_size=CHUNK_SIZE, max_retries=0).upload(self.local_path,
+                                                                                            self.remote_path)
+        self.assertFalse(report.ok)
+        self.assertIn("Checksum mismatch", report.errors[0][1])
+        self.assertFalse(os.path.exists(self.remote_path))
+        # Resuming wouldn't help, so the next upload starts over.
+        self.assertFalse(os.path.exists(self.state_path))
+
+    def test_missing_remote_directory(self):
+        with self.assertRaises(FileNotFoundError):
+            ChunkedUploader(self.pool, chunk_size=CHUNK_SIZE).upload(self.local_path,
+                                                                     os.path.join(self.temp_dir, "missing", "a.zip"))
+        self.assertFalse(os.path.exists(self.state_path))
+
+
+class TestResumedArchiveUpload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeSFTPServer()
+        cls.pool = SSHPool("127.0.0.1", username="test", port=cls.server.port, password="x", max_size=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.server.close()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.dir_path = os.path.join(self.temp_dir, "results")
+        os.mkdir(self.dir_path)
+        for i in range(3):
+            with open(os.path.join(self.dir_path, "case_{}.csv".format(i)), "w") as f:
+                f.write("{}\n".format(i) * 1000)
+        self.remote_dir = os.path.join(self.temp_dir, "remote")
+        os.mkdir(self.remote_dir)
+        self.simbot = SimBot(token="xoxb-test", debug=True, metrics=Metrics())
+        self.simbot.ssh_pool = self.pool
+
+    def interrupted_upload(self):
+        # Leaves an archive behind as if an earlier chunked upload of it was interrupted.
+        remote_file_name = self.simbot.remote_file_name("monte_carlo", self.dir_path, self.remote_dir, "chunked")
+        remote_path = os.path.join(self.remote_dir, remote_file_name)
+        report = self.simbot.compress_directory(self.dir_path,
+                                                zip_path=self.simbot._archive_path(self.dir_path, remote_path))
+        ChunkedUploader(self.pool, chunk_size=1024, channels=1, max_retries=0,
+                        progress=interrupt).upload(report.path, remote_path)
+        return remote_path, report.path
+
+    def test_resume(self):
+        remote_path, zip_path = self.interrupted_upload()
+        self.assertTrue(os.path.exists(ChunkedUploader.state_path(zip_path)))
+
+        # The batch finishing again gets the same remote name, and the archive isn't compressed again.
+        self.assertEqual(self.simbot.interrupted_upload(self.dir_path, self.remote_dir), remote_path)
+        self.assertEqual(self.simbot.remote_file_name("monte_carlo", self.dir_path, self.remote_dir, "chunked"),
+                         os.path.basename(remote_path))
+        self.assertNotEqual(self.simbot.remote_file_name("other", self.dir_path, self.remote_dir, "chunked"),
+                            os.path.basename(remote_path))
+        self.simbot._compress_directory = lambda *args, **kwargs: self.fail("The archive was compressed again")
+        visited = []
+        report = self.simbot.upload_archive(self.dir_path, remote_path, mode="chunked",
+                                            visit=lambda path, arcname, st: visited.append(arcname))
+        self.assertEqual(report.path, zip_path)
+        self.assertTrue(report.upload.ok)
+        self.assertEqual(report.n_files, 3)
+        self.assertIn("results/case_0.csv", visited)
+
+        with zipfile.ZipFile(remote_path) as zf:
+            self.assertIsNone(zf.testzip())
+        self.assertEqual(os.stat(remote_path).st_size, report.bytes_out)
+        # The archive and the saved progress are removed once the upload succeeded.
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ["remote", "results"])
+        self.assertIsNone(self.simbot.interrupted_upload(self.dir_path, self.remote_dir))
+
+    def test_permanent_failure_removes_archive(self):
+        remote_path = os.path.join(self.temp_dir, "missing", "results.zip")
+        with self.assertRaises(FileNotFoundError):
+            self.simbot.upload_archive(self.dir_path, remote_path, mode="chunked")
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ["remote", "results"])
@@ -0,0 +1,123 @@
+import unittest
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from aiohttp import web
+
+from slack_simbot import SimBot
+from slack_simbot.cancel import BatchCancelled
+from slack_simbot.event_loop import get_event_loop
+
+from fakes import RecordingSlackClient
+
+
+class FakeSocketMode:
+    """apps.connections.open and a websocket sending one slash command, running on the event loop."""
+
+    def __init__(self, text):
+        self.text = text
+        self.acks = []
+        self.runner = None
+        self.url = None
+
+    async def open(self, request):
+        return web.json_response({"ok": True, "url": self.url + "/ws"})
+
+    async def ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({"type": "hello"}))
+        await ws.send_str(json.dumps({"envelope_id": "e1", "type": "slash_commands",
+                                      "payload": {"command": "/simbot", "text": self.text, "user_id": "U1"}}))
+        self.acks.append(json.loads((await ws.receive()).data))
+        await ws.close()
+        return ws
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/api/apps.connections.open", self.open)
+        app.router.add_get("/ws", self.ws)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = "http://127.0.0.1:{}".format(site._server.sockets[0].getsockname()[1])
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class TestCommands(unittest.TestCase):
+    def setUp(self):
+        self.simbot = SimBot(token="xoxb-test", debug=True)
+        self.simbot.slack_client = RecordingSlackClient()
+        self.batch = self.simbot.get_user_("Monte Carlo", 10, "commands")
+        self.other = self.simbot.get_user_("Monte Carlo 2", 10, "commands")
+        self.batch.update("case_0")
+
+    def test_status_and_cancel(self):
+        commands = self.simbot.commands(allowed_users=["U1"])
+        status = commands.handle("status")["text"]
+        self.assertIn("*Monte Carlo* 1/10", status)
+        self.assertIn("*Monte Carlo 2* 0/10", status)
+        self.assertIn("*last case* case_0", commands.handle("status monte carlo")["text"])
+        self.assertIn("matches 'Monte Carlo', 'Monte Carlo 2'", commands.handle("status monte")["text"])
+        self.assertIn("No running batch", commands.handle("status nothing")["text"])
+        self.assertIn("/simbot status", commands.handle("help")["text"])
+
+        self.assertIn("not allowed", commands.handle("cancel Monte Carlo", user_id="U2")["text"])
+        self.assertFalse(self.batch.cancelled)
+        response = commands.handle("cancel Monte Carlo", user_id="U1")
+        self.assertEqual(response["response_type"], "in_channel")
+        self.assertTrue(self.batch.cancelled)
+        self.assertFalse(self.other.cancelled)
+        with self.assertRaises(BatchCancelled):
+            self.batch.cancel_token.raise_if_cancelled()
+
+        self.batch.finish(status=self.batch.CANCELLED)
+        self.assertEqual(self.simbot.running_batches(), [self.other])
+
+    def test_http(self):
+        commands = self.simbot.commands(signing_secret="secret", http_address=("127.0.0.1", 0))
+        self.addCleanup(commands.close)
+        url = "http://127.0.0.1:{}/slack/commands".format(commands.port)
+        body = urlencode({"command": "/simbot", "text": "status Monte Carlo 2", "user_id": "U1"})
+        timestamp = str(int(time.time()))
+        signature = "v0=" + hmac.new(b"secret", "v0:{}:{}".format(timestamp, body).encode(),
+                                     hashlib.sha256).hexdigest()
+        headers = {"X-Slack-Request-Timestamp": timestamp, "X-Slack-Signature": signature,
+                   "Content-Type": "application/x-www-form-urlencoded"}
+
+        with urlopen(Request(url, data=body.encode(), headers=headers), timeout=5) as response:
+            self.assertIn("*progress* 0/10", json.load(response)["text"])
+        headers["X-Slack-Signature"] = "v0=forged"
+        with self.assertRaises(HTTPError) as cm:
+            urlopen(Request(url, data=body.encode(), headers=headers), timeout=5)
+        self.assertEqual(cm.exception.code, 401)
+
+    def test_socket_mode(self):
+        loop = get_event_loop(debug_enabled=False)
+        server = FakeSocketMode("cancel Monte Carlo 2")
+        asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+        self.addCleanup(lambda: asyncio.run_coroutine_threadsafe(server.stop(), loop).result())
+
+        commands = self.simbot.commands()
+        commands.connect_socket_mode("xapp-test", url=server.url + "/api/apps.connections.open",
+                                     reconnect_delay=60)
+        self.addCleanup(commands.close)
+        self.assertTrue(self.other.cancel_token.wait(timeout=5))
+        deadline = time.time() + 5
+        while not server.acks and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(server.acks[0]["envelope_id"], "e1")
+        self.assertIn("Asked batch 'Monte Carlo 2' to stop", server.acks[0]["payload"]["text"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import os
+import io
+import zlib
+import zipfile
+import tempfile
+
+from slack_simbot.compression import write_archive, crc32_combine
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir_path = os.path.join(self.tmp.name, "results")
+        os.makedirs(os.path.join(self.dir_path, "sub"))
+        self.files = {
+            "results/data.csv": "\n".join("{},{}".format(i, i * 0.5) for i in range(50000)).encode(),
+            "results/sub/random.bin": os.urandom(300000),
+            "results/sub/archive.gz": b"already compressed",
+            "results/empty.txt": b"",
+        }
+        for name, data in self.files.items():
+            with open(os.path.join(self.tmp.name, name), "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check_archive(self, buffer):
+        with zipfile.ZipFile(buffer) as zf:
+            self.assertIsNone(zf.testzip())
+            for name, data in self.files.items():
+                self.assertEqual(zf.read(name), data)
+            self.assertIn("results/sub/", zf.namelist())
+            self.assertEqual(zf.getinfo("results/sub/archive.gz").compress_type, zipfile.ZIP_STORED)
+
+    def test_crc32_combine(self):
+        a, b = os.urandom(1000), os.urandom(3000)
+        self.assertEqual(crc32_combine(zlib.crc32(a), zlib.crc32(b), len(b)), zlib.crc32(a + b))
+
+    def test_deflate(self):
+        for workers in [1, 2]:
+            buffer = io.BytesIO()
+            report = write_archive(self.dir_path, buffer, workers=workers, chunk_size=64 * 1024)
+            self.assertTrue(report.ok)
+            self.assertEqual(report.n_files, 4)
+            self.assertEqual(report.bytes_out, len(buffer.getvalue()))
+            self.check_archive(buffer)
+
+    def test_stored(self):
+        buffer = io.BytesIO()
+        report = write_archive(self.dir_path, buffer, codec="none")
+        self.assertTrue(report.ok)
+        self.check_archive(buffer)
+
+    def test_unreadable_file_is_reported(self):
+        path = os.path.join(self.dir_path, "sub", "missing.bin")
+        os.symlink(os.path.join(self.tmp.name, "does_not_exist"), path)
+
+        buffer = io.BytesIO()
+        report = write_archive(self.dir_path, buffer, workers=1)
+        self.assertEqual([p for p, _ in report.errors], [path])
+        self.check_archive(buffer)
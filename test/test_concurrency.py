@@ -0,0 +1,185 @@
+import unittest
+import gc
+import os
+import tempfile
+import threading
+import zipfile
+
+from benchmarks.fake_sftp import FakeSFTPServer
+from slack_simbot import SimBot
+from slack_simbot.metrics import Metrics
+from slack_simbot.rate_limit import TokenBucket
+from slack_simbot.ssh_pool import SSHPool
+
+from fakes import CheckingSlackClient
+
+
+N_THREADS = 64
+
+
+def run_threads(target, n=N_THREADS):
+    errors = []
+
+    def wrapper(i):
+        try:
+            target(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=wrapper, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class TestConcurrency(unittest.TestCase):
+    def setUp(self):
+        self.simbot = SimBot(token="xoxb-test", debug=True, update_interval=0., metrics=Metrics())
+        self.simbot.slack_client = self.client = CheckingSlackClient()
+
+    def test_one_batch_from_many_threads(self):
+        n_cases = 20
+        batch = self.simbot.get_user_("Shared", N_THREADS * n_cases, "stress")
+
+        def target(i):
+            for case in range(n_cases):
+                batch.update("case_{}_{}".format(i, case), status="failed" if case == 0 else "ok")
+
+        self.assertEqual(run_threads(target), [])
+        self.assertEqual(len(batch.cases), N_THREADS * n_cases)
+        self.assertEqual(batch.cases.n_failed, N_THREADS)
+        self.assertEqual(self.client.overlaps, 0)
+
+        # The last update sent has the final progress, older renders were dropped. It
+        # may be held back by the rate limit, flushing sends it right away.
+        batch.flush()
+        updates = [kwargs for method, kwargs in self.client.calls if method == "chat.update"]
+        self.assertIn("*progress* {0}/{0}".format(N_THREADS * n_cases), updates[-1]["attachments"][0]["text"])
+
+    def test_many_batches(self):
+        def target(i):
+            batch = self.simbot.get_user_("Batch {}".format(i), 10, "stress")
+            for case in range(10):
+                batch.update("case_{}".format(case))
+            # Finishing twice only sends one notification.
+            batch.finish()
+            batch.finish()
+
+        self.assertEqual(run_threads(target), [])
+        self.assertEqual(self.client.overlaps, 0)
+        methods = [method for method, _ in self.client.calls]
+        self.assertEqual(methods.count("chat.postMessage"), 2 * N_THREADS)
+        self.assertEqual(methods.count("chat.delete"), N_THREADS)
+        self.assertEqual(self.simbot.running_batches(), [])
+        self.assertEqual(len(self.simbot._message_locks), 0)
+
+    def test_update_after_finish(self):
+        batch = self.simbot.get_user_("Late", 100, "stress")
+        finished = threading.Event()
+
+        def target(i):
+            if i == 0:
+                batch.finish()
+                finished.set()
+                batch.update("late")
+            else:
+                for case in range(20):
+                    batch.update("case_{}_{}".format(i, case))
+
+        self.assertEqual(run_threads(target), [])
+        self.assertTrue(finished.is_set())
+        # Nothing touched the summary after it was posted.
+        summary = [i for i, (method, kwargs) in enumerate(self.client.calls)
+                   if method == "chat.postMessage" and kwargs.get("text") == "@channel"]
+        self.assertEqual(len(summary), 1)
+        summary_ts = "{}.0".format(sum(method == "chat.postMessage" for method, _ in self.client.calls))
+        self.assertEqual([kwargs for method, kwargs in self.client.calls[summary[0]:]
+                          if kwargs.get("ts") == summary_ts], [])
+        self.assertNotEqual(batch.cases.last, "late")
+        self.assertGreaterEqual(self.simbot.metrics.get("simbot_updates_after_finish_total"), 1)
+
+    def test_message_locks_are_dropped(self):
+        def target(i):
+            handle = self.simbot.send_msg("Message {}".format(i))
+            for j in range(5):
+                self.simbot.update_msg(handle, "Update {}".format(j))
+
+        # The messages are never deleted, their locks go with their handles.
+        self.assertEqual(run_threads(target), [])
+        self.assertEqual(self.client.overlaps, 0)
+        gc.collect()
+        self.assertEqual(len(self.simbot._message_locks), 0)
+
+    def test_same_title_finishing_together(self):
+        sftp_server = FakeSFTPServer()
+        self.addCleanup(sftp_server.close)
+        self.simbot.ssh_pool = SSHPool("127.0.0.1", username="test", port=sftp_server.port, password="x",
+                                       max_size=8)
+        self.addCleanup(self.simbot.ssh_pool.close)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            remote_dir = os.path.join(temp_dir, "remote")
+            os.mkdir(remote_dir)
+            batches = []
+            for i in range(8):
+                result_dir = os.path.join(temp_dir, "results_{}".format(i))
+                batch = self.simbot.get_user_("Same title", 1, "stress", result_dir=result_dir)
+                with open(os.path.join(result_dir, "case.csv"), "w") as f:
+                    f.write("{}\n".format(i) * 1000)
+                batch.update("case")
+                batches.append(batch)
+
+            errors = run_threads(lambda i: batches[i].finish(remote_path=remote_dir, url="http://localhost",
+                                                             upload_mode=("stream", "chunked")[i % 2]), n=8)
+            self.assertEqual(errors, [])
+            names = os.listdir(remote_dir)
+            self.assertEqual(len(names), 8)
+            for name in names:
+                self.assertTrue(name.startswith("same_title_"), name)
+                with zipfile.ZipFile(os.path.join(remote_dir, name)) as zf:
+                    self.assertIsNone(zf.testzip())
+            # No archives are left next to the results.
+            self.assertFalse([name for name in os.listdir(temp_dir) if name.endswith((".zip", ".json", ".tmp"))])
+
+    def test_async_updates(self):
+        self.simbot.async_updates = True
+        self.addCleanup(self.simbot.dispatcher.close)
+        self.simbot.dispatcher.rate_limit = TokenBucket(1e6, 1e6)
+        batches = [self.simbot.get_user_("Batch {}".format(i), 64, "stress") for i in range(8)]
+
+        def target(i):
+            # Eight threads per batch, eight cases each.
+            batch = batches[i % len(batches)]
+            for case in range(8):
+                batch.update("case_{}_{}".format(i, case))
+
+        self.assertEqual(run_threads(target), [])
+        for batch in batches:
+            batch.flush(timeout=10)
+            self.assertEqual(len(batch.cases), 64)
+        self.assertEqual(self.client.overlaps, 0)
+
+    def test_compress_same_directory(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dir_path = os.path.join(temp_dir, "results")
+            os.mkdir(dir_path)
+            for i in range(20):
+                with open(os.path.join(dir_path, "file_{}.csv".format(i)), "w") as f:
+                    f.write("{}\n".format(i) * 1000)
+
+            reports = [None] * 16
+            errors = run_threads(lambda i: reports.__setitem__(i, self.simbot.compress_directory(dir_path, workers=1)),
+                                 n=16)
+            self.assertEqual(errors, [])
+            self.assertEqual({report.path for report in reports}, {os.path.join(temp_dir, "results.zip")})
+            with zipfile.ZipFile(reports[0].path) as zf:
+                self.assertIsNone(zf.testzip())
+                self.assertEqual(len(zf.namelist()), 21)
+            # No temporary archives are left behind.
+            self.assertEqual(sorted(os.listdir(temp_dir)), ["results", "results.zip"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import asyncio
+import time
+import threading
+from multiprocessing import Pool
+from types import SimpleNamespace
+
+from slack_simbot import SimBot
+from slack_simbot.coordinator import BatchCoordinator
+from slack_simbot.metrics import Metrics
+
+from fakes import RecordingSlackClient
+
+
+class FakeBatch:
+    def __init__(self):
+        self.simbot = SimpleNamespace(active=False)
+        self.async_updates = False
+        self.cases = []
+        self.lock = threading.Lock()
+
+    def update(self, case_name, start_time=None, end_time=None, status="ok"):
+        with self.lock:
+            self.cases.append(case_name)
+
+
+def run_case(args):
+    reporter, case_name = args
+    reporter.report(case_name)
+
+
+class TestCoordinator(unittest.TestCase):
+    def wait_for(self, batch, n, timeout=5):
+        t0 = time.time()
+        while len(batch.cases) < n and time.time() - t0 < timeout:
+            time.sleep(0.01)
+
+    def test_reports_from_worker_processes(self):
+        batch = FakeBatch()
+        coordinator = BatchCoordinator(batch)
+        self.assertTrue(batch.async_updates)
+
+        reporter = coordinator.reporter()
+        cases = ["case_{}".format(i) for i in range(50)]
+        with Pool(4) as pool:
+            pool.map(run_case, [(reporter, case) for case in cases])
+
+        self.wait_for(batch, len(cases))
+        self.assertEqual(sorted(batch.cases), sorted(cases))
+        coordinator.close()
+
+    def test_tcp_with_secret(self):
+        batch = FakeBatch()
+        coordinator = BatchCoordinator(batch, address=("127.0.0.1", 0), secret="abc")
+
+        reporter = coordinator.reporter()
+        reporter.report("accepted")
+        reporter.secret = "wrong"
+        reporter.report("rejected")
+        reporter.close()
+
+        self.wait_for(batch, 2, timeout=0.5)
+        self.assertEqual(batch.cases, ["accepted"])
+        self.assertEqual(coordinator.n_rejected, 1)
+        coordinator.close()
+
+    def test_simbot_batch(self):
+        simbot = SimBot(token="xoxb-test", debug=True, update_interval=0., metrics=Metrics())
+        simbot.slack_client = client = RecordingSlackClient()
+        batch = simbot.get_user_("Coordinated", 5, "Reports from workers")
+        coordinator = batch.serve()
+        self.addCleanup(coordinator.close)
+        self.addCleanup(lambda: simbot.dispatcher.close())
+
+        reporter = coordinator.reporter()
+        for i in range(5):
+            reporter.report("case_{}".format(i))
+        reporter.close()
+        self.wait_for(batch, 5)
+        self.assertEqual(len(batch.cases), 5)
+
+        # The event loop is still responsive and the updates reach slack through the dispatcher.
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), coordinator.loop).result(timeout=1)
+        batch.flush(timeout=5)
+        updates = [kwargs for method, kwargs in client.calls if method == "chat.update"]
+        self.assertIn("*progress* 5/5", updates[-1]["attachments"][0]["text"])
@@ -0,0 +1,41 @@
+import unittest
+import time
+
+from slack_simbot import SimBot
+
+from fakes import RecordingSlackClient
+
+
+class TestDashboard(unittest.TestCase):
+    def test_many_batches_share_one_message(self):
+        simbot = SimBot(token="xoxb-test", debug=True, update_interval=0.)
+        simbot.slack_client = client = RecordingSlackClient()
+        dashboard = simbot.dashboard("Sweep", interval=0.2)
+        self.addCleanup(simbot.dispatcher.close)
+
+        batches = [simbot.get_user_("Batch {}".format(i), 50, "batch {}".format(i), dashboard=dashboard)
+                   for i in range(40)]
+        t0 = time.perf_counter()
+        for case in range(50):
+            for batch in batches:
+                batch.update("case_{}".format(case))
+        for batch in batches[:10]:
+            batch.finish()
+        dashboard.close(timeout=5)
+        duration = time.perf_counter() - t0
+
+        methods = [method for method, _ in client.calls]
+        self.assertEqual(methods.count("chat.postMessage"), 1)
+        self.assertNotIn("chat.delete", methods)
+        # One update per render instead of one per case.
+        self.assertLessEqual(methods.count("chat.update"), duration / 0.2 + 2)
+
+        _, last = client.calls[-1]
+        self.assertEqual(len(last["attachments"]), 40)
+        self.assertIn("30 running, 10 finished", last["text"])
+        self.assertEqual(last["attachments"][0]["title"], "Simulation batch completed")
+        self.assertIn("50/50", last["attachments"][-1]["text"])
+
+
+if __name__ == '__main__':
+    unittest.main()
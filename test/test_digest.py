@@ -0,0 +1,110 @@
+import unittest
+import io
+import os
+import tempfile
+from unittest import mock
+
+from benchmarks.fake_sftp import FakeSFTPServer
+from slack_simbot import SimBot
+from slack_simbot.compression import write_archive
+from slack_simbot.digest import Digest, ColumnStats
+from slack_simbot.metrics import Metrics
+from slack_simbot.ssh_pool import SSHPool
+
+from fakes import RecordingSlackClient
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class TestDigest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir_path = os.path.join(self.tmp.name, "results")
+        os.makedirs(os.path.join(self.dir_path, "case_1"))
+        os.makedirs(os.path.join(self.dir_path, "case_2"))
+        for case, offset in (("case_1", 0), ("case_2", 1000)):
+            with open(os.path.join(self.dir_path, case, "states.csv"), "w") as f:
+                f.write("time,x\n")
+                f.write("".join("{},{}\n".format(i + offset, "nan" if i == 5 else i * 0.5) for i in range(1000)))
+        with open(os.path.join(self.dir_path, "log.txt"), "w") as f:
+            f.write("done\n")
+        open(os.path.join(self.dir_path, "empty.txt"), "w").close()
+
+    def test_counts(self):
+        digest = Digest(workers=1).scan(self.dir_path).close()
+        self.assertEqual(digest.n_files, 4)
+        self.assertEqual(digest.n_empty, 1)
+        self.assertEqual(digest.extensions[".txt"], (2, 5))
+        self.assertEqual(digest.largest[0][1], "results/case_2/states.csv")
+        self.assertIn("4 files", digest.fields()[0]["value"])
+
+    def test_merge(self):
+        stats = ColumnStats(2, 0, 1., 3., 4.)
+        stats.merge(ColumnStats(1, 1, -1., 0., -1.))
+        stats.merge(ColumnStats(0, 2))
+        self.assertEqual((stats.count, stats.nan, stats.min, stats.max, stats.mean), (3, 3, -1., 3., 1.))
+
+    @unittest.skipIf(np is None, "needs numpy")
+    def test_columns_during_compression(self):
+        np.save(os.path.join(self.dir_path, "case_1", "u.npy"), np.arange(30000, dtype=float).reshape(-1, 3))
+        digest = Digest(workers=2, block_rows=128)
+        write_archive(self.dir_path, io.BytesIO(), workers=1, visit=digest.add)
+        digest.close()
+
+        self.assertEqual(digest.n_files, 5)
+        time = digest.columns["time"]
+        self.assertEqual((time.count, time.nan, time.min, time.max), (2000, 0, 0., 1999.))
+        x = digest.columns["x"]
+        self.assertEqual((x.count, x.nan, x.max), (1998, 2, 499.5))
+        self.assertEqual(digest.columns["u[2]"].max, 29999.)
+        self.assertAlmostEqual(digest.columns["u[0]"].mean, 14998.5)
+        # The column with NaNs is shown first.
+        columns = digest.fields()[2]["value"].split("\n")
+        self.assertTrue(columns[1].startswith("x "))
+
+    @unittest.skipIf(np is None or h5py is None, "needs numpy and h5py")
+    def test_hdf5(self):
+        with h5py.File(os.path.join(self.dir_path, "out.h5"), "w") as f:
+            f.create_dataset("group/y", data=np.linspace(0, 1, 1001))
+            f.create_dataset("labels", data=np.array([b"a", b"b"]))
+        digest = Digest(workers=1, block_rows=100).scan(self.dir_path).close()
+        y = digest.columns["group/y"]
+        self.assertEqual((y.count, y.min, y.max), (1001, 0., 1.))
+        self.assertAlmostEqual(y.mean, 0.5)
+        self.assertNotIn("labels", digest.columns)
+        self.assertEqual(digest.errors, [])
+
+
+    def test_default_workers(self):
+        # The digest runs next to the compression, so it only takes a small pool by default.
+        self.assertEqual(Digest().workers, max(1, (os.cpu_count() or 1) // 4))
+
+    def test_batch_shares_cores(self):
+        sftp_server = FakeSFTPServer()
+        self.addCleanup(sftp_server.close)
+        simbot = SimBot(token="xoxb-test", debug=True, metrics=Metrics())
+        simbot.slack_client = RecordingSlackClient()
+        simbot.ssh_pool = SSHPool("127.0.0.1", username="test", port=sftp_server.port, password="x")
+        self.addCleanup(simbot.ssh_pool.close)
+        remote_dir = os.path.join(self.tmp.name, "remote")
+        os.mkdir(remote_dir)
+
+        batch = simbot.get_user_("Batch", 1, "digest", result_dir=self.dir_path, clear_result_dir=False)
+        batch.update("case_1")
+        with mock.patch.object(simbot, "_upload_archive", wraps=simbot._upload_archive) as upload_archive:
+            batch.finish(remote_path=remote_dir, url="http://localhost", digest=Digest(workers=2))
+        self.assertEqual(upload_archive.call_args.kwargs["workers"], max(1, (os.cpu_count() or 1) - 2))
+        self.assertEqual(len(os.listdir(remote_dir)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import os
+import tempfile
+import threading
+import time
+
+from slack_simbot.directory import Directory
+
+
+class PagedSlackClient:
+    def __init__(self, n_users=450, n_channels=250, delay=0.05, n_ratelimited=0, channel_error=None):
+        self.users = [{"id": "U{}".format(i), "name": "user{}".format(i), "deleted": i == 3,
+                       "profile": {"email": "User{}@example.com".format(i), "real_name": "User {}".format(i),
+                                   "display_name": "u{}".format(i), "image_192": "img", "phone": "1"}}
+                      for i in range(n_users)]
+        self.channels = [{"id": "C{}".format(i), "name": "channel{}".format(i), "members": ["U1"]}
+                         for i in range(n_channels)]
+        self.delay = delay
+        self.n_ratelimited = n_ratelimited
+        self.channel_error = channel_error
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def api_call(self, method, limit=100, cursor=None, **kwargs):
+        with self.lock:
+            self.calls.append(method)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            ratelimited = self.n_ratelimited > 0
+            self.n_ratelimited -= ratelimited
+        try:
+            time.sleep(self.delay)
+            if ratelimited:
+                return {"ok": False, "error": "ratelimited", "headers": {"Retry-After": "0.01"}}
+            if method == "users.info":
+                return {"ok": True, "user": dict(self.users[int(kwargs["user"][1:])], name="renamed")}
+            if method == "users.lookupByEmail":
+                return {"ok": True, "user": {"id": "UNEW", "profile": {"email": kwargs["email"]}}}
+            if method != "users.list" and self.channel_error:
+                return {"ok": False, "error": self.channel_error}
+
+            entries, key = (self.users, "members") if method == "users.list" else (self.channels, "channels")
+            offset = int(cursor or 0)
+            page = entries[offset:offset + limit]
+            next_cursor = str(offset + limit) if offset + limit < len(entries) else ""
+            return {"ok": True, key: page, "response_metadata": {"next_cursor": next_cursor}}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class TestDirectory(unittest.TestCase):
+    def test_pagination_and_lookups(self):
+        client = PagedSlackClient()
+        directory = Directory(client.api_call, page_size=100).refresh()
+        self.assertEqual(len(directory.users), 450)
+        self.assertEqual(len(directory.channels), 250)
+        self.assertEqual(client.calls.count("users.list"), 5)
+        # The users and channels are downloaded at the same time.
+        self.assertGreaterEqual(client.max_active, 2)
+
+        n_calls = len(client.calls)
+        self.assertEqual(directory.user("U7")["name"], "user7")
+        self.assertEqual(directory.user_by_email("user7@EXAMPLE.com")["id"], "U7")
+        self.assertEqual(directory.user_by_name("@U7")["id"], "U7")
+        self.assertEqual(directory.channel_by_name("#channel12")["id"], "C12")
+        self.assertNotIn("phone", directory.user("U7")["profile"])
+        self.assertNotIn("members", directory.channel("C12"))
+        self.assertEqual(len(client.calls), n_calls)
+
+        # Incremental updates of single users.
+        self.assertEqual(directory.refresh_user("U7")["name"], "renamed")
+        self.assertEqual(directory.user_by_name("renamed")["id"], "U7")
+        self.assertEqual(directory.user_by_email("new@example.com")["id"], "UNEW")
+        self.assertEqual(directory.user_by_email("new@example.com")["id"], "UNEW")
+        self.assertEqual(client.calls.count("users.lookupByEmail"), 1)
+
+    def test_ratelimited_pages_are_retried(self):
+        client = PagedSlackClient(n_users=10, n_channels=10, delay=0., n_ratelimited=2)
+        directory = Directory(client.api_call)
+        self.assertEqual(len(directory.users), 10)
+
+    def test_snapshot_and_ttl(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "cache", "directory.json")
+            client = PagedSlackClient(delay=0.)
+            Directory(client.api_call, snapshot_path=path).refresh()
+
+            # A new directory starts from the snapshot without calling the api.
+            client = PagedSlackClient(delay=0.)
+            directory = Directory(client.api_call, snapshot_path=path)
+            self.assertEqual(directory.user_by_email("user1@example.com")["id"], "U1")
+            self.assertEqual(client.calls, [])
+
+            # Once stale the cached entries are returned while refreshing in the background.
+            directory.ttl = 0
+            directory.users_updated -= 1
+            updated = directory.users_updated
+            self.assertEqual(directory.user("U1")["id"], "U1")
+            directory._refresh_thread.join(5)
+            self.assertIn("users.list", client.calls)
+            self.assertGreater(directory.users_updated, updated)
+
+    def test_channels_without_scope(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "directory.json")
+            client = PagedSlackClient(delay=0., channel_error="missing_scope")
+            directory = Directory(client.api_call, snapshot_path=path)
+            with self.assertRaises(IOError):
+                directory.refresh()
+
+            # The users are cached and saved although the channels can't be listed.
+            self.assertEqual(len(directory.users), 450)
+            self.assertEqual(directory.user_by_email("user7@example.com")["id"], "U7")
+            self.assertEqual(directory.user_by_name("u7")["id"], "U7")
+            self.assertEqual(Directory(client.api_call, snapshot_path=path).user("U7")["name"], "user7")
+            with self.assertRaises(IOError):
+                directory.channel_by_name("channel1")
+
+            # User lookups don't list the channels again.
+            n_calls = client.calls.count("channels.list")
+            directory.user("U7")
+            self.assertEqual(client.calls.count("channels.list"), n_calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import unittest
+import time
+
+from slack_simbot import SimBot
+from slack_simbot.dispatcher import Dispatcher
+from slack_simbot.metrics import Metrics
+from slack_simbot.rate_limit import TokenBucket
+
+from fakes import RecordingSlackClient, SlowSlackClient
+
+
+class TestDispatcher(unittest.TestCase):
+    def test_submit_does_not_block(self):
+        client = SlowSlackClient()
+        dispatcher = Dispatcher(client)
+
+        t0 = time.perf_counter()
+        for i in range(10):
+            dispatcher.submit("chat.postMessage", channel="C1", text=str(i))
+        self.assertLess(time.perf_counter() - t0, client.delay)
+
+        dispatcher.flush(timeout=5)
+        self.assertEqual([kwargs['text'] for _, kwargs in client.calls], [str(i) for i in range(10)])
+        dispatcher.close()
+
+    def test_updates_are_coalesced(self):
+        client = SlowSlackClient(delay=0.01)
+        dispatcher = Dispatcher(client, min_interval=0.2)
+
+        for i in range(100):
+            dispatcher.submit("chat.update", ts="1", channel="C1", text=str(i))
+            dispatcher.submit("chat.update", ts="2", channel="C1", text=str(i))
+            time.sleep(0.002)
+        dispatcher.flush(timeout=5)
+
+        texts = {}
+        for _, kwargs in client.calls:
+            texts.setdefault(kwargs['ts'], []).append(kwargs['text'])
+        self.assertEqual(texts["1"][-1], "99")
+        self.assertEqual(texts["2"][-1], "99")
+        self.assertLess(len(client.calls), 20)
+        dispatcher.close()
+
+    def test_ratelimited_calls_are_retried(self):
+        client = SlowSlackClient(delay=0, n_ratelimited=2)
+        dispatcher = Dispatcher(client)
+
+        dispatcher.submit("chat.update", ts="1", channel="C1", text="a")
+        dispatcher.flush(timeout=5)
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual(dispatcher.n_ratelimited, 2)
+        self.assertEqual(len(dispatcher.errors), 0)
+        dispatcher.close()
+
+    def test_errors_are_collected(self):
+        class FailingSlackClient:
+            def api_call(self, method, **kwargs):
+                return {"ok": False, "error": "channel_not_found"}
+
+        dispatcher = Dispatcher(FailingSlackClient())
+        dispatcher.submit("chat.update", ts="1", channel="C1")
+        dispatcher.flush(timeout=5)
+        self.assertEqual(len(dispatcher.errors), 1)
+
+        dispatcher.debug = True
+        dispatcher.submit("chat.update", ts="1", channel="C1")
+        with self.assertRaises(Exception):
+            dispatcher.flush(timeout=5)
+        dispatcher.close()
+
+
+class TestSyncUpdates(unittest.TestCase):
+    def setUp(self):
+        self.client = RecordingSlackClient()
+        self.simbot = SimBot(token="xoxb-test", slack_client=self.client, metrics=Metrics(), update_interval=60)
+
+    def updates(self):
+        return [kwargs for method, kwargs in self.client.calls if method == "chat.update"]
+
+    def test_updates_are_coalesced(self):
+        batch = self.simbot.get_user_("Batch", 1000, "Coalesced")
+        for i in range(999):
+            batch.update("case_{}".format(i))
+        # Only the first update was sent, the others came within the update interval.
+        self.assertEqual(len(self.updates()), 1)
+        self.assertEqual(self.simbot.metrics.get("simbot_updates_coalesced_total"), 998)
+
+        # Flushing sends the latest progress.
+        batch.flush()
+        self.assertEqual(len(self.updates()), 2)
+        self.assertIn("999", self.updates()[-1]["attachments"][0]["text"])
+        batch.flush()
+        self.assertEqual(len(self.updates()), 2)
+
+        # The last case is sent right away.
+        batch.update("case_999")
+        self.assertEqual(len(self.updates()), 3)
+
+    def test_held_back_update_is_sent_later(self):
+        # A burst of fast cases followed by a long one.
+        self.simbot.update_interval = 0.1
+        batch = self.simbot.get_user_("Batch", 10, "Burst")
+        for i in range(3):
+            batch.update("case_{}".format(i))
+        self.assertEqual(len(self.updates()), 1)
+
+        deadline = time.monotonic() + 5
+        while len(self.updates()) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.updates()), 2)
+        self.assertIn("3/10", self.updates()[-1]["attachments"][0]["text"])
+
+    def test_updates_are_rate_limited(self):
+        now = [0.]
+        self.simbot.rate_limit = TokenBucket(rate=1, capacity=2, clock=lambda: now[0])
+        self.simbot.update_interval = 0
+        batch = self.simbot.get_user_("Batch", 100, "Rate limited")
+        for i in range(10):
+            batch.update("case_{}".format(i))
+        self.assertEqual(len(self.updates()), 2)
+        now[0] = 1.
+        batch.update("case_10")
+        self.assertEqual(len(self.updates()), 3)
+        self.assertIn("11", self.updates()[-1]["attachments"][0]["text"])
+
+    def test_ratelimited_update_is_sent_again(self):
+        self.simbot.slack_client = self.client = SlowSlackClient(delay=0)
+        self.simbot.update_interval = 0
+        batch = self.simbot.get_user_("Batch", 100, "Rate limited")
+        self.client.n_ratelimited = 1
+        batch.update("case_0")
+        self.assertEqual(self.updates(), [])
+        t0 = time.monotonic()
+        batch.flush()
+        # The Retry-After of the rate limited call was honoured.
+        self.assertGreaterEqual(time.monotonic() - t0, 0.09)
+        self.assertEqual(len(self.updates()), 1)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate(self):
+        now = [0.]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+        self.assertTrue(bucket.take())
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+        self.assertAlmostEqual(bucket.delay(), 0.5)
+        now[0] = 0.5
+        self.assertTrue(bucket.take())
+
+    def test_block(self):
+        now = [0.]
+        bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+        bucket.block(3)
+        self.assertAlmostEqual(bucket.delay(), 3)
+        now[0] = 3
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
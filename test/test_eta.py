@@ -0,0 +1,97 @@
+import unittest
+import datetime
+import random
+
+from slack_simbot import SimBot
+from slack_simbot.eta import ThroughputEstimator, EwmaEstimator, quantile
+
+
+def simulate(n_cases, workers, duration, origin=1000., jitter=0., pause=None, seed=0):
+    """Returns the (start, end) times of cases run by a pool of workers."""
+    rng = random.Random(seed)
+    free_at = [origin] * workers
+    cases = []
+    for i in range(n_cases):
+        worker = min(range(workers), key=lambda w: free_at[w])
+        start = free_at[worker]
+        if pause is not None and i == pause[0]:
+            start += pause[1]
+        end = start + duration * (1 + rng.uniform(-jitter, jitter))
+        free_at[worker] = end
+        cases.append((start, end))
+    return sorted(cases, key=lambda case: case[1])
+
+
+class TestEta(unittest.TestCase):
+    def test_quantile(self):
+        self.assertEqual(quantile([3, 1, 2], 0.5), 2)
+        self.assertAlmostEqual(quantile([0, 10], 0.25), 2.5)
+        self.assertEqual(quantile([5], 0.9), 5)
+
+    def test_parallel_throughput(self):
+        # 8 workers, 10 s per case gives 0.8 cases per second.
+        estimator = ThroughputEstimator()
+        estimator.begin(1000.)
+        for start, end in simulate(200, 8, 10., jitter=0.3):
+            estimator.record(end, start)
+        expected, low, high = estimator.rates()
+        self.assertAlmostEqual(expected, 0.8, delta=0.08)
+        self.assertLessEqual(low, expected)
+        self.assertGreaterEqual(high, expected)
+
+        # The sequential estimator only sees the time between completions, which is very noisy.
+        estimator = ThroughputEstimator()
+        estimator.begin(1000.)
+        for start, end in simulate(200, 8, 10., jitter=0.3):
+            estimator.record(end)
+        self.assertAlmostEqual(estimator.rate(), 0.8, delta=0.08)
+
+    def test_pause_is_skipped(self):
+        estimator = ThroughputEstimator(window=50)
+        estimator.begin(1000.)
+        for start, end in simulate(60, 1, 1., pause=(30, 3600.)):
+            estimator.record(end, start)
+        self.assertAlmostEqual(estimator.rate(), 1., places=6)
+
+    def test_fallbacks(self):
+        estimator = ThroughputEstimator()
+        self.assertIsNone(estimator.estimate(10))
+
+        # Only the batch start and a single end time.
+        estimator.begin(1000.)
+        estimator.record(1010.)
+        self.assertAlmostEqual(estimator.rate(), 0.1)
+
+        # Durations and the number of workers.
+        estimator = ThroughputEstimator(workers=4)
+        estimator.record(1010., 1000.)
+        self.assertAlmostEqual(estimator.rate(), 0.4)
+
+    def test_estimate(self):
+        estimator = ThroughputEstimator()
+        estimator.begin(1000.)
+        for start, end in simulate(100, 4, 4., jitter=0.5):
+            estimator.record(end, start)
+        now = 1100.
+        eta = estimator.estimate(100, now=now)
+        self.assertLessEqual(eta.low, eta.expected)
+        self.assertLessEqual(eta.expected, eta.high)
+        self.assertAlmostEqual((eta.expected - datetime.datetime.fromtimestamp(now)).total_seconds(), 100, delta=15)
+
+    def test_ewma(self):
+        estimator = EwmaEstimator()
+        self.assertIsNone(estimator.estimate(5))
+        for end in (10., 12., 14.):
+            estimator.record(end)
+        self.assertAlmostEqual(estimator.rate(), 0.5)
+        eta = estimator.estimate(4, now=20.)
+        self.assertEqual(eta.expected, datetime.datetime.fromtimestamp(28.))
+
+    def test_batch_estimator(self):
+        estimator = EwmaEstimator()
+        batch = SimBot(active=False).get_user_("Eta", 10, "Estimator", eta_estimator=estimator)
+        self.assertIs(batch.eta_estimator, estimator)
+
+
+if __name__ == '__main__':
+    unittest.main()
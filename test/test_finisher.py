@@ -0,0 +1,119 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fake_sftp import FakeSFTPServer
+from slack_simbot import SimBot
+from slack_simbot.finisher import Finisher
+
+from fakes import SlowSlackClient
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Finishes a batch detached and exits without waiting for it.
+EXIT_SCRIPT = """
+import json, sys
+sys.path.insert(0, "test")
+from fakes import SlowSlackClient
+from slack_simbot import SimBot
+from slack_simbot.digest import Digest
+from slack_simbot.ssh_pool import SSHPool
+
+class LoggingSlackClient(SlowSlackClient):
+    def api_call(self, method, **kwargs):
+        r = super().api_call(method, **kwargs)
+        with open(sys.argv[1], "a") as f:
+            f.write(json.dumps([method, kwargs]) + "\\n")
+        return r
+
+simbot = SimBot(token="xoxb-test", debug=True, slack_client=LoggingSlackClient(delay=0.05))
+simbot.ssh_pool = SSHPool("127.0.0.1", username="test", port=int(sys.argv[2]), password="x")
+batch = simbot.get_user_("Exit", 1, "detached", result_dir=sys.argv[3], clear_result_dir=False)
+batch.update("case_0")
+batch.finish(remote_path=sys.argv[4], url="http://localhost", detach=True, digest=Digest(workers=2))
+"""
+
+
+class TestFinisher(unittest.TestCase):
+    def test_detached_finish(self):
+        simbot = SimBot(token="xoxb-test", debug=True)
+        simbot.slack_client = client = SlowSlackClient(
+            delay=0.1, slow=lambda method, kwargs: method == "chat.postMessage" and kwargs.get("text") == "@channel")
+        batches = [simbot.get_user_("Batch {}".format(i), 2, "detached") for i in range(4)]
+        for batch in batches:
+            batch.update("case_0")
+            batch.update("case_1")
+
+        t0 = time.perf_counter()
+        futures = [batch.finish(detach=True) for batch in batches]
+        self.assertLess(time.perf_counter() - t0, 0.1)
+        self.assertTrue(simbot.wait_all(timeout=10))
+        for future in futures:
+            self.assertIsNone(future.result())
+
+        summaries = [kwargs for method, kwargs in client.calls
+                     if method == "chat.postMessage" and kwargs["text"] == "@channel"]
+        self.assertEqual(len(summaries), 4)
+        stages = [kwargs["attachments"][0]["text"] for method, kwargs in client.calls if method == "chat.update"]
+        self.assertTrue(any("Sending notification" in text for text in stages))
+
+    @unittest.skipIf(np is None, "needs numpy")
+    def test_finish_at_exit(self):
+        sftp_server = FakeSFTPServer()
+        self.addCleanup(sftp_server.close)
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        log_path = os.path.join(temp_dir.name, "calls.jsonl")
+        result_dir = os.path.join(temp_dir.name, "results")
+        remote_dir = os.path.join(temp_dir.name, "remote")
+        os.mkdir(result_dir)
+        os.mkdir(remote_dir)
+        for i in range(4):
+            with open(os.path.join(result_dir, "case_{}.csv".format(i)), "w") as f:
+                f.write("x\n" + "".join("{}\n".format(j) for j in range(1000)))
+
+        subprocess.run([sys.executable, "-c", EXIT_SCRIPT, log_path, str(sftp_server.port), result_dir, remote_dir],
+                       capture_output=True, text=True, check=True, timeout=60,
+                       cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        # The summary was posted with the digest, after the archive was uploaded.
+        with open(log_path) as f:
+            calls = [json.loads(line) for line in f]
+        summaries = [kwargs for method, kwargs in calls if method == "chat.postMessage" and kwargs["text"] == "@channel"]
+        self.assertEqual(len(summaries), 1)
+        attachment = summaries[0]["attachments"][0]
+        self.assertEqual(attachment["title"], "Simulation batch completed")
+        self.assertIn("Columns", [field.get("title") for field in attachment["fields"]])
+        self.assertEqual(len(os.listdir(remote_dir)), 1)
+
+    def test_bounded_concurrency(self):
+        finisher = Finisher(max_workers=2)
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def work():
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+        for _ in range(6):
+            finisher.submit(work)
+        self.assertTrue(finisher.wait_all(timeout=5))
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(finisher.n_pending, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
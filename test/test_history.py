@@ -0,0 +1,89 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import time
+
+from slack_simbot import SimBot
+from slack_simbot.history import RunHistory
+
+from fakes import RecordingSlackClient
+
+
+class TestRunHistory(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "history.sqlite")
+
+    def test_record_and_query(self):
+        history = RunHistory(self.path, batch_size=3)
+        self.addCleanup(history.close)
+        for i, rate in enumerate([1., 2., 4.]):
+            run = history.begin("Batch", 5, started=1000. * i)
+            for case in range(5):
+                history.add_case(run, "Batch", "case_{}".format(case), "ok", 1000. * i + case, 1000. * i + 2 * case)
+            history.finish(run, 5, 0, 0, throughput=rate, artifact_bytes=100 * i, finished=1000. * i + 10)
+        history.begin("Batch", 5)
+
+        self.assertEqual([run.throughput for run in history.runs("Batch")], [4., 2., 1.])
+        self.assertEqual(history.baseline("Batch"), 2.)
+        self.assertEqual(history.seed("Batch"), (2., 1.2, 3.6))
+        self.assertIsNone(history.seed("Other"))
+        self.assertEqual(history.trend("Batch", "artifact_bytes"), [(10., 0), (1010., 100), (2010., 200)])
+        with self.assertRaises(ValueError):
+            history.trend("Batch", "title; DROP TABLE runs")
+
+        stats = history.case_stats("Batch")
+        self.assertEqual(stats[0], ("case_4", 3, 4., 4.))
+        self.assertEqual(len(stats), 5)
+
+    def test_failed_finish_rolls_back(self):
+        history = RunHistory(self.path)
+        self.addCleanup(history.close)
+        run = history.begin("Batch", 2)
+        history.add_case(run, "Batch", "case_0", "ok", 0., 1.)
+        history.add_case(run, "Batch", "case_1", "ok", 1., 2.)
+        with self.assertRaises(sqlite3.Error):
+            history.finish(run, 2, 0, 0, throughput=object())
+        self.assertFalse(history._db.in_transaction)
+        self.assertEqual(history.runs("Batch"), [])
+
+        # The buffered cases are written once, by the next finish.
+        history.finish(run, 2, 0, 0)
+        self.assertEqual([stats.n_runs for stats in history.case_stats("Batch")], [1, 1])
+
+    def test_batch_history(self):
+        history = RunHistory(self.path)
+        self.addCleanup(history.close)
+        simbot = SimBot(token="xoxb-test", debug=True)
+        simbot.slack_client = RecordingSlackClient()
+        batch = simbot.get_user_("Batch", 1, "own history", history=history)
+        batch.update("case_0")
+        batch.finish()
+        self.assertEqual([run.n_ok for run in history.runs("Batch")], [1])
+
+    def test_seeds_eta(self):
+        simbot = SimBot(token="xoxb-test", debug=True, history_path=self.path)
+        simbot.slack_client = RecordingSlackClient()
+        self.addCleanup(simbot.history.close)
+
+        t0 = time.time()
+        batch = simbot.get_user_("Batch", 20, "first run")
+        self.assertIsNone(batch.eta_band)
+        for i in range(20):
+            batch.update("case_{}".format(i), start_time=t0 + i, end_time=t0 + i + 1)
+        batch.finish()
+        run, = simbot.history.runs("Batch")
+        self.assertEqual((run.n_ok, run.status), (20, "completed"))
+        self.assertGreater(run.throughput, 0)
+
+        batch = simbot.get_user_("Batch", 20, "second run")
+        batch.update("case_0")
+        # The eta is known from the first case on.
+        self.assertIsNotNone(batch.eta_band)
+        self.assertAlmostEqual(batch.eta_estimator.rate(), run.throughput)
+
+
+if __name__ == '__main__':
+    unittest.main()
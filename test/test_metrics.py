@@ -0,0 +1,130 @@
+import unittest
+import json
+import os
+import tempfile
+import time
+
+from slack_simbot.metrics import Metrics, Histogram
+from slack_simbot.exception_guard import guard
+from slack_simbot import SimBot
+
+from fakes import SlowSlackClient
+
+
+class Guarded:
+    def __init__(self, metrics, debug=False):
+        self.metrics = metrics
+        self.debug = debug
+
+    @guard
+    def outer(self):
+        time.sleep(0.01)
+        return self.inner()
+
+    @guard
+    def inner(self):
+        time.sleep(0.01)
+        return "done"
+
+    @guard
+    def fail(self):
+        raise KeyError("x")
+
+
+class FakeSlackClient:
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def api_call(self, method, **kwargs):
+        return self.responses.pop(0)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram(buckets=(1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual((histogram.count, histogram.sum, histogram.min, histogram.max), (5, 16.5, 0.5, 10))
+        self.assertAlmostEqual(histogram.quantile(0.5), 1.75)
+
+    def test_export(self):
+        metrics = Metrics()
+        hooked = []
+        metrics.add_hook(lambda *args: hooked.append(args))
+        metrics.add_hook(lambda *args: 1 / 0)
+        metrics.inc("slack_api_calls_total", method="chat.update")
+        metrics.inc("slack_api_calls_total", 2, method="chat.update")
+        metrics.observe("slack_api_seconds", 0.2, method='say "hi"')
+
+        text = metrics.prometheus()
+        self.assertIn("# TYPE slack_api_calls_total counter", text)
+        self.assertIn('slack_api_calls_total{method="chat.update"} 3', text)
+        self.assertIn('slack_api_seconds_bucket{method="say \\"hi\\"",le="0.25"} 1', text)
+        self.assertIn('slack_api_seconds_bucket{method="say \\"hi\\"",le="+Inf"} 1', text)
+        self.assertIn('slack_api_seconds_count{method="say \\"hi\\""} 1', text)
+        self.assertEqual(hooked[0], ("counter", "slack_api_calls_total", 1, {"method": "chat.update"}))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            metrics.write_json(os.path.join(temp_dir, "metrics.json"))
+            metrics.write_prometheus(os.path.join(temp_dir, "simbot.prom"))
+            with open(os.path.join(temp_dir, "metrics.json")) as f:
+                data = json.load(f)
+            self.assertEqual(sorted(os.listdir(temp_dir)), ["metrics.json", "simbot.prom"])
+        self.assertEqual(data["counters"][0]["value"], 3)
+        self.assertEqual(data["histograms"][0]["count"], 1)
+
+    def test_guard(self):
+        metrics = Metrics()
+        guarded = Guarded(metrics)
+        self.assertEqual(guarded.outer(), "done")
+        self.assertEqual(guarded.outer.__name__, "outer")
+        self.assertEqual(metrics.get("simbot_call_seconds", op="inner").count, 1)
+        # The nested call is not counted twice.
+        self.assertAlmostEqual(metrics.blocking_seconds, metrics.get("simbot_call_seconds", op="outer").sum)
+
+        self.assertIs(guarded.fail()[0], KeyError)
+        self.assertEqual(metrics.get("simbot_errors_total", op="fail", type="KeyError"), 1)
+
+    def test_api_calls(self):
+        metrics = Metrics()
+        simbot = SimBot(token="xoxb-test", metrics=metrics)
+        simbot.slack_client = FakeSlackClient([
+            {"ok": True, "ts": "1.0", "channel": "C1"},
+            {"ok": False, "error": "ratelimited"},
+            {"ok": False, "error": "channel_not_found"},
+        ])
+        handle = simbot.send_msg("Hello")
+        simbot.update_msg(handle, "Hello again")
+        simbot.delete_msg(handle)
+
+        self.assertEqual(metrics.total("slack_api_calls_total"), 3)
+        self.assertEqual(metrics.get("slack_api_ratelimited_total", method="chat.update"), 1)
+        self.assertEqual(metrics.get("slack_api_errors_total", method="chat.delete", error="channel_not_found"), 1)
+        self.assertEqual(metrics.get("slack_api_seconds", method="chat.postMessage").count, 1)
+        self.assertEqual(metrics.get("simbot_call_seconds", op="send_msg").count, 1)
+
+
+    def test_batch_overhead(self):
+        simbot = SimBot(token="xoxb-test", debug=True, metrics=Metrics())
+        # Deleting the progress message of a finished batch is slow.
+        simbot.slack_client = SlowSlackClient(delay=0.5, slow=lambda method, kwargs: method == "chat.delete",
+                                              unique_ts=True)
+        batch_a = simbot.get_user_("Batch A", 1, "finishes detached")
+        batch_b = simbot.get_user_("Batch B", 2, "keeps running")
+        batch_a.update("case_0")
+        future = batch_a.finish(detach=True)
+        batch_b.update("case_0")
+        future.result()
+        batch_b.update("case_1")
+        self.assertGreater(simbot.metrics.blocking_seconds, 0.5)
+
+        # The finish of batch A blocked, but only the calls of batch B count towards its overhead.
+        batch_b.finish()
+        summary = simbot.slack_client.calls[-1][1]["attachments"][0]
+        overhead = [field for field in summary["fields"] if field.get("title", "").startswith("Simbot overhead")]
+        self.assertLess(float(overhead[0]["value"].split()[0]), 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
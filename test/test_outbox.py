@@ -0,0 +1,104 @@
+import unittest
+import os
+import tempfile
+
+from slack_simbot.outbox import Outbox
+from slack_simbot.msg_handle import MsgHandle
+from slack_simbot.rate_limit import TokenBucket
+
+from fakes import FlakySlackClient
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "outbox.db")
+
+    def open(self, client, **kwargs):
+        outbox = Outbox(self.path, client.api_call, min_interval=0, rate_limit=TokenBucket(1000, 1000),
+                        backoff=0.01, **kwargs)
+        self.addCleanup(outbox.close)
+        return outbox
+
+    def test_calls_are_sent_in_order(self):
+        client = FlakySlackClient()
+        outbox = self.open(client)
+        handle_id = outbox.new_handle()
+        r = outbox.call("chat.postMessage", handle=handle_id, creates=True, channel="C1", text="start")
+        self.assertEqual(r["ts"], "1.0")
+
+        for i in range(10):
+            outbox.submit("chat.update", handle=handle_id, text=str(i))
+        outbox.submit("chat.delete", handle=handle_id)
+        self.assertTrue(outbox.flush(5))
+
+        methods = [method for method, _ in client.calls]
+        self.assertEqual(methods[0], "chat.postMessage")
+        self.assertEqual(methods[-1], "chat.delete")
+        updates = [kwargs for method, kwargs in client.calls if method == "chat.update"]
+        self.assertEqual(updates[-1], {"text": "9", "channel": "C1", "ts": "1.0"})
+        self.assertEqual(outbox.live_handles(), [])
+        self.assertEqual(outbox.pending(), 0)
+
+    def test_outage(self):
+        client = FlakySlackClient()
+        client.online.clear()
+        outbox = self.open(client)
+
+        handle_id = outbox.new_handle()
+        self.assertIsNone(outbox.call("chat.postMessage", handle=handle_id, creates=True, timeout=0.1,
+                                      channel="C1", text="start"))
+        handle = MsgHandle(None, "C1", outbox_id=handle_id)
+        outbox.bind(handle)
+        outbox.submit("chat.update", handle=handle_id, text="update")
+        self.assertFalse(outbox.flush(0.1))
+        self.assertGreater(outbox.n_retried, 0)
+
+        client.online.set()
+        outbox.backoff = outbox.max_backoff = 0.01
+        self.assertTrue(outbox.flush(5))
+        self.assertEqual(handle.ts, "1.0")
+        self.assertEqual([method for method, _ in client.calls], ["chat.postMessage", "chat.update"])
+
+    def test_replay_after_restart(self):
+        client = FlakySlackClient()
+        client.online.clear()
+        outbox = self.open(client)
+        handle_id = outbox.new_handle()
+        outbox.submit("chat.postMessage", handle=handle_id, creates=True, channel="C1", text="start")
+        outbox.submit("chat.update", handle=handle_id, text="update")
+        outbox.close()
+
+        client = FlakySlackClient()
+        outbox = self.open(client)
+        self.assertTrue(outbox.flush(5))
+        self.assertEqual([method for method, _ in client.calls], ["chat.postMessage", "chat.update"])
+        handle = outbox.message_handle(handle_id)
+        self.assertEqual((handle.channel, handle.ts), ("C1", "1.0"))
+        self.assertEqual(outbox.live_handles(), [handle_id])
+
+    def test_permanent_errors(self):
+        client = FlakySlackClient(error="channel_not_found")
+        outbox = self.open(client)
+        handle_id = outbox.new_handle()
+        r = outbox.call("chat.postMessage", handle=handle_id, creates=True, channel="C1", text="start")
+        self.assertEqual(r["error"], "channel_not_found")
+        outbox.submit("chat.update", handle=handle_id, text="update")
+        self.assertTrue(outbox.flush(5))
+        self.assertEqual([error for _, _, error in outbox.failed()],
+                         ["channel_not_found", "the message could not be posted"])
+
+    def test_existing_messages(self):
+        client = FlakySlackClient()
+        outbox = self.open(client)
+        handle = MsgHandle("5.0", "C2")
+        handle_id = outbox.handle_id(handle)
+        self.assertEqual(outbox.handle_id(MsgHandle("5.0", "C2")), handle_id)
+        outbox.submit("chat.delete", handle=handle_id)
+        self.assertTrue(outbox.flush(5))
+        self.assertEqual(client.calls, [("chat.delete", {"channel": "C2", "ts": "5.0"})])
+
+
+if __name__ == '__main__':
+    unittest.main()
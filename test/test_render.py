@@ -0,0 +1,43 @@
+import unittest
+import json
+
+from slack_simbot import SimBot
+from slack_simbot.metrics import Metrics
+from slack_simbot.render import BatchRenderer
+
+from fakes import RecordingSlackClient
+
+
+class TestRender(unittest.TestCase):
+    def test_templates(self):
+        renderer = BatchRenderer("Title", "Sweep {x} of {y}", 10)
+        text = renderer.progress("case_1", 1, "tbd", resources="cpu 100%")["attachments"][0]["text"]
+        self.assertEqual(text, "_Sweep {x} of {y}_\n*running* case_1\n*progress* 1/10\n*eta* tbd\n*resources* cpu 100%")
+        self.assertEqual(renderer.progress(None, 11, "tbd")["attachments"][0]["text"], "_Sweep {x} of {y}_\n*done*")
+        self.assertEqual(renderer.done("Uploading")["attachments"][0]["text"], "_Sweep {x} of {y}_\n*Done*\nUploading")
+
+    def test_blocks(self):
+        renderer = BatchRenderer("Title", "Sweep {x}", 10, blocks=True)
+        payload = renderer.progress("case_\"1\"", 1, "tbd")
+        self.assertNotIn("parse", payload)
+        header, section = json.loads(payload["blocks"])
+        self.assertEqual(header["text"]["text"], "*Title*\n_Sweep {x}_")
+        self.assertEqual(section["text"]["text"], "*running* case_\"1\"\n*progress* 1/10\n*eta* tbd")
+
+    def test_skips_unchanged_updates(self):
+        simbot = SimBot(token="xoxb-test", debug=True, metrics=Metrics())
+        simbot.slack_client = client = RecordingSlackClient()
+        batch = simbot.get_user_("Batch", 3, "skips", blocks=True)
+        batch.update("case_0")
+        for _ in range(5):
+            batch.update_done("Uploading results")
+        batch.update_done("Sending notification")
+
+        updates = [kwargs for method, kwargs in client.calls if method == "chat.update"]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(updates[1]["ts"], "1.0")
+        self.assertEqual(simbot.metrics.total("simbot_updates_skipped_total"), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from slack_simbot import SimBot
+from slack_simbot.resources import ResourceSampler, CasePeaks, format_bytes
+
+from fakes import RecordingSlackClient
+
+
+@unittest.skipUnless(os.path.exists("/proc/self/stat"), "needs /proc")
+class TestResourceSampler(unittest.TestCase):
+    def test_samples_children(self):
+        child = subprocess.Popen([sys.executable, "-c", "while True: pass"])
+        self.addCleanup(child.wait)
+        self.addCleanup(child.kill)
+
+        sampler = ResourceSampler(interval=0.05).start()
+        time.sleep(0.5)
+        sampler.close()
+
+        summary = sampler.summary()
+        self.assertGreater(summary.cpu, 20)
+        self.assertGreater(summary.rss_peak, 0)
+        self.assertGreaterEqual(summary.rss_peak, summary.rss)
+        self.assertIn("cpu", sampler.text())
+
+        cpu, rss = sampler.take_peak()
+        self.assertGreater(cpu, 20)
+        self.assertGreater(rss, 0)
+
+    def test_samples_off_calling_thread(self):
+        class RecordingSampler(ResourceSampler):
+            threads = []
+
+            def sample(self):
+                self.threads.append(threading.current_thread())
+                return super().sample()
+
+        sampler = RecordingSampler(interval=0.05).start()
+        time.sleep(0.2)
+        sampler.close()
+        self.assertGreater(len(sampler.threads), 1)
+        self.assertNotIn(threading.current_thread(), sampler.threads)
+
+    def test_batch_reports_resources(self):
+        simbot = SimBot(token="xoxb-test", debug=True)
+        simbot.slack_client = client = RecordingSlackClient()
+        batch = simbot.get_user_("Batch", 3, "resources",
+                                 resources=ResourceSampler(interval=0.05, metrics=simbot.metrics))
+        for i in range(3):
+            time.sleep(0.1)
+            batch.update("case_{}".format(i))
+        self.assertIn("*resources* cpu", client.calls[-1][1]["attachments"][0]["text"])
+
+        batch.finish()
+        self.assertIsNone(batch.resources._thread)
+        fields = client.calls[-1][1]["attachments"][0]["fields"]
+        titles = [field.get("title") for field in fields]
+        self.assertIn("Resources", titles)
+        self.assertIn("Peak cases", titles)
+
+
+class TestCasePeaks(unittest.TestCase):
+    def test_keeps_highest(self):
+        peaks = CasePeaks(n=2)
+        for i in range(100):
+            peaks.add("case_{}".format(i), cpu=i % 7, rss=i)
+        self.assertEqual([peak.case for peak in peaks.by_rss()], ["case_99", "case_98"])
+        self.assertEqual([peak.cpu for peak in peaks.by_cpu()], [6, 6])
+
+    def test_format_bytes(self):
+        self.assertEqual(format_bytes(512), "512 B")
+        self.assertEqual(format_bytes(1536), "1.5 KB")
+        self.assertEqual(format_bytes(3 * 1024 ** 3), "3.0 GB")
+
+
+if __name__ == '__main__':
+    unittest.main()
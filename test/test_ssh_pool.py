@@ -0,0 +1,117 @@
+import unittest
+import threading
+import time
+
+import paramiko
+
+from benchmarks.fake_sftp import FakeSFTPServer
+from slack_simbot import SimBot
+from slack_simbot.metrics import Metrics
+from slack_simbot.ssh_pool import SSHPool, get_pool, _pools
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+
+class FakeSSHClient:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+        self.transport.active = False
+
+
+class FakeSSHPool(SSHPool):
+    def __init__(self, **kwargs):
+        super().__init__("localhost", **kwargs)
+        self.n_connects = 0
+
+    def _connect(self):
+        self.n_connects += 1
+        return FakeSSHClient()
+
+
+class TestSSHPool(unittest.TestCase):
+    def test_connections_are_reused(self):
+        pool = FakeSSHPool()
+        with pool.connection() as a:
+            pass
+        with pool.connection() as b:
+            pass
+        self.assertIs(a, b)
+        self.assertEqual(pool.n_connects, 1)
+
+    def test_dead_connections_are_replaced(self):
+        pool = FakeSSHPool()
+        with pool.connection() as a:
+            pass
+        a.transport.active = False
+        with pool.connection() as b:
+            pass
+        self.assertIsNot(a, b)
+        self.assertTrue(a.closed)
+
+    def test_pool_is_bounded(self):
+        pool = FakeSSHPool(max_size=2)
+        in_use = []
+        max_in_use = [0]
+        lock = threading.Lock()
+
+        def target():
+            with pool.connection() as ssh_client:
+                with lock:
+                    in_use.append(ssh_client)
+                    max_in_use[0] = max(max_in_use[0], len(in_use))
+                time.sleep(0.01)
+                with lock:
+                    in_use.remove(ssh_client)
+
+        threads = [threading.Thread(target=target) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max_in_use[0], 2)
+        self.assertEqual(pool.n_connects, 2)
+
+    def test_acquire_timeout(self):
+        pool = FakeSSHPool(max_size=1)
+        pool.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.acquire(timeout=0.01)
+
+
+class TestGetPool(unittest.TestCase):
+    def test_settings_select_the_pool(self):
+        pool = get_pool("pool.example.com", username="u", password="a", max_size=2)
+        self.assertIs(get_pool("pool.example.com", username="u", max_size=2, password="a"), pool)
+        self.assertIsNot(get_pool("pool.example.com", username="u", password="b", max_size=2), pool)
+        self.assertIsNot(get_pool("pool.example.com", username="u", password="a", max_size=4), pool)
+        self.assertIs(get_pool("pool.example.com", username="u", key_filename=["k1", "k2"]),
+                      get_pool("pool.example.com", username="u", key_filename=["k1", "k2"]))
+
+    def test_failed_authentication_is_not_cached(self):
+        server = FakeSFTPServer(password="right")
+        self.addCleanup(server.close)
+        simbot = SimBot(token="xoxb-test", debug=True, metrics=Metrics())
+
+        with self.assertRaises(paramiko.AuthenticationException):
+            simbot._connect_ssh("127.0.0.1", username="test", password="wrong", port=server.port)
+        self.assertIsNone(simbot.ssh_pool)
+        self.assertNotIn("wrong", [pool.password for pool in _pools.values()])
+
+        pool = simbot._connect_ssh("127.0.0.1", username="test", password="right", port=server.port)
+        self.addCleanup(pool.close)
+        self.assertIs(simbot.ssh_pool, pool)
+        self.assertEqual(pool.password, "right")
@@ -0,0 +1,40 @@
+import unittest
+import subprocess
+import sys
+import os
+
+from slack_simbot import SimBot
+
+
+class TestStartup(unittest.TestCase):
+    def test_lazy_imports(self):
+        script = "import sys, slack_simbot; print(' '.join(sorted(set(sys.modules) & {})))".format(
+            {"slackclient", "paramiko", "scp", "asyncio", "slack_simbot.compression"})
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+        self.assertEqual(output.strip(), "")
+
+    def test_inactive(self):
+        simbot = SimBot(token="xoxb-test", active=False, outbox_path="unused.db")
+        self.assertIsNone(simbot.send_msg("Hello"))
+        self.assertEqual(simbot.api_call("chat.postMessage"), {"ok": False, "error": "inactive"})
+        self.assertEqual(simbot.get_users(), [])
+        self.assertEqual(simbot.mention("someone@example.com"), "@someone@example.com")
+        self.assertIsNone(simbot.dashboard())
+
+        batch = simbot.get_user_("Inactive", 2, "No messages")
+        self.assertIsNone(batch.ts)
+        batch.update("case_0")
+        batch.update("case_1", status="failed")
+        self.assertIsNone(batch.finish())
+        self.assertEqual((len(batch.cases), batch.cases.n_failed), (2, 1))
+
+        # Nothing was created to talk to slack.
+        self.assertIsNone(simbot._slack_client)
+        self.assertIsNone(simbot._dispatcher)
+        self.assertIsNone(simbot.outbox)
+        self.assertFalse(os.path.exists("unused.db"))
+
+
+if __name__ == '__main__':
+    unittest.main()
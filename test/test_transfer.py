@@ -0,0 +1,211 @@
+import unittest
+import importlib.util
+import io
+import os
+import time
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
+
+from benchmarks.fake_sftp import FakeSFTPServer
+from slack_simbot import SimBot
+from slack_simbot.metrics import Metrics
+from slack_simbot.ssh_pool import SSHPool
+from slack_simbot.transfer import BackgroundWriter, sync_directory
+
+from fakes import RecordingSlackClient
+
+
+class SlowFile(io.BytesIO):
+    def write(self, data):
+        time.sleep(0.001)
+        return super().write(data)
+
+
+class TestBackgroundWriter(unittest.TestCase):
+    def test_write(self):
+        data = [os.urandom(n) for n in range(0, 5000, 7)]
+        f = SlowFile()
+        with BackgroundWriter(f, block_size=1000, max_blocks=2) as writer:
+            for block in data:
+                writer.write(block)
+        self.assertEqual(f.getvalue(), b"".join(data))
+        self.assertEqual(writer.bytes_written, len(f.getvalue()))
+
+    def test_errors_are_raised(self):
+        class BrokenFile:
+            def write(self, data):
+                raise IOError("Connection lost")
+
+        writer = BackgroundWriter(BrokenFile(), block_size=10)
+        with self.assertRaises(IOError):
+            for _ in range(100):
+                writer.write(b"0123456789")
+                time.sleep(0.001)
+            writer.close()
+
+
+class LocalSFTP:
+    """Minimal stand-in for paramiko's SFTPClient working on the local file system."""
+
+    def __init__(self):
+        self.n_put = 0
+
+    def open(self, path, mode="r"):
+        f = open(path, mode)
+        f.set_pipelined = lambda pipelined: None
+        return f
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def mkdir(self, path):
+        os.mkdir(path)
+
+    def put(self, local_path, remote_path):
+        self.n_put += 1
+        shutil.copyfile(local_path, remote_path)
+
+    def posix_rename(self, old_path, new_path):
+        os.replace(old_path, new_path)
+
+    def remove(self, path):
+        os.remove(path)
+
+
+class TestSyncDirectory(unittest.TestCase):
+    def test_sync(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dir_path = os.path.join(tmp, "results")
+            remote_dir = os.path.join(tmp, "remote", "batch")
+            os.makedirs(os.path.join(dir_path, "sub"))
+            for i in range(10):
+                with open(os.path.join(dir_path, "sub" if i % 2 else "", "case_{}.csv".format(i)), "w") as f:
+                    f.write("case {}".format(i))
+
+            sftp = LocalSFTP()
+            report = sync_directory(sftp, dir_path, remote_dir)
+            self.assertTrue(report.ok)
+            self.assertEqual(len(report.uploaded), 10)
+            self.assertTrue(os.path.isfile(os.path.join(remote_dir, "index.html")))
+
+            # Recreate the results as a rerun would, changing a single file and removing another.
+            shutil.rmtree(dir_path)
+            os.makedirs(os.path.join(dir_path, "sub"))
+            for i in range(9):
+                with open(os.path.join(dir_path, "sub" if i % 2 else "", "case_{}.csv".format(i)), "w") as f:
+                    f.write("case {}".format(i) if i != 3 else "changed")
+
+            report = sync_directory(sftp, dir_path, remote_dir)
+            self.assertEqual(report.uploaded, ["sub/case_3.csv"])
+            self.assertEqual(report.removed, ["sub/case_9.csv"])
+            self.assertEqual(report.n_unchanged, 8)
+            with open(os.path.join(remote_dir, "files", "sub", "case_3.csv")) as f:
+                self.assertEqual(f.read(), "changed")
+            self.assertFalse(os.path.exists(os.path.join(remote_dir, "files", "sub", "case_9.csv")))
+
+
+class TestStreamUpload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeSFTPServer()
+        cls.pool = SSHPool("127.0.0.1", username="test", port=cls.server.port, password="x")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.server.close()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.dir_path = os.path.join(self.temp_dir, "results")
+        os.makedirs(os.path.join(self.dir_path, "sub"))
+        self.files = {}
+        for i in range(5):
+            arcname = "results/{}case_{}.bin".format("sub/" if i % 2 else "", i)
+            self.files[arcname] = os.urandom(1000 * i) + b"0" * 100000
+            with open(os.path.join(self.temp_dir, arcname), "wb") as f:
+                f.write(self.files[arcname])
+        self.remote_dir = os.path.join(self.temp_dir, "remote")
+        os.mkdir(self.remote_dir)
+        self.remote_path = os.path.join(self.remote_dir, "results.zip")
+        self.simbot = SimBot(token="xoxb-test", debug=True, metrics=Metrics())
+        self.simbot.ssh_pool = self.pool
+
+    def test_round_trip(self):
+        report = self.simbot.upload_archive(self.dir_path, self.remote_path, mode="stream", workers=1)
+        self.assertTrue(report.ok)
+        self.assertEqual(report.upload.bytes, os.path.getsize(self.remote_path))
+        # The '.part' file was renamed to the final name.
+        self.assertEqual(os.listdir(self.remote_dir), ["results.zip"])
+        with zipfile.ZipFile(self.remote_path) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual({name: zf.read(name) for name in self.files}, self.files)
+
+    def test_failed_compression_removes_part_file(self):
+        def visit(path, arcname, st):
+            if arcname.endswith("case_3.bin"):
+                raise IOError("Disk error")
+
+        with self.assertRaises(IOError):
+            self.simbot.upload_archive(self.dir_path, self.remote_path, mode="stream", workers=1, visit=visit)
+        self.assertEqual(os.listdir(self.remote_dir), [])
+
+
+class TestFailedUpload(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeSFTPServer()
+        cls.pool = SSHPool("127.0.0.1", username="test", port=cls.server.port, password="x")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.server.close()
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.dir_path = os.path.join(self.temp_dir, "results")
+        os.mkdir(self.dir_path)
+        with open(os.path.join(self.dir_path, "case_0.csv"), "w") as f:
+            f.write("0\n")
+        # The server rejects uploads into a directory that doesn't exist.
+        self.remote_dir = os.path.join(self.temp_dir, "missing")
+        # Without debug, failures are returned instead of raised.
+        self.simbot = SimBot(token="xoxb-test", debug=False, metrics=Metrics())
+        self.simbot.slack_client = self.client = RecordingSlackClient()
+        self.simbot.ssh_pool = self.pool
+
+    def test_batch_reports_failed_upload(self):
+        batch = self.simbot.get_user_("Batch", 1, "upload fails", result_dir=self.dir_path, clear_result_dir=False)
+        batch.update("case_0")
+        batch.finish(remote_path=self.remote_dir, url="http://localhost")
+
+        method, kwargs = self.client.calls[-1]
+        self.assertEqual(method, "chat.postMessage")
+        attachment = kwargs["attachments"][0]
+        self.assertIn("uploading the results failed", attachment["title"])
+        self.assertEqual(attachment["color"], "danger")
+        titles = [field.get("title") for field in attachment["fields"]]
+        self.assertNotIn("Download", titles)
+        self.assertIn("Upload failed", titles)
+        self.assertEqual(self.simbot.metrics.get("simbot_errors_total", op="upload", type="FileNotFoundError"), 1)
+
+    @unittest.skipUnless(importlib.util.find_spec("scp"), "needs scp")
+    def test_failed_copy_removes_archive(self):
+        # The fake server doesn't run scp, so the copy fails.
+        with self.assertRaises(Exception):
+            self.simbot._upload_archive(self.dir_path, os.path.join(self.temp_dir, "results.zip"), mode="file")
+        self.assertEqual(os.listdir(self.temp_dir), ["results"])
+
+    def test_upload_directory_not_announced(self):
+        with mock.patch.object(self.simbot, "_connect_ssh"):
+            result = self.simbot.upload_directory("Results", "upload fails", self.dir_path,
+                                                  remote_path=self.remote_dir)
+        # The guard returns the exception, and no message claims the directory was uploaded.
+        self.assertIsInstance(result, tuple)
+        self.assertEqual(self.client.messages(), [])
+
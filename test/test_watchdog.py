@@ -0,0 +1,93 @@
+import unittest
+import os
+import tempfile
+import threading
+import time
+
+from slack_simbot import SimBot
+from slack_simbot.watchdog import ThroughputHistory
+
+from fakes import RecordingSlackClient
+
+
+class TestWatchdog(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.history_path = os.path.join(temp_dir.name, "throughput.json")
+        self.simbot = SimBot(token="xoxb-test", debug=True, directory_path=os.path.join(temp_dir.name, "dir.json"))
+        self.simbot.slack_client = self.client = RecordingSlackClient(users=[
+            {"id": "U1", "name": "alice", "profile": {"email": "alice@example.com"}}])
+
+    def test_stall_and_recovery(self):
+        watchdog = self.simbot.watchdog(owner="alice@example.com", interval=3600, min_stall=10,
+                                        history_path=self.history_path)
+        self.addCleanup(watchdog.close)
+        batch = self.simbot.get_user_("Batch", 100, "stalls", watchdog=watchdog)
+        t0 = time.time()
+        for i in range(20):
+            batch.update("case_{}".format(i), start_time=t0 + i - 1, end_time=t0 + i)
+
+        self.assertEqual(watchdog.check(now=t0 + 25), [])
+        alerts = watchdog.check(now=t0 + 19 + 11)
+        self.assertEqual(len(alerts), 1)
+        self.assertIn("has stalled", alerts[0][2])
+        # Only reported once.
+        self.assertEqual(watchdog.check(now=t0 + 19 + 12), [])
+
+        watchdog.alert(*alerts[0])
+        self.assertEqual(self.client.messages(":warning:")[-1].split()[:2], [":warning:", "<@U1>"])
+
+        batch.update("case_20", end_time=t0 + 31)
+        alerts = watchdog.check(now=t0 + 32)
+        self.assertIn("continued", alerts[0][2])
+
+    def test_regression(self):
+        history = ThroughputHistory(self.history_path)
+        history.record("Batch", 10.)
+        watchdog = self.simbot.watchdog(interval=3600, history_path=self.history_path)
+        self.addCleanup(watchdog.close)
+        batch = self.simbot.get_user_("Batch", 100, "slow", watchdog=watchdog)
+        t0 = time.time()
+        for i in range(20):
+            batch.update("case_{}".format(i), start_time=t0 + i - 1, end_time=t0 + i)
+
+        alerts = watchdog.check(now=t0 + 20)
+        self.assertEqual(len(alerts), 1)
+        self.assertIn("of the usual 10 cases/s", alerts[0][2])
+
+        batch.finish()
+        self.assertAlmostEqual(ThroughputHistory(self.history_path).baseline("Batch"), (10. + 1.) / 2, delta=0.1)
+
+    def test_check_waits_for_batch(self):
+        watchdog = self.simbot.watchdog(interval=3600, history_path=self.history_path)
+        self.addCleanup(watchdog.close)
+        batch = self.simbot.get_user_("Batch", 100, "busy", watchdog=watchdog)
+        for i in range(20):
+            batch.update("case_{}".format(i))
+
+        # The estimator isn't read while a case is being recorded.
+        with batch._lock:
+            checker = threading.Thread(target=watchdog.check)
+            checker.start()
+            checker.join(0.1)
+            self.assertTrue(checker.is_alive())
+        checker.join(5)
+        self.assertFalse(checker.is_alive())
+
+    def test_background_check(self):
+        watchdog = self.simbot.watchdog(interval=0.05, min_stall=0.1, history_path=self.history_path)
+        self.addCleanup(watchdog.close)
+        batch = self.simbot.get_user_("Batch", 100, "hangs", watchdog=watchdog)
+        for i in range(10):
+            batch.update("case_{}".format(i))
+            time.sleep(0.01)
+
+        deadline = time.time() + 5
+        while not self.client.messages(":warning:") and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertIn("has stalled", self.client.messages(":warning:")[0])
+
+
+if __name__ == '__main__':
+    unittest.main()